@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding:utf-8 -*-
 # Author: kerlomz <kerlomz@gmail.com>
+import functools
+from types import MappingProxyType
+import numpy as np
 from exception import *
 from constants import SimpleCharset
 
@@ -221,5 +224,80 @@ def category_extract(param):
         )
 
 
+class CategoryTable(object):
+    """
+    类别集合对应的不可变编解码查找表，同一类别集合只构建一次
+    """
+    def __init__(self, categories):
+        self.categories = tuple(categories)
+        self.category_num = len(self.categories)
+        self.encode_map = MappingProxyType({category: i for i, category in enumerate(self.categories, 0)})
+        self.decode_map = MappingProxyType({i: category for i, category in enumerate(self.categories, 0)})
+        # 末尾追加两个空字符：CTC补齐值category_num与-1均解码为空
+        self.decode_array = np.asarray(list(self.categories) + ['', ''])
+        self.decode_array.setflags(write=False)
+        self.codepoint_table = self._codepoint_table()
+
+    def _codepoint_table(self):
+        """全部为单字符类别时，构建 Unicode码位 -> 编码 的数组，用于整串向量化编码"""
+        chars = [category for category in self.categories if category]
+        if not chars or any(len(category) != 1 for category in chars):
+            return None
+        table = np.full(max([ord(char) for char in chars]) + 1, -1, dtype=np.int32)
+        for char, index in self.encode_map.items():
+            if char:
+                table[ord(char)] = index
+        table.setflags(write=False)
+        return table
+
+    def encode(self, labels) -> np.ndarray:
+        """
+        标签编码：str(单字符类别) 或 类别列表 -> int32数组
+        :raise KeyError: 标签包含类别集合以外的字符，异常参数为该字符
+        """
+        if isinstance(labels, str) and self.codepoint_table is not None:
+            codepoints = np.frombuffer(labels.encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+            valid = codepoints < len(self.codepoint_table)
+            encoded = np.full(len(codepoints), -1, dtype=np.int32)
+            encoded[valid] = self.codepoint_table[codepoints[valid]]
+            if (encoded < 0).any():
+                raise KeyError(labels[int(np.argmax(encoded < 0))])
+            return encoded
+        return np.fromiter((self.encode_map[i] for i in labels), dtype=np.int32, count=len(labels))
+
+    def decode(self, indices) -> str:
+        """标签解码：int数组 -> str，忽略-1与category_num"""
+        return "".join(self.decode_array[np.asarray(indices, dtype=np.int64).reshape(-1)].tolist())
+
+    def decode_batch(self, dense_decoded, output_split=None) -> list:
+        """
+        批量解码：dense_decoded int矩阵 [N, T] -> N个字符串
+        整批经查找表映射，-1与category_num映射为空字符，Python层仅逐行拼接一次
+        :param dense_decoded: 一维输入视为单个样本
+        :param output_split: 可选，字符之间的分隔符(OutputSplit)，空字符不参与分隔
+        """
+        codes = np.asarray(dense_decoded, dtype=np.int64)
+        if codes.ndim != 2:
+            codes = codes.reshape(1, -1) if codes.ndim < 2 else codes.reshape(codes.shape[0], -1)
+        chars = self.decode_array[codes].tolist()
+        if not output_split:
+            return ["".join(row) for row in chars]
+        return [output_split.join(filter(None, row)) for row in chars]
+
+
+@functools.lru_cache(maxsize=None)
+def _category_table(categories: tuple) -> CategoryTable:
+    return CategoryTable(categories)
+
+
+def category_table(source) -> CategoryTable:
+    """获取类别集合对应的缓存查找表"""
+    return _category_table(tuple(source))
+
+
 def encode_maps(source):
-    return {category: i for i, category in enumerate(source, 0)}
+    return category_table(source).encode_map
+
+
+def decode_maps(source):
+    return category_table(source).decode_map
@@ -70,6 +70,12 @@ LOSS_FUNC_MAP = {
     'CrossEntropy': LossFunction.CrossEntropy
 }
 
+DECODER_MAP = {
+    'CTC': DecoderType.CTC,
+    'BeamSearch': DecoderType.BeamSearch,
+    'CrossEntropy': DecoderType.CrossEntropy
+}
+
 RESIZE_MAP = {
     LossFunction.CTC: lambda x, y: [None, y],
     LossFunction.CrossEntropy: lambda x, y: [x, y]
@@ -81,6 +87,25 @@ LABEL_FROM_MAP = {
     'FileName': LabelFrom.FileName,
 }
 
+INPUT_PIPELINE_MAP = {
+    'Feed': InputPipeline.Feed,
+    'Graph': InputPipeline.Graph,
+    'Tensor': InputPipeline.Tensor,
+    'Memmap': InputPipeline.Memmap,
+}
+
+VALIDATION_MODE_MAP = {
+    'Batch': ValidationMode.Batch,
+    'Full': ValidationMode.Full,
+    'Async': ValidationMode.Async,
+}
+
+EXPORT_INPUT_MAP = {
+    'Tensor': ExportInput.Tensor,
+    'Bytes': ExportInput.Bytes,
+    'UInt8': ExportInput.UInt8,
+}
+
 EXCEPT_FORMAT_MAP = {
     ModelField.Image: 'png',
     ModelField.Text: 'csv'
@@ -112,6 +137,7 @@ class ModelConfig:
     """SYSTEM"""
     system_root: dict
     memory_usage: float
+    workers: int
     save_model: str
     save_checkpoint: str
 
@@ -136,6 +162,8 @@ class ModelConfig:
     output_layer: dict
     loss_func_param: str
     decoder: str
+    beam_width: int
+    decode_charset: list
 
     """LABEL"""
     label_root: dict
@@ -164,6 +192,17 @@ class ModelConfig:
     trains_learning_rate: float
     batch_size: int
     validation_batch_size: int
+    input_pipeline_param: str
+    prefetch_depth: int
+    bucket_width: int
+    uint8_input_param: bool
+    staging: bool
+    batch_encoding: bool
+    validation_mode_param: str
+    quantized_export: bool
+    export_input_param: str
+    calibration_set_num: int
+    trains_end_cer: float
 
     """DATA AUGMENTATION"""
     data_augmentation_root: dict
@@ -179,10 +218,15 @@ class ModelConfig:
     """COMPILE_MODEL"""
     compile_model_path: str
 
-    def __init__(self, project_name, project_path=None, **argv):
+    def __init__(self, project_name, project_path=None, model_conf_path=None, **argv):
+        """
+        :param model_conf_path: 可选，指定读取的配置文件，如compile_graph导出的 out/model/<ModelName>_model.yaml
+        """
         self.project_path = project_path if project_path else "./projects/{}".format(project_name)
         self.model_root_path = os.path.join(self.project_path, 'model')
-        self.model_conf_path = os.path.join(self.project_path, MODEL_CONFIG_NAME)
+        self.model_conf_path = model_conf_path if model_conf_path else os.path.join(self.project_path, MODEL_CONFIG_NAME)
+        # 导出的配置仅用于推理，不改写工程的检查点索引
+        self.compiled = model_conf_path is not None
         self.output_path = os.path.join(self.project_path, 'out')
         self.dataset_root_path = os.path.join(self.project_path, 'dataset')
         self.checkpoint_tag = 'checkpoint'
@@ -216,6 +260,8 @@ class ModelConfig:
         """SYSTEM"""
         self.system_root = self.conf['System']
         self.memory_usage = self.system_root.get('MemoryUsage')
+        self.workers = self.system_root.get('Workers')
+        self.workers = self.workers if self.workers else 0
         self.save_model = os.path.join(self.model_root_path, self.model_tag)
         self.save_checkpoint = os.path.join(self.model_root_path, self.checkpoint_tag)
 
@@ -247,6 +293,9 @@ class ModelConfig:
         self.loss_func_param = self.output_layer.get('LossFunction')
 
         self.decoder = self.output_layer.get('Decoder')
+        self.beam_width = self.output_layer.get('BeamWidth')
+        self.beam_width = self.beam_width if self.beam_width else 10
+        self.decode_charset = self.output_layer.get('DecodeCharset')
 
         """LABEL"""
         self.label_root = self.conf.get('Label')
@@ -277,11 +326,25 @@ class ModelConfig:
         self.trains_end_cost = self.trains_end_cost if self.trains_end_cost else 1
         self.trains_end_epochs = self.trains_root.get('EndEpochs')
         self.trains_end_epochs = self.trains_end_epochs if self.trains_end_epochs else 2
+        self.trains_end_cer = self.trains_root.get('EndCER')
         self.trains_learning_rate = self.trains_root.get('LearningRate')
         self.batch_size = self.trains_root.get('BatchSize')
         self.batch_size = self.batch_size if self.batch_size else 64
         self.validation_batch_size = self.trains_root.get('ValidationBatchSize')
         self.validation_batch_size = self.validation_batch_size if self.validation_batch_size else 300
+        self.input_pipeline_param = self.trains_root.get('InputPipeline')
+        self.prefetch_depth = self.trains_root.get('PrefetchDepth')
+        self.prefetch_depth = self.prefetch_depth if self.prefetch_depth is not None else 2
+        self.bucket_width = self.trains_root.get('BucketWidth')
+        self.bucket_width = self.bucket_width if self.bucket_width else -1
+        self.uint8_input_param = self.trains_root.get('UInt8Input')
+        self.staging = bool(self.trains_root.get('Staging'))
+        self.batch_encoding = bool(self.trains_root.get('BatchEncoding'))
+        self.validation_mode_param = self.trains_root.get('ValidationMode')
+        self.quantized_export = bool(self.trains_root.get('QuantizedExport'))
+        self.export_input_param = self.trains_root.get('ExportInput')
+        self.calibration_set_num = self.trains_root.get('CalibrationSetNum')
+        self.calibration_set_num = self.calibration_set_num if self.calibration_set_num else 200
 
         """DATA AUGMENTATION"""
         self.data_augmentation_root = self.conf['DataAugmentation']
@@ -353,6 +416,81 @@ class ModelConfig:
             code=ConfigException.LOSS_FUNC_NOT_SUPPORTED,
         )
 
+    @property
+    def input_pipeline(self) -> InputPipeline:
+        return ModelConfig.param_convert(
+            source=self.input_pipeline_param,
+            param_map=INPUT_PIPELINE_MAP,
+            text="This type of input pipeline ({ip}) is not supported at this time.".format(
+                ip=self.input_pipeline_param
+            ),
+            code=ConfigException.INPUT_PIPELINE_NOT_SUPPORTED,
+            default=InputPipeline.Feed
+        )
+
+    @property
+    def validation_mode(self) -> ValidationMode:
+        return ModelConfig.param_convert(
+            source=self.validation_mode_param,
+            param_map=VALIDATION_MODE_MAP,
+            text="This type of validation mode ({vm}) is not supported at this time.".format(
+                vm=self.validation_mode_param
+            ),
+            code=ConfigException.VALIDATION_MODE_NOT_SUPPORTED,
+            default=ValidationMode.Batch
+        )
+
+    @property
+    def decoder_type(self) -> DecoderType:
+        return ModelConfig.param_convert(
+            source=self.decoder,
+            param_map=DECODER_MAP,
+            text="This type of decoder ({decoder}) is not supported at this time.".format(decoder=self.decoder),
+            code=ConfigException.DECODER_NOT_SUPPORTED,
+            default=DecoderType.CTC if self.loss_func == LossFunction.CTC else DecoderType.CrossEntropy
+        )
+
+    @property
+    def decode_charset_index(self) -> list:
+        """DecodeCharset对应的类别序号，未配置时为None"""
+        if not self.decode_charset:
+            return None
+        encode_map = self.category_table.encode_map
+        unknown = [char for char in self.decode_charset if char not in encode_map]
+        if unknown:
+            exception(
+                "DecodeCharset contains characters that are not in the category: {}".format(unknown),
+                ConfigException.DECODE_CHARSET_ERROR
+            )
+        return [encode_map[char] for char in self.decode_charset]
+
+    @property
+    def export_input(self) -> ExportInput:
+        return ModelConfig.param_convert(
+            source=self.export_input_param,
+            param_map=EXPORT_INPUT_MAP,
+            text="This type of export input ({ei}) is not supported at this time.".format(
+                ei=self.export_input_param
+            ),
+            code=ConfigException.EXPORT_INPUT_NOT_SUPPORTED,
+            default=ExportInput.Tensor
+        )
+
+    @property
+    def uint8_input(self) -> bool:
+        """
+        训练时图片是否以uint8传输到计算图，由网络的第一个操作转换并归一化
+        预解码的输入管道(Tensor/Memmap)与图内管道(Graph)默认启用，
+        Feed与Graph仅支持固定尺寸，不定宽时主机端的全量评估(iter_all)仍输出归一化的float32
+        """
+        if self.model_field != ModelField.Image:
+            return False
+        if self.input_pipeline in [InputPipeline.Feed, InputPipeline.Graph] and self.resize[0] == -1:
+            return False
+        if self.uint8_input_param is None:
+            return self.input_pipeline in [InputPipeline.Tensor, InputPipeline.Memmap, InputPipeline.Graph]
+        return bool(self.uint8_input_param)
+
     @property
     def label_from(self) -> LabelFrom:
         return ModelConfig.param_convert(
@@ -367,10 +505,23 @@ class ModelConfig:
         category_value = category_extract(self.category_param)
         return SPACE_TOKEN + category_value
 
+    @property
+    def category_table(self) -> CategoryTable:
+        """当前类别集合的缓存编解码查找表"""
+        return category_table(self.category)
+
     @property
     def category_num(self) -> int:
         return len(self.category)
 
+    @property
+    def max_resize_width(self) -> int:
+        """缩放后的最大宽度，不定宽时按配置的原图宽高比留出余量估计"""
+        if self.resize[0] != -1:
+            return self.resize[0]
+        ratio = self.image_width / self.image_height if self.image_width and self.image_height else 4
+        return int(self.resize[1] * ratio * 1.5)
+
     @staticmethod
     def param_convert(source, param_map: dict, text, code, default=None):
         if source is None:
@@ -389,6 +540,14 @@ class ModelConfig:
                     MODEL_CONFIG_NAME
                 ), ConfigException.MODEL_CONFIG_PATH_NOT_EXIST
             )
+        if self.compiled:
+            return
+        if self.input_pipeline == InputPipeline.Tensor and self.resize[0] == -1:
+            exception(
+                'The Tensor input pipeline requires a fixed Resize, got {}. '
+                'Use the Memmap input pipeline for variable width.'.format(self.resize),
+                ConfigException.INPUT_PIPELINE_NOT_SUPPORTED
+            )
         if not os.path.exists(self.model_root_path):
             os.makedirs(self.model_root_path)
 
@@ -437,12 +596,15 @@ class ModelConfig:
             base_config = "".join(f.readlines())
             model = base_config.format(
                 MemoryUsage=self.memory_usage,
+                Workers=self.workers,
                 CNNNetwork=self.neu_cnn.value,
                 RecurrentNetwork=self.val_filter(self.neu_recurrent_param),
                 UnitsNum=self.units_num,
                 Optimizer=self.neu_optimizer.value,
                 LossFunction=self.loss_func.value,
                 Decoder=self.decoder,
+                BeamWidth=self.beam_width,
+                DecodeCharset=json.dumps(self.decode_charset, ensure_ascii=False),
                 ModelName=model_name if model_name else self.model_name,
                 ModelField=self.model_field.value,
                 ModelScene=self.model_scene.value,
@@ -468,9 +630,20 @@ class ModelConfig:
                 EndAcc=self.trains_end_acc,
                 EndCost=self.trains_end_cost,
                 EndEpochs=self.trains_end_epochs,
+                EndCER=self.val_filter(self.trains_end_cer),
                 BatchSize=self.batch_size,
                 ValidationBatchSize=self.validation_batch_size,
                 LearningRate=self.trains_learning_rate,
+                InputPipeline=self.input_pipeline.value,
+                PrefetchDepth=self.prefetch_depth,
+                BucketWidth=self.bucket_width,
+                UInt8Input=self.val_filter(self.uint8_input_param),
+                Staging=self.staging,
+                BatchEncoding=self.batch_encoding,
+                ValidationMode=self.validation_mode.value,
+                QuantizedExport=self.quantized_export,
+                ExportInput=self.export_input.value,
+                CalibrationSetNum=self.calibration_set_num,
                 Binaryzation=self.binaryzation,
                 MedianBlur=self.median_blur,
                 GaussianBlur=self.gaussian_blur,
@@ -494,7 +667,11 @@ class ModelConfig:
         dataset_group = os.listdir(self.dataset_root_path)
         if len(dataset_group) < 1:
             return None
+        # 仅统计形如 Trains.0.tfrecords 的数据集文件，忽略索引等附属文件
         name_split = [i.split(".") for i in dataset_group if mode.value in i]
+        name_split = [i for i in name_split if len(i) == 3 and i[1].isdigit()]
+        if not name_split:
+            return None
         last_index = max([int(i[1]) for i in name_split])
         current_index = last_index + 1
         name_prefix = name_split[0][0]
@@ -503,12 +680,15 @@ class ModelConfig:
 
     def new(self, **argv):
         self.memory_usage = argv.get('MemoryUsage')
+        self.workers = argv.get('Workers') if argv.get('Workers') else 0
         self.neu_cnn_param = argv.get('CNNNetwork')
         self.neu_recurrent_param = argv.get('RecurrentNetwork')
         self.units_num = argv.get('UnitsNum')
         self.neu_optimizer_param = argv.get('Optimizer')
         self.loss_func_param = argv.get('LossFunction')
         self.decoder = argv.get('Decoder')
+        self.beam_width = argv.get('BeamWidth') if argv.get('BeamWidth') else 10
+        self.decode_charset = argv.get('DecodeCharset')
         self.model_name = argv.get('ModelName')
         self.model_field_param = argv.get('ModelField')
         self.model_scene_param = argv.get('ModelScene')
@@ -539,9 +719,20 @@ class ModelConfig:
         self.trains_end_acc = argv.get('EndAcc')
         self.trains_end_cost = argv.get('EndCost')
         self.trains_end_epochs = argv.get('EndEpochs')
+        self.trains_end_cer = argv.get('EndCER')
         self.batch_size = argv.get('BatchSize')
         self.validation_batch_size = argv.get('ValidationBatchSize')
         self.trains_learning_rate = argv.get('LearningRate')
+        self.input_pipeline_param = argv.get('InputPipeline')
+        self.prefetch_depth = argv.get('PrefetchDepth') if argv.get('PrefetchDepth') is not None else 2
+        self.bucket_width = argv.get('BucketWidth') if argv.get('BucketWidth') else -1
+        self.uint8_input_param = argv.get('UInt8Input')
+        self.staging = bool(argv.get('Staging'))
+        self.batch_encoding = bool(argv.get('BatchEncoding'))
+        self.validation_mode_param = argv.get('ValidationMode')
+        self.quantized_export = bool(argv.get('QuantizedExport'))
+        self.export_input_param = argv.get('ExportInput')
+        self.calibration_set_num = argv.get('CalibrationSetNum') if argv.get('CalibrationSetNum') else 200
         self.binaryzation = argv.get('Binaryzation')
         self.median_blur = argv.get('MedianBlur')
         self.gaussian_blur = argv.get('GaussianBlur')
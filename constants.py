@@ -11,6 +11,31 @@ class DatasetType(Enum):
     TFRecords = 'TFRecords'
 
 
+@unique
+class InputPipeline(Enum):
+    """输入管道枚举"""
+    Feed = 'Feed'
+    Graph = 'Graph'
+    Tensor = 'Tensor'
+    Memmap = 'Memmap'
+
+
+@unique
+class ExportInput(Enum):
+    """导出模型的输入枚举"""
+    Tensor = 'Tensor'
+    Bytes = 'Bytes'
+    UInt8 = 'UInt8'
+
+
+@unique
+class ValidationMode(Enum):
+    """验证方式枚举"""
+    Batch = 'Batch'
+    Full = 'Full'
+    Async = 'Async'
+
+
 @unique
 class LabelFrom(Enum):
     """标签来源枚举"""
@@ -26,6 +51,14 @@ class LossFunction(Enum):
     CTC = 'CTC'
 
 
+@unique
+class DecoderType(Enum):
+    """解码器枚举，CTC为贪心解码"""
+    CTC = 'CTC'
+    BeamSearch = 'BeamSearch'
+    CrossEntropy = 'CrossEntropy'
+
+
 @unique
 class ModelScene(Enum):
     """模型场景枚举"""
@@ -22,17 +22,53 @@ class NeuralNetwork(object):
     """
     神经网络构建类
     """
-    def __init__(self, model_conf: ModelConfig, mode: RunMode, cnn: CNNNetwork, recurrent: RecurrentNetwork):
+    def __init__(self, model_conf: ModelConfig, mode: RunMode, cnn: CNNNetwork, recurrent: RecurrentNetwork,
+                 inputs=None, labels=None, staging=False):
+        """
+        :param inputs: 可选，来自tf.data迭代器的输入张量，缺省时构建名为input的占位符
+        :param labels: 可选，来自tf.data迭代器的稀疏标签张量，缺省时构建名为labels的占位符
+        :param staging: 是否经由StagingArea读取输入，训练步在计算当前批次的同时预先放入下一个批次
+        """
         self.model_conf = model_conf
         self.mode = mode
         self.decoder = Decoder(self.model_conf)
         self.utils = NetworkUtils(mode)
         self.network = cnn
         self.recurrent = recurrent
-        self.inputs = tf.keras.Input(dtype=tf.float32, shape=self.input_shape, name='input')
-        self.labels = tf.keras.Input(dtype=tf.int32, shape=[None], sparse=True, name='labels')
+        if inputs is None:
+            # 训练与评估时可使用uint8输入占位符，导出的预测图仍为float32输入
+            dtype = tf.uint8 if mode != RunMode.Predict and model_conf.uint8_input else tf.float32
+            inputs = tf.keras.Input(dtype=dtype, shape=self.input_shape, name='input')
+        if labels is None:
+            labels = tf.keras.Input(dtype=tf.int32, shape=[None], sparse=True, name='labels')
+        # 训练批次feed的目标，启用StagingArea时为放入暂存区的输入
+        self.feed_inputs = inputs
+        self.feed_labels = labels
+        self.inputs = inputs
+        self.labels = labels
+        self.stage_op = None
+        if staging:
+            self._build_staging()
         self.merged_summary = None
 
+    def _build_staging(self):
+        """
+        输入与稀疏标签经由StagingArea传入网络，每个训练步同时运行stage_op放入下一个批次，
+        GPU版本中暂存区位于显存，相当于prefetch-to-device，主机到显存的拷贝与计算重叠
+        验证时可直接feed暂存区的输出，不消耗暂存的批次
+        """
+        device = '/device:GPU:0' if tf.test.is_built_with_cuda() else '/cpu:0'
+        with tf.device(device):
+            area = tf.contrib.staging.StagingArea(
+                dtypes=[self.inputs.dtype, tf.int64, self.labels.values.dtype, tf.int64],
+                shapes=[self.inputs.shape, [None, 2], [None], [2]],
+                name='staging_area'
+            )
+            self.stage_op = area.put([self.inputs, self.labels.indices, self.labels.values, self.labels.dense_shape])
+            inputs, indices, values, dense_shape = area.get()
+        self.inputs = inputs
+        self.labels = tf.SparseTensor(indices=indices, values=values, dense_shape=dense_shape)
+
     @property
     def input_shape(self):
         """
@@ -46,23 +82,31 @@ class NeuralNetwork(object):
         self._build_train_op()
         self.merged_summary = tf.compat.v1.summary.merge_all()
 
+    def normalize_inputs(self):
+        """uint8输入在网络的第一个操作中转换为float32并归一化，float32输入已在编码时归一化"""
+        if self.inputs.dtype == tf.uint8:
+            return tf.math.divide(tf.cast(self.inputs, tf.float32), 255., name='normalize')
+        return self.inputs
+
     def _build_model(self):
 
+        inputs = self.normalize_inputs()
+
         """选择采用哪种卷积网络"""
         if self.network == CNNNetwork.CNN5:
-            x = CNN5(model_conf=self.model_conf, inputs=self.inputs, utils=self.utils).build()
+            x = CNN5(model_conf=self.model_conf, inputs=inputs, utils=self.utils).build()
 
         elif self.network == CNNNetwork.CNNX:
-            x = CNNX(model_conf=self.model_conf, inputs=self.inputs, utils=self.utils).build()
+            x = CNNX(model_conf=self.model_conf, inputs=inputs, utils=self.utils).build()
 
         elif self.network == CNNNetwork.ResNetTiny:
-            x = ResNetTiny(model_conf=self.model_conf, inputs=self.inputs, utils=self.utils).build()
+            x = ResNetTiny(model_conf=self.model_conf, inputs=inputs, utils=self.utils).build()
 
         elif self.network == CNNNetwork.ResNet50:
-            x = ResNet50(model_conf=self.model_conf, inputs=self.inputs, utils=self.utils).build()
+            x = ResNet50(model_conf=self.model_conf, inputs=inputs, utils=self.utils).build()
 
         elif self.network == CNNNetwork.DenseNet:
-            x = DenseNet(model_conf=self.model_conf, inputs=self.inputs, utils=self.utils).build()
+            x = DenseNet(model_conf=self.model_conf, inputs=inputs, utils=self.utils).build()
 
         else:
             raise ValueError('This cnn neural network is not supported at this time.')
@@ -203,6 +247,36 @@ class NeuralNetwork(object):
                 inputs=self.outputs
             )
 
+        self._build_metrics()
+
+    def ignore_to_sparse(self, dense):
+        """密集序列转为稀疏序列，忽略值与Validation一致：-1、category_num与0"""
+        dense = tf.cast(dense, tf.int64)
+        mask = tf.logical_and(
+            tf.logical_and(tf.not_equal(dense, -1), tf.not_equal(dense, self.model_conf.category_num)),
+            tf.not_equal(dense, 0)
+        )
+        indices = tf.where(mask)
+        return tf.SparseTensor(
+            indices=indices,
+            values=tf.gather_nd(dense, indices),
+            dense_shape=tf.shape(dense, out_type=tf.int64)
+        )
+
+    def _build_metrics(self):
+        """
+        图内字符错误率：当前批次预测与标签的编辑距离之和 / 标签字符总数，无需主机端解码
+        不注册为summary，以免merged_summary使每个训练步都运行解码，仅在验证时获取
+        """
+        with tf.name_scope('metrics'):
+            hypothesis = self.ignore_to_sparse(self.dense_decoded)
+            truth = self.ignore_to_sparse(tf.sparse.to_dense(self.labels, default_value=-1))
+            distance = tf.edit_distance(hypothesis, truth, normalize=False)
+            self.edit_distance = tf.reduce_mean(distance, name='edit_distance')
+            self.cer = tf.math.divide_no_nan(
+                tf.reduce_sum(distance), tf.cast(tf.size(truth.values), tf.float32), name='cer'
+            )
+
 
 if __name__ == '__main__':
     # GraphOCR(RunMode.Trains, CNNNetwork.CNN5, RecurrentNetwork.GRU).build_graph()
@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding:utf-8 -*-
 # Author: kerlomz <kerlomz@gmail.com>
+import numpy as np
 import tensorflow as tf
-from config import ModelConfig
+from config import ModelConfig, DecoderType
 
 
 class Decoder:
@@ -14,13 +15,59 @@ class Decoder:
         self.category_num = self.model_conf.category_num
 
     def ctc(self, inputs, sequence_length):
-        """针对CTC Loss的解码"""
+        """针对CTC Loss的解码，Decoder为BeamSearch时使用束搜索，否则为贪心解码"""
+        inputs = self.constrain_charset(inputs)
+        if self.model_conf.decoder_type == DecoderType.BeamSearch:
+            return self.ctc_beam_search(inputs, sequence_length)
         ctc_decode, _ = tf.nn.ctc_greedy_decoder(inputs, sequence_length)
         decoded_sequences = tf.sparse.to_dense(ctc_decode[0], default_value=self.category_num, name='dense_decoded')
         return decoded_sequences
 
+    def constrain_charset(self, inputs):
+        """DecodeCharset以外的类别的logits减去一个极大值，解码时不会被选中，空白类与补齐类不受影响"""
+        charset_index = self.model_conf.decode_charset_index
+        if not charset_index:
+            return inputs
+        mask = np.full(self.category_num + 2, -1e9, dtype=np.float32)
+        mask[charset_index] = 0
+        mask[self.category_num:] = 0
+        return inputs + tf.constant(mask)
+
+    def ctc_beam_search(self, inputs, sequence_length):
+        """
+        CTC束搜索解码，MaxLabelNum为定长时保留前BeamWidth条路径，
+        逐样本选取概率最高的长度等于MaxLabelNum的路径，均不满足时取概率最高的路径
+        """
+        beam_width = self.model_conf.beam_width
+        max_label_num = self.model_conf.max_label_num
+        fixed_length = max_label_num if max_label_num and max_label_num > 0 else None
+        top_paths = beam_width if fixed_length else 1
+        ctc_decode, _ = tf.nn.ctc_beam_search_decoder_v2(
+            inputs, sequence_length, beam_width=beam_width, top_paths=top_paths
+        )
+        if top_paths == 1:
+            return tf.sparse.to_dense(ctc_decode[0], default_value=self.category_num, name='dense_decoded')
+
+        paths = [tf.sparse.to_dense(path, default_value=self.category_num) for path in ctc_decode]
+        width = tf.reduce_max([tf.shape(path)[1] for path in paths])
+        # [top_paths, N, width]
+        paths = tf.stack([
+            tf.pad(path, [[0, 0], [0, width - tf.shape(path)[1]]], constant_values=self.category_num)
+            for path in paths
+        ])
+        lengths = tf.reduce_sum(tf.cast(tf.not_equal(paths, self.category_num), tf.int32), axis=2)
+        matched = tf.equal(lengths, fixed_length)
+        # 路径按概率降序排列，以递减的权重取第一条满足长度的路径
+        rank = tf.range(top_paths, 0, -1)[:, tf.newaxis] * tf.cast(matched, tf.int32)
+        choice = tf.where(
+            tf.reduce_any(matched, axis=0),
+            tf.argmax(rank, axis=0, output_type=tf.int32),
+            tf.zeros([tf.shape(paths)[1]], dtype=tf.int32)
+        )
+        index = tf.stack([choice, tf.range(tf.shape(paths)[1])], axis=1)
+        return tf.gather_nd(paths, index, name='dense_decoded')
+
     @staticmethod
     def cross_entropy(inputs):
         """针对CrossEntropy Loss的解码"""
         return tf.argmax(inputs, 2, name='dense_decoded')
-
@@ -9,10 +9,9 @@ import PIL.Image
 import numpy as np
 import tensorflow as tf
 from exception import *
-from constants import RunMode
+from constants import RunMode, ExportInput
 from config import ModelConfig, LabelFrom, LossFunction
-from category import encode_maps
-from pretreatment import preprocessing
+from pretreatment import preprocessing, batch_preprocessing, tensor_preprocessing
 
 
 class Encoder(object):
@@ -23,9 +22,45 @@ class Encoder(object):
         self.model_conf = model_conf
         self.mode = mode
         self.category_param = self.model_conf.category_param
+        self.category_table = self.model_conf.category_table
 
-    def image(self, path_or_bytes):
-        """针对图片类型的输入的编码"""
+    def image(self, path_or_bytes, raw=False):
+        """
+        针对图片类型的输入的编码
+        :param raw: 为True时跳过数据增广与归一化，返回缩放后的uint8 [H, W(, C)]
+        """
+        im = self.decode_image(path_or_bytes)
+        size = im.shape[1], im.shape[0]
+        if raw:
+            pass
+        elif self.mode == RunMode.Trains and bool(random.getrandbits(1)):
+            im = self.preprocessing(im).astype(np.float32)
+
+        else:
+            im = im.astype(np.float32)
+        if self.model_conf.resize[0] == -1:
+            # random_ratio = random.choice([2.5, 3, 3.5, 3.2, 2.7, 2.75])
+            ratio = self.model_conf.resize[1] / size[1]
+            # random_width = int(random_ratio * RESIZE[1])
+            resize_width = int(ratio * size[0])
+            # resize_width = random_width if is_random else resize_width
+            im = cv2.resize(im, (resize_width, self.model_conf.resize[1]))
+        else:
+            im = cv2.resize(im, (self.model_conf.resize[0], self.model_conf.resize[1]))
+        if raw:
+            return im
+        im = im.swapaxes(0, 1)
+
+        if self.model_conf.image_channel == 1:
+            return np.array((im[:, :, np.newaxis]) / 255.)
+        else:
+            return np.array(im[:, :]) / 255.
+
+    def decode_image(self, path_or_bytes):
+        """
+        解码图片并转换为配置的通道数，不缩放，供image_batch先增广后缩放
+        :return: uint8 [H, W(, C)]
+        """
         # im = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
         # The OpenCV cannot handle gif format images, it will return None.
         # if im is None:
@@ -43,10 +78,114 @@ class Encoder(object):
         if self.model_conf.image_channel == 1:
             pil_image = pil_image.convert('L')
 
-        im = np.array(pil_image)
-        if self.mode == RunMode.Trains and bool(random.getrandbits(1)):
-            im = preprocessing(
-                image=im,
+        return np.array(pil_image)
+
+    def image_batch(self, images, widths=None, normalize=True):
+        """
+        针对固定尺寸图片批次的编码：与image函数的顺序一致，先整批向量化数据增广，再缩放、归一化
+        原图尺寸相同的样本作为一组整批增广；Tensor/Memmap管道缓存的是已缩放的图片，增广作用于缩放后的图片
+        :param images: decode_image输出的原图列表，或已缩放的uint8 [N, H, W(, C)]
+        :param widths: 可选，不定宽图片以0补齐时各样本的实际宽度，增广后补齐部分重新置0
+        :param normalize: 为False时返回uint8，归一化交由计算图完成
+        :return: float32 [N, W, H, C]，normalize为False时为uint8
+        """
+        if self.mode == RunMode.Trains:
+            # 与image函数一致，约一半的样本进入数据增广
+            images = self.augment_batch(images, np.random.random_sample(len(images)) < 0.5)
+        if not isinstance(images, np.ndarray):
+            size = self.model_conf.resize[0], self.model_conf.resize[1]
+            images = [cv2.resize(im, size) for im in images]
+        images = np.array(images, dtype=np.uint8).swapaxes(1, 2)
+        if self.model_conf.image_channel == 1:
+            images = images[:, :, :, np.newaxis]
+        if widths is not None:
+            images[np.arange(images.shape[1])[np.newaxis, :] >= np.asarray(widths)[:, np.newaxis]] = 0
+        if not normalize:
+            return np.ascontiguousarray(images)
+        return images.astype(np.float32) / 255.
+
+    def augment_batch(self, images, augment):
+        """
+        对augment选中的样本进行数据增广，尺寸相同的样本整批调用batch_preprocessing
+        :param augment: bool [N]
+        :return: 增广后的图片列表或批次
+        """
+        if isinstance(images, np.ndarray):
+            images = np.array(images, dtype=np.uint8)
+            index = np.flatnonzero(augment)
+            images[index] = self.batch_preprocessing(images[index])
+            return images
+        images = list(images)
+        groups = {}
+        for i in np.flatnonzero(augment):
+            groups.setdefault(images[i].shape, []).append(i)
+        for index in groups.values():
+            for i, im in zip(index, self.batch_preprocessing(np.stack([images[i] for i in index]))):
+                images[i] = im
+        return images
+
+    def batch_preprocessing(self, images):
+        """根据配置对图片批次进行随机数据增广"""
+        return batch_preprocessing(
+            batch=images,
+            binaryzation=self.model_conf.binaryzation,
+            median_blur=self.model_conf.median_blur,
+            gaussian_blur=self.model_conf.gaussian_blur,
+            equalize_hist=self.model_conf.equalize_hist,
+            laplacian=self.model_conf.laplace,
+            rotate=self.model_conf.rotate,
+            warp_perspective=self.model_conf.warp_perspective,
+            sp_noise=self.model_conf.sp_noise,
+        )
+
+    def preprocessing(self, im):
+        """根据配置对图片进行随机数据增广"""
+        return preprocessing(
+            image=im,
+            binaryzation=self.model_conf.binaryzation,
+            median_blur=self.model_conf.median_blur,
+            gaussian_blur=self.model_conf.gaussian_blur,
+            equalize_hist=self.model_conf.equalize_hist,
+            laplacian=self.model_conf.laplace,
+            rotate=self.model_conf.rotate,
+            warp_perspective=self.model_conf.warp_perspective,
+            sp_noise=self.model_conf.sp_noise,
+        )
+
+    @staticmethod
+    def decode_tensor(contents):
+        """
+        图内解码图片字节流，GIF取首帧，带透明通道的PNG合成到白色背景上
+        :param contents: 图片字节流tf.string
+        :return: uint8 [H, W, 3]
+        """
+        def _gif():
+            return tf.image.decode_gif(contents)[0]
+
+        def _png():
+            rgba = tf.cast(tf.image.decode_png(contents, channels=4), tf.float32)
+            alpha = rgba[:, :, 3:] / 255.
+            return tf.cast(rgba[:, :, :3] * alpha + 255. * (1 - alpha), tf.uint8)
+
+        def _bmp():
+            return tf.image.decode_bmp(contents, channels=3)
+
+        def _jpeg():
+            return tf.image.decode_jpeg(contents, channels=3)
+
+        image = tf.case([
+            (tf.equal(tf.strings.substr(contents, 0, 3), b'GIF'), _gif),
+            (tf.equal(tf.strings.substr(contents, 0, 4), b'\x89PNG'), _png),
+            (tf.equal(tf.strings.substr(contents, 0, 2), b'BM'), _bmp),
+        ], default=_jpeg, exclusive=True)
+        image.set_shape([None, None, 3])
+        return image
+
+    def augment_tensor(self, image):
+        """在tf.data的map阶段中以TensorFlow OP进行数据增广，与image函数相同以1/2的概率触发"""
+        def _augment():
+            return tensor_preprocessing(
+                image=image,
                 binaryzation=self.model_conf.binaryzation,
                 median_blur=self.model_conf.median_blur,
                 gaussian_blur=self.model_conf.gaussian_blur,
@@ -55,25 +194,152 @@ class Encoder(object):
                 rotate=self.model_conf.rotate,
                 warp_perspective=self.model_conf.warp_perspective,
                 sp_noise=self.model_conf.sp_noise,
-            ).astype(np.float32)
+            )
 
-        else:
-            im = im.astype(np.float32)
+        augmented = tf.cond(tf.random.uniform([]) < 0.5, _augment, lambda: image)
+        augmented.set_shape(image.get_shape())
+        return augmented
+
+    @staticmethod
+    def grayscale_tensor(image):
+        """
+        与PIL的convert('L')一致的灰度转换：ITU-R 601-2 luma，16位定点运算后四舍五入
+        :param image: uint8 [..., 3]
+        :return: uint8 [..., 1]
+        """
+        rgb = tf.cast(image, tf.int32)
+        luma = rgb[..., 0:1] * 19595 + rgb[..., 1:2] * 38470 + rgb[..., 2:3] * 7471 + 32768
+        return tf.cast(tf.bitwise.right_shift(luma, 16), tf.uint8)
+
+    def resize_tensor(self, images):
+        """
+        按配置缩放图片，与cv2.resize的INTER_LINEAR一致(半像素中心的双线性插值)，
+        不定宽时宽度的计算方式与image函数相同
+        :param images: [N, H, W, C]
+        :return: float32 [N, resize[1], 宽度, C]
+        """
         if self.model_conf.resize[0] == -1:
-            # random_ratio = random.choice([2.5, 3, 3.5, 3.2, 2.7, 2.75])
-            ratio = self.model_conf.resize[1] / size[1]
-            # random_width = int(random_ratio * RESIZE[1])
-            resize_width = int(ratio * size[0])
-            # resize_width = random_width if is_random else resize_width
-            im = cv2.resize(im, (resize_width, self.model_conf.resize[1]))
+            shape = tf.shape(images, out_type=tf.int64)
+            ratio = self.model_conf.resize[1] / tf.cast(shape[1], tf.float64)
+            resize_width = tf.cast(ratio * tf.cast(shape[2], tf.float64), tf.int32)
+            size = tf.stack([self.model_conf.resize[1], resize_width])
         else:
-            im = cv2.resize(im, (self.model_conf.resize[0], self.model_conf.resize[1]))
-        im = im.swapaxes(0, 1)
+            size = [self.model_conf.resize[1], self.model_conf.resize[0]]
+        return tf.compat.v1.image.resize_bilinear(
+            tf.cast(images, tf.float32), size, align_corners=False, half_pixel_centers=True
+        )
 
+    def image_tensor(self, contents):
+        """
+        针对图片类型的输入的图内编码，等价于image函数，用于tf.data数据管道
+        :param contents: 图片字节流tf.string
+        :return: uint8 [W, H, C]，归一化交由计算图的第一个操作或export_tensor完成
+        """
+        image = self.decode_tensor(contents)
         if self.model_conf.image_channel == 1:
-            return np.array((im[:, :, np.newaxis]) / 255.)
+            image = self.grayscale_tensor(image)
+
+        if self.mode == RunMode.Trains:
+            image = self.augment_tensor(image)
+
+        image = self.resize_tensor(image[tf.newaxis])[0]
+        # 缩放输出float32，转换回uint8以便以uint8组批传输
+        image = tf.saturate_cast(tf.round(image), tf.uint8)
+        return tf.transpose(image, perm=[1, 0, 2])
+
+    def image_batch_tensor(self, inputs):
+        """
+        不定宽图片字节流批次的图内编码，按当前批次的实际最大宽度在右侧以0补齐
+        各样本宽度不一，先逐张编码写入不推断形状的TensorArray，再统一补齐
+        :param inputs: 图片字节流tf.string [N]
+        :return: uint8 [N, W, H, C]
+        """
+        batch_size = tf.shape(inputs)[0]
+        encoded = tf.TensorArray(tf.uint8, size=batch_size, infer_shape=False)
+        widths = tf.TensorArray(tf.int32, size=batch_size)
+
+        def _encode(i, _encoded, _widths):
+            image = self.image_tensor(inputs[i])
+            return i + 1, _encoded.write(i, image), _widths.write(i, tf.shape(image)[0])
+
+        _, encoded, widths = tf.while_loop(
+            lambda i, *_: i < batch_size, _encode, [0, encoded, widths], back_prop=False
+        )
+        widths = widths.stack()
+        max_width = tf.reduce_max(widths)
+
+        def _pad(i):
+            return tf.pad(encoded.read(i), [[0, max_width - widths[i]], [0, 0], [0, 0]])
+
+        return tf.map_fn(_pad, tf.range(batch_size), dtype=tf.uint8, back_prop=False)
+
+    def export_tensor(self, export_input: ExportInput):
+        """
+        导出模型的输入占位符(名为input)及图内预处理，客户端无需复现image函数
+        :param export_input: Bytes为图片字节流 tf.string [N]，UInt8为已解码的像素 uint8 [N, H, W, C]
+        :return: (输入占位符, 预处理后的float32 [N, W, H, C])
+        """
+        if export_input == ExportInput.Bytes:
+            inputs = tf.compat.v1.placeholder(tf.string, [None], name='input')
+            if self.model_conf.resize[0] != -1:
+                # 固定尺寸时宽度须为静态值，FullConnectedCNN等输出层依赖静态形状
+                images = tf.map_fn(self.image_tensor, inputs, dtype=tf.uint8, back_prop=False)
+                images.set_shape(
+                    [None, self.model_conf.resize[0], self.model_conf.resize[1], self.model_conf.image_channel]
+                )
+                return inputs, tf.cast(images, tf.float32) / 255.
+
+            images = self.image_batch_tensor(inputs)
+            images.set_shape([None, None, self.model_conf.resize[1], self.model_conf.image_channel])
+            return inputs, tf.cast(images, tf.float32) / 255.
+
+        inputs = tf.compat.v1.placeholder(tf.uint8, [None, None, None, self.model_conf.image_channel], name='input')
+        return inputs, tf.transpose(self.resize_tensor(inputs), perm=[0, 2, 1, 3]) / 255.
+
+    def category_lookup(self):
+        """
+        类别 -> 编码的静态查找表，供text_tensor使用，须在tf.data的map函数之外构建，由tables_initializer初始化
+        类别集合含大小写规范(_LOWER/_UPPER)时追加另一种大小写的键，与text函数中的大小写转换等价
+        """
+        encode_map = dict(self.category_table.encode_map)
+        param = self.category_param if isinstance(self.category_param, str) else ''
+        for category, index in list(encode_map.items()):
+            if '_LOWER' in param:
+                encode_map.setdefault(category.upper(), index)
+            if '_UPPER' in param:
+                encode_map.setdefault(category.lower(), index)
+        return tf.lookup.StaticHashTable(
+            tf.lookup.KeyValueTensorInitializer(
+                keys=list(encode_map.keys()),
+                values=list(encode_map.values()),
+                key_dtype=tf.string,
+                value_dtype=tf.int32
+            ),
+            default_value=-1
+        )
+
+    def text_tensor(self, content, table):
+        """
+        针对文本类型的标签在tf.data的map阶段中编码，规则与text函数一致，全部在图内完成
+        :param content: 标签tf.string
+        :param table: category_lookup构建的查找表
+        :return: int32 [None]，标签包含类别集合以外的字符时抛出InvalidArgumentError，由ignore_errors跳过该样本
+        """
+        if self.model_conf.label_split:
+            labels = tf.strings.split([content], sep=self.model_conf.label_split).values
+        elif self.model_conf.max_label_num == 1:
+            labels = tf.reshape(content, [1])
         else:
-            return np.array(im[:, :]) / 255.
+            labels = tf.strings.unicode_split(content, 'UTF-8')
+        label = table.lookup(labels)
+        check = tf.debugging.Assert(
+            tf.reduce_all(label >= 0), ['The sample label contains invalid charset:', content]
+        )
+        with tf.control_dependencies([check]):
+            label = tf.identity(label)
+        if self.model_conf.loss_func == LossFunction.CTC:
+            label = self.split_continuous_tensor(label)
+        return label
 
     def text(self, content, extracted=False):
         """针对文本类型的输入的编码"""
@@ -98,21 +364,18 @@ class Encoder(object):
             if isinstance(self.category_param, str) and '_UPPER' in self.category_param:
                 found = found.upper()
 
-            # 标签是否包含分隔符
+            # 标签是否包含分隔符，单字符类别的标签直接以整串进行向量化编码
             if self.model_conf.label_split:
                 labels = found.split(self.model_conf.label_split)
             elif self.model_conf.max_label_num == 1:
                 labels = [found]
             else:
-                labels = [_ for _ in found]
+                labels = found
             try:
                 # 根据类别集合找到对应映射编码为dense数组
+                label = self.category_table.encode(labels)
                 if self.model_conf.loss_func == LossFunction.CTC:
-                    label = self.split_continuous_char(
-                        [encode_maps(self.model_conf.category)[i] for i in labels]
-                    )
-                else:
-                    label = [encode_maps(self.model_conf.category)[i] for i in labels]
+                    label = self.split_continuous_char(label)
                 return label
 
             except KeyError as e:
@@ -122,15 +385,19 @@ class Encoder(object):
                     ), ConfigException.SAMPLE_LABEL_ERROR
                 )
 
+    def split_continuous_tensor(self, label):
+        """图内为连续的相同分类插入空白符，与split_continuous_char一致"""
+        repeat = tf.concat([
+            tf.zeros([tf.minimum(tf.size(label), 1)], dtype=tf.bool), tf.equal(label[1:], label[:-1])
+        ], axis=0)
+        pairs = tf.stack([tf.fill(tf.shape(label), self.model_conf.category_num), label], axis=1)
+        return tf.boolean_mask(pairs, tf.stack([repeat, tf.ones_like(repeat)], axis=1))
+
     def split_continuous_char(self, content):
         # 为连续的分类插入空白符
-        store_list = []
-        for i in range(len(content) - 1):
-            store_list.append(content[i])
-            if content[i] == content[i + 1]:
-                store_list += [self.model_conf.category_num]
-        store_list.append(content[-1])
-        return store_list
+        content = np.asarray(content, dtype=np.int32)
+        continuous = np.flatnonzero(content[1:] == content[:-1]) + 1
+        return np.insert(content, continuous, self.model_conf.category_num)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import os
+import time
+import threading
+import tensorflow as tf
+import core
+import utils.data
+import validation
+from config import ModelConfig
+from constants import RunMode
+
+
+class Evaluation(object):
+    """
+    全量验证集评估：基于检查点快照在独立的验证模式计算图与会话中遍历完整验证集，
+    累计整体准确率与字符准确率，可同步运行，或在后台线程中异步运行，训练不因验证而停顿
+    """
+    def __init__(self, model_conf: ModelConfig, feeder: utils.data.DataIterator):
+        """
+        :param model_conf: 工程配置
+        :param feeder: 验证集的数据集迭代器
+        """
+        self.model_conf = model_conf
+        self.feeder = feeder
+        self.validation = validation.Validation(self.model_conf)
+        self.snapshot_path = os.path.join(self.model_conf.model_root_path, 'evaluation', self.model_conf.model_tag)
+        self.thread = None
+        self.result = None
+        self.error = None
+        self.graph = None
+        self.sess = None
+        self.model = None
+        self.saver = None
+
+    def evaluate(self, sess, model):
+        """
+        在给定会话中以model.dense_decoded遍历完整验证集
+        :return: (整体准确率, 字符准确率, 样本数)
+        """
+        exact, correct_chars, total_chars, samples = 0, 0, 0, 0
+        for input_batch, label_batch in self.feeder.iter_all():
+            dense_decoded = sess.run(model.dense_decoded, feed_dict={model.inputs: input_batch})
+            matched, labels, decoded = self.validation.match(label_batch, dense_decoded)
+            valid = labels != -1
+            exact += int(matched.sum())
+            correct_chars += int(((labels == decoded) & valid).sum())
+            total_chars += int(valid.sum())
+            samples += len(matched)
+        return exact / max(samples, 1), correct_chars / max(total_chars, 1), samples
+
+    @property
+    def running(self):
+        """是否有异步评估正在进行"""
+        return self.thread is not None and self.thread.is_alive()
+
+    @property
+    def accuracy(self):
+        """最近一次完成的评估的整体准确率，尚无结果时为0"""
+        return self.result[1] if self.result else 0
+
+    def build_graph(self):
+        """构建独立的评估计算图，批归一化等使用推理模式"""
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.model = core.NeuralNetwork(
+                model_conf=self.model_conf,
+                mode=RunMode.Validation,
+                cnn=self.model_conf.neu_cnn,
+                recurrent=self.model_conf.neu_recurrent
+            )
+            self.model.build_graph()
+            self.saver = tf.train.Saver(var_list=tf.global_variables())
+        self.sess = tf.compat.v1.Session(
+            graph=self.graph,
+            config=tf.compat.v1.ConfigProto(
+                allow_soft_placement=True,
+                gpu_options=tf.compat.v1.GPUOptions(allow_growth=True)
+            )
+        )
+
+    def start(self, sess, saver, step, epoch):
+        """
+        保存当前变量的快照后在后台线程中评估，上一次评估尚未结束时跳过
+        :param sess: 训练会话
+        :param saver: 训练计算图中专用于快照的Saver
+        :param step: 当前步数
+        :param epoch: 当前epoch
+        :return: 是否启动了新的评估
+        :raises Exception: 上一次异步评估中抛出的异常
+        """
+        self.check()
+        if self.running:
+            return False
+        snapshot = self.snapshot(sess, saver, step)
+        self.thread = threading.Thread(target=self.run, args=(snapshot, step, epoch), daemon=True)
+        self.thread.start()
+        return True
+
+    def snapshot(self, sess, saver, step):
+        """保存训练会话中当前变量的快照，返回快照路径"""
+        if not os.path.exists(os.path.dirname(self.snapshot_path)):
+            os.makedirs(os.path.dirname(self.snapshot_path))
+        return saver.save(sess, self.snapshot_path, global_step=step)
+
+    def evaluate_snapshot(self, sess, saver, step, epoch):
+        """
+        同步评估：与异步评估相同，以快照在验证模式的计算图中遍历完整验证集，
+        批归一化使用滑动平均、Dropout关闭，结果不受批次组成影响
+        :return: (步数, 整体准确率, 字符准确率)
+        """
+        self.run(self.snapshot(sess, saver, step), step, epoch)
+        self.check()
+        return self.result
+
+    def run(self, snapshot, step, epoch):
+        """后台线程中的评估，异常保存在error中，由训练线程在下一次start或close时抛出"""
+        try:
+            if self.graph is None:
+                self.build_graph()
+            start_time = time.time()
+            self.saver.restore(self.sess, snapshot)
+            accuracy, char_accuracy, samples = self.evaluate(self.sess, self.model)
+            self.result = step, accuracy, char_accuracy
+            self.log(epoch, step, accuracy, char_accuracy, samples, time.time() - start_time)
+        except Exception as e:
+            tf.logging.error('Evaluation - Step: {} failed: {}'.format(step, e))
+            self.error = e
+
+    def check(self):
+        """在训练线程中抛出异步评估的异常"""
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    @staticmethod
+    def log(epoch, step, accuracy, char_accuracy, samples, cost_time):
+        tf.logging.info(
+            "Evaluation - Epoch: {}, Step: {}, Accuracy = {:.4f}, CharAccuracy = {:.4f}, "
+            "Samples: {}, Time = {:.3f} sec".format(
+                epoch, step, accuracy, char_accuracy, samples, cost_time
+            )
+        )
+
+    def close(self):
+        """等待进行中的异步评估结束并释放评估会话，评估中的异常在释放后抛出"""
+        if self.thread is not None:
+            self.thread.join()
+        if self.sess is not None:
+            self.sess.close()
+            self.sess = None
+        self.check()
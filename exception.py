@@ -42,6 +42,11 @@ class ConfigException:
     SAMPLE_LABEL_ERROR = -4044
     GET_LABEL_REGEX_ERROR = -4045
     ERROR_LABEL_FROM = -4046
+    INPUT_PIPELINE_NOT_SUPPORTED = -4047
+    VALIDATION_MODE_NOT_SUPPORTED = -4048
+    EXPORT_INPUT_NOT_SUPPORTED = -4049
+    DECODER_NOT_SUPPORTED = -4050
+    DECODE_CHARSET_ERROR = -4053
     INSUFFICIENT_SAMPLE = -5
     VALIDATION_SET_SIZE_ERROR = -6
 
@@ -3,19 +3,60 @@
 # Author: kerlomz <kerlomz@gmail.com>
 import sys
 import random
+import multiprocessing
 from tqdm import tqdm
 import tensorflow as tf
+import utils.index
+import utils.tensor
 from config import *
 from constants import RunMode
 
 _RANDOM_SEED = 0
+_EXTRACT_REGEX = None
+
+
+def _init_worker(extract_regex):
+    """进程池初始化：子进程中保存标签提取正则"""
+    global _EXTRACT_REGEX
+    _EXTRACT_REGEX = extract_regex
+
+
+def _serialize_example(file_name):
+    """
+    子进程任务：读取图片并序列化为tf.train.Example
+    :param file_name: 图片路径
+    :return: (文件名, 序列化后的字节串)，读取失败时字节串为None
+    """
+    try:
+        image_data = DataSets.read_image(file_name)
+    except IOError as e:
+        print('could not read:', file_name)
+        print('error:', e)
+        print('skip it \n')
+        return file_name, None
+    labels = re.search(_EXTRACT_REGEX, file_name.split(PATH_SPLIT)[-1])
+    if not labels:
+        raise NameError('invalid filename {}'.format(file_name))
+    labels = labels.group().encode('utf-8')
+    return file_name, DataSets.input_to_tfrecords(image_data, labels).SerializeToString()
 
 
 class DataSets:
 
     """此类用于打包数据集为TFRecords格式"""
-    def __init__(self, model: ModelConfig):
+    def __init__(self, model: ModelConfig, process_num=1, shard_num=None, deterministic=True):
+        """
+        :param model: 工程配置
+        :param process_num: 打包进程数，大于1时启用多进程分片打包
+        :param shard_num: 分片数，默认与进程数相同
+        :param deterministic: 是否保持merge_source的seed-0乱序结果，
+                              为True时按序号顺序依次读取所有分片等价于单文件打包的样本顺序
+        """
         self.model = model
+        self.process_num = process_num if process_num else 1
+        self.shard_num = shard_num if shard_num else self.process_num
+        self.deterministic = deterministic
+        self.shard_map = {}
         if not os.path.exists(self.model.dataset_root_path):
             os.makedirs(self.model.dataset_root_path)
 
@@ -40,18 +81,90 @@ class DataSets:
     def bytes_feature(values):
         return tf.train.Feature(bytes_list=tf.train.BytesList(value=[values]))
 
-    def input_to_tfrecords(self, input_data, label):
+    @staticmethod
+    def input_to_tfrecords(input_data, label):
         return tf.train.Example(features=tf.train.Features(feature={
-            'input': self.bytes_feature(input_data),
-            'label': self.bytes_feature(label),
+            'input': DataSets.bytes_feature(input_data),
+            'label': DataSets.bytes_feature(label),
         }))
 
+    @staticmethod
+    def shard_names(output_filename, shard_num):
+        """
+        根据输出路径生成分片路径，形如 Trains.0.tfrecords -> Trains.0.tfrecords, Trains.1.tfrecords ...
+        :param output_filename: 首个分片的路径
+        :param shard_num: 分片数
+        :return: 分片路径列表
+        """
+        dir_name, base_name = os.path.split(output_filename)
+        name_split = base_name.split(".")
+        if len(name_split) == 3 and name_split[1].isdigit():
+            prefix, start_index, suffix = name_split[0], int(name_split[1]), name_split[2]
+        else:
+            prefix, start_index, suffix = ".".join(name_split[:-1]) or base_name, 0, name_split[-1]
+        return [
+            os.path.join(dir_name, "{}.{}.{}".format(prefix, start_index + i, suffix)).replace("\\", "/")
+            for i in range(shard_num)
+        ]
+
+    def convert_dataset_parallel(self, output_filename, file_list, mode: RunMode):
+        """
+        多进程打包：进程池并行读取与序列化样本，主进程按样本序号写入各自分片的TFRecordWriter
+        确定性模式下结果按输入顺序返回，第i个分片即为seed-0乱序结果中连续的第i段
+        :return: 分片路径列表
+        """
+        shard_num = max(min(self.shard_num, len(file_list)), 1)
+        shard_size = -(-len(file_list) // shard_num)
+        shard_paths = self.shard_names(output_filename, shard_num)
+        writers = [tf.io.TFRecordWriter(path) for path in shard_paths]
+        offsets = [[] for _ in shard_paths]
+        shard_offset = [0 for _ in shard_paths]
+        chunk_size = max(min(shard_size // self.process_num, 256), 1)
+        pool = multiprocessing.Pool(
+            processes=self.process_num,
+            initializer=_init_worker,
+            initargs=(self.model.extract_regex,)
+        )
+        try:
+            imap = pool.imap if self.deterministic else pool.imap_unordered
+            pbar = tqdm(imap(_serialize_example, file_list, chunk_size), total=len(file_list))
+            written = 0
+            for file_name, serialized in pbar:
+                if serialized is None:
+                    continue
+                shard_index = written // shard_size
+                writers[shard_index].write(serialized)
+                offsets[shard_index].append(shard_offset[shard_index])
+                shard_offset[shard_index] += utils.index.record_size(serialized)
+                written += 1
+                pbar.set_description('[Processing dataset %s] [filename: %s]' % (mode, file_name))
+        except BaseException:
+            # 异常(含Ctrl+C)时不再等待剩余任务，直接结束子进程
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+            for writer in writers:
+                writer.close()
+        for path, shard_offsets, file_size in zip(shard_paths, offsets, shard_offset):
+            utils.index.write_index(path, shard_offsets, file_size)
+        return shard_paths
+
     def convert_dataset(self, output_filename, file_list, mode: RunMode, is_add=False):
         if is_add:
             output_filename = self.model.dataset_increasing_name(mode)
             if not output_filename:
                 raise FileNotFoundError('Basic data set missing, please check.')
             output_filename = os.path.join(self.model.dataset_root_path, output_filename)
+        if self.process_num > 1:
+            shard_paths = self.convert_dataset_parallel(output_filename, file_list, mode)
+            self.shard_map[mode] = (output_filename, shard_paths)
+            self.convert_tensor(shard_paths)
+            return
+        offsets = []
+        offset = 0
         with tf.io.TFRecordWriter(output_filename) as writer:
             pbar = tqdm(file_list)
             for i, file_name in enumerate(pbar):
@@ -64,14 +177,28 @@ class DataSets:
                         raise NameError('invalid filename {}'.format(file_name))
                     labels = labels.encode('utf-8')
 
-                    example = self.input_to_tfrecords(image_data, labels)
-                    writer.write(example.SerializeToString())
+                    serialized = self.input_to_tfrecords(image_data, labels).SerializeToString()
+                    writer.write(serialized)
+                    offsets.append(offset)
+                    offset += utils.index.record_size(serialized)
                     pbar.set_description('[Processing dataset %s] [filename: %s]' % (mode, file_name))
 
                 except IOError as e:
                     print('could not read:', file_list[1])
                     print('error:', e)
                     print('skip it \n')
+        utils.index.write_index(output_filename, offsets, offset)
+        self.convert_tensor([output_filename])
+
+    def convert_tensor(self, paths):
+        """InputPipeline为Tensor时，将打包好的TFRecords分片预解码为缩放后的uint8张量分片"""
+        if self.model.input_pipeline != InputPipeline.Tensor:
+            return
+        if self.model.resize[0] == -1:
+            tf.compat.v1.logging.warn('Tensor shards require a fixed Resize, skipped.')
+            return
+        for path in paths:
+            utils.tensor.write_tensor(path, self.model)
 
     @staticmethod
     def merge_source(source):
@@ -85,10 +212,25 @@ class DataSets:
             origin_dataset = [os.path.join(source, trains) for trains in os.listdir(source)]
         else:
             return
-        random.seed(0)
+        random.seed(_RANDOM_SEED)
         random.shuffle(origin_dataset)
         return origin_dataset
 
+    def update_shard_paths(self):
+        """将多进程打包生成的分片列表回写到工程配置的DatasetPath中"""
+        if not self.shard_map:
+            return
+        for mode, (output_filename, shard_paths) in self.shard_map.items():
+            dataset_paths = self.model.dataset_map[mode][DatasetType.TFRecords]
+            dataset_paths = [
+                i for i in (dataset_paths if dataset_paths else [])
+                if os.path.normpath(i) != os.path.normpath(output_filename)
+            ]
+            self.model.dataset_map[mode][DatasetType.TFRecords] = dataset_paths + shard_paths
+            tf.compat.v1.logging.info('{} shards: {}'.format(mode.value, shard_paths))
+        self.model.update()
+        self.shard_map = {}
+
     def make_dataset(self, trains_path=None, validation_path=None, is_add=False, callback=None, msg=None):
         if self.dataset_exists() and not is_add:
             state = "EXISTS"
@@ -144,6 +286,7 @@ class DataSets:
                 mode=RunMode.Trains,
                 is_add=is_add
             )
+        self.update_shard_paths()
         state = "DONE"
         if callback:
             callback()
@@ -153,6 +296,7 @@ class DataSets:
 
 
 if __name__ == '__main__':
+    # python make_dataset.py [进程数] 工程名
     model_conf = ModelConfig(sys.argv[-1])
-    _dataset = DataSets(model_conf)
+    _dataset = DataSets(model_conf, process_num=int(sys.argv[-2]) if len(sys.argv) > 2 else 1)
     _dataset.make_dataset()
@@ -20,30 +20,15 @@ def get_image_batch(img_bytes):
     return [encoder.image(index) for index in [img_bytes]]
 
 
-def decode_maps(categories):
-    """解码器"""
-    return {index: category for index, category in enumerate(categories, 0)}
-
-
 def predict_func(image_batch, _sess, dense_decoded, op_input):
     """预测函数"""
     dense_decoded_code = _sess.run(dense_decoded, feed_dict={
         op_input: image_batch,
     })
     # print(dense_decoded_code)
-    decoded_expression = []
-    for item in dense_decoded_code:
-        expression = ''
-        # print(item)
-        if isinstance(item, int) or isinstance(item, np.int64):
-            item = [item]
-        for class_index in item:
-            if class_index == -1 or class_index == model_conf.category_num:
-                expression += ''
-            else:
-                expression += decode_maps(model_conf.category)[class_index]
-        decoded_expression.append(expression)
-    return ''.join(decoded_expression) if len(decoded_expression) > 1 else decoded_expression[0]
+    # 整批查表解码，-1与category_num被掩去
+    decoded_expression = model_conf.category_table.decode_batch(dense_decoded_code, model_conf.output_split)
+    return ''.join(decoded_expression)
 
 
 if __name__ == '__main__':
@@ -4,6 +4,19 @@
 import cv2
 import random
 import numpy as np
+import tensorflow as tf
+
+
+def get_rng(rng=None):
+    """
+    :param rng: None/随机数种子/np.random.RandomState
+    :return: np.random.RandomState，为None时使用numpy全局随机状态
+    """
+    if rng is None:
+        return np.random.mtrand._rand
+    if isinstance(rng, np.random.RandomState):
+        return rng
+    return np.random.RandomState(rng)
 
 
 class Pretreatment(object):
@@ -96,19 +109,18 @@ class Pretreatment(object):
             self.origin = dst
         return dst
 
-    def sp_noise(self, prob, modify=False):
-        size = self.origin.shape
-        output = np.zeros(self.origin.shape, np.uint8)
-        thres = 1 - prob
-        for i in range(size[0]):
-            for j in range(size[1]):
-                rdn = random.random()
-                if rdn < prob:
-                    output[i][j] = 0
-                elif rdn > thres:
-                    output[i][j] = 255
-                else:
-                    output[i][j] = self.origin[i][j]
+    def sp_noise(self, prob, modify=False, rng=None):
+        """
+        椒盐噪声：每个像素以prob的概率置0，以prob的概率置255
+        :param prob: 噪声概率
+        :param modify: 是否修改原图
+        :param rng: 可选，随机数种子或np.random.RandomState，用于复现增广结果
+        """
+        rng = get_rng(rng)
+        rdn = rng.random_sample(self.origin.shape[:2])
+        output = self.origin.astype(np.uint8)
+        output[rdn < prob] = 0
+        output[rdn > 1 - prob] = 255
         if modify:
             self.origin = output
         return output
@@ -133,10 +145,12 @@ def preprocessing(
         warp_perspective=False,
         sp_noise=-1,
         rotate=-1,
-        light=False
+        light=False,
+        rng=None
 ):
     """
     各种预处理函数是否启用及参数配置
+    :param rng: 随机数种子或np.random.RandomState，用于复现椒盐噪声
     :param light: bool
     :param image: numpy图片数组
     :param binaryzation: list-int数字范围
@@ -165,11 +179,417 @@ def preprocessing(
     if warp_perspective and bool(random.getrandbits(1)):
         pretreatment.warp_perspective(True)
     if 0 < sp_noise < 1 and bool(random.getrandbits(1)):
-        pretreatment.sp_noise(sp_noise, True)
+        pretreatment.sp_noise(sp_noise, True, rng=rng)
     if light and bool(random.getrandbits(1)):
         pretreatment.light(True)
     return pretreatment.get()
 
 
+class BatchPretreatment(object):
+    """
+    批量预处理功能函数集合：输入 (N, H, W[, C]) 的uint8批次，每个函数仅作用于index指定的样本并直接写回批次
+    随机参数整批生成，逐像素的增广以整批向量化运算完成，滤波与几何变换对选中样本逐张调用OpenCV
+    """
+    # 椒盐噪声使用uint16随机数，生成速度远快于float64
+    NOISE_SCALE = 65536
+
+    def __init__(self, origin, rng=None):
+        self.origin = np.array(origin, dtype=np.uint8)
+        self.rng = get_rng(rng)
+
+    def get(self):
+        return self.origin
+
+    @property
+    def size(self):
+        return len(self.origin)
+
+    def subset(self, ratio=0.5) -> np.ndarray:
+        """随机选取批次中约ratio比例的样本序号"""
+        return np.flatnonzero(self.rng.random_sample(self.size) < ratio)
+
+    def per_sample(self, value, index):
+        """为每个样本生成对应的参数并reshape为可与批次广播的形状"""
+        return np.asarray(value).reshape([len(index)] + [1] * (self.origin.ndim - 1))
+
+    def random_kernel(self, value, index):
+        """为每个样本生成[0, value]之间的奇数，用于滤波核尺寸"""
+        values = self.rng.randint(0, value + 1, size=len(index))
+        return values + (values % 2 == 0)
+
+    def binarization(self, value, index):
+        if not len(index):
+            return
+        if isinstance(value, list) and len(value) == 2:
+            value = self.rng.randint(value[0], value[1] + 1, size=len(index))
+        else:
+            value = np.full(len(index), value)
+        threshold = self.per_sample(np.clip(value, 0, 255).astype(np.uint8), index)
+        # uint8的True取负即为255，与cv2.THRESH_BINARY一致
+        self.origin[index] = np.negative((self.origin[index] > threshold).view(np.uint8))
+
+    def median_blur(self, value, index):
+        if not value:
+            return
+        for i, ksize in zip(index, self.random_kernel(value, index)):
+            self.origin[i] = cv2.medianBlur(self.origin[i], int(ksize))
+
+    def gaussian_blur(self, value, index):
+        if not value:
+            return
+        for i, ksize in zip(index, self.random_kernel(value, index)):
+            self.origin[i] = cv2.GaussianBlur(self.origin[i], (int(ksize), int(ksize)), 0)
+
+    def equalize_hist(self, value, index):
+        if not value:
+            return
+        for i in index:
+            self.origin[i] = cv2.equalizeHist(self.origin[i])
+
+    def laplacian(self, value, index):
+        if not value:
+            return
+        for i in index:
+            self.origin[i] = cv2.convertScaleAbs(cv2.Laplacian(self.origin[i], cv2.CV_16S, ksize=3))
+
+    def rotate(self, value, index):
+        if not value or not len(index):
+            return
+        height, width = self.origin.shape[1:3]
+        angles = -self.rng.randint(-value, value + 1, size=len(index))
+        for i, angle in zip(index, angles):
+            # 与Pretreatment.rotate一致，大角度旋转时以左上四分之一处为中心
+            center = (width / 4, height / 4) if abs(angle) > 15 else (width / 2, height / 2)
+            m = cv2.getRotationMatrix2D(center, int(angle), 1.0)
+            self.origin[i] = cv2.warpAffine(
+                self.origin[i], m, (width, height), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE
+            )
+
+    def warp_perspective(self, index):
+        if not len(index):
+            return
+        height, width = self.origin.shape[1:3]
+        size0 = self.rng.randint(3, 10, size=len(index))
+        size1 = self.rng.randint(25, 31, size=len(index))
+        size2 = self.rng.randint(23, 28, size=len(index))
+        size3 = self.rng.randint(33, 38, size=len(index))
+        is_random = self.rng.randint(0, 2, size=len(index)).astype(bool)
+        for i, s0, s1, s2, s3, r in zip(index, size0, size1, size2, size3, is_random):
+            pts1 = np.float32([[0, 0], [0, s1], [s1, s1], [s1, 0]])
+            pts2 = np.float32([[s0, 0], [-s0, s1], [s2, s1], [s3, 0]])
+            warp_mat = cv2.getPerspectiveTransform(*((pts2, pts1) if r else (pts1, pts2)))
+            self.origin[i] = cv2.warpPerspective(self.origin[i], warp_mat, (width, height))
+
+    def sp_noise(self, prob, index):
+        if not len(index):
+            return
+        rdn = self.rng.randint(0, self.NOISE_SCALE, size=(len(index),) + self.origin.shape[1:3], dtype=np.uint16)
+        images = self.origin[index]
+        images[rdn < prob * self.NOISE_SCALE] = 0
+        images[rdn > (1 - prob) * self.NOISE_SCALE] = 255
+        self.origin[index] = images
+
+    def light(self, index):
+        if not len(index):
+            return
+        alpha = np.float32(0.3 * 0.01)
+        beta = self.per_sample(self.rng.randint(0, 81, size=len(index)).astype(np.float32), index)
+        self.origin[index] = np.clip((alpha * self.origin[index] + beta), 0, 255).astype(np.uint8)
+
+
+def batch_preprocessing(
+        batch,
+        binaryzation=-1,
+        median_blur=-1,
+        gaussian_blur=-1,
+        equalize_hist=False,
+        laplacian=False,
+        warp_perspective=False,
+        sp_noise=-1,
+        rotate=-1,
+        light=False,
+        ratio=0.5,
+        rng=None
+):
+    """
+    批量数据增广，参数含义与preprocessing一致，每种增广随机作用于批次中约ratio比例的样本
+    :param batch: (N, H, W[, C]) uint8批次，同一批次内尺寸必须一致
+    :param ratio: 每种增广被触发的概率，与preprocessing中逐张抛硬币的概率一致
+    :param rng: 随机数种子或np.random.RandomState
+    :return: 增广后的uint8批次
+    """
+    pretreatment = BatchPretreatment(batch, rng)
+    if binaryzation != -1:
+        pretreatment.binarization(binaryzation, pretreatment.subset(ratio))
+    if median_blur != -1:
+        pretreatment.median_blur(median_blur, pretreatment.subset(ratio))
+    if gaussian_blur != -1:
+        pretreatment.gaussian_blur(gaussian_blur, pretreatment.subset(ratio))
+    if equalize_hist:
+        pretreatment.equalize_hist(True, pretreatment.subset(ratio))
+    if laplacian:
+        pretreatment.laplacian(True, pretreatment.subset(ratio))
+    if rotate > 0:
+        pretreatment.rotate(rotate, pretreatment.subset(ratio))
+    if warp_perspective:
+        pretreatment.warp_perspective(pretreatment.subset(ratio))
+    if 0 < sp_noise < 1:
+        pretreatment.sp_noise(sp_noise, pretreatment.subset(ratio))
+    if light:
+        pretreatment.light(pretreatment.subset(ratio))
+    return pretreatment.get()
+
+
+class TensorPretreatment(object):
+    """
+    图内预处理功能函数集合：输入 [H, W, C] 的uint8张量，全部以TensorFlow OP实现，
+    用于tf.data的map阶段，无需tf.py_func，不受GIL限制
+    随机参数的取值范围、滤波核与边界处理与Pretreatment(OpenCV)一致，旋转以双线性插值近似INTER_CUBIC
+    """
+    # cv2.getGaussianKernel在sigma<=0且核尺寸不大于7时使用的固定系数
+    SMALL_GAUSSIAN = {
+        1: [1.],
+        3: [0.25, 0.5, 0.25],
+        5: [0.0625, 0.25, 0.375, 0.25, 0.0625],
+        7: [0.03125, 0.109375, 0.21875, 0.28125, 0.21875, 0.109375, 0.03125],
+    }
+
+    def __init__(self, origin):
+        self.origin = origin
+        self.channel = origin.get_shape().as_list()[-1]
+
+    def get(self):
+        return self.origin
+
+    @staticmethod
+    def coin():
+        """以1/2的概率为True，与random.getrandbits(1)一致"""
+        return tf.random.uniform([]) < 0.5
+
+    @staticmethod
+    def randint(low, high):
+        """[low, high]闭区间的随机整数，与random.randint一致"""
+        return tf.random.uniform([], low, high + 1, dtype=tf.int32)
+
+    def apply(self, fn):
+        """以1/2的概率将fn作用于当前图片"""
+        origin = self.origin
+        self.origin = tf.cond(self.coin(), lambda: fn(origin), lambda: origin)
+        self.origin.set_shape(origin.get_shape())
+
+    def random_kernel(self, value, fn):
+        """
+        以[0, value]之间的随机奇数为核尺寸调用fn，与Pretreatment一致偶数加1
+        核尺寸须为静态值，按可能的取值分支
+        """
+        ksize = self.randint(0, value)
+        ksize = ksize + 1 - ksize % 2
+
+        def _branch(image, size):
+            return lambda: image if size == 1 else fn(image, size)
+
+        def _fn(image):
+            sizes = sorted({i + 1 - i % 2 for i in range(value + 1)})
+            return tf.case([(tf.equal(ksize, size), _branch(image, size)) for size in sizes], exclusive=True)
+        return _fn
+
+    @staticmethod
+    def replicate_pad(image, pad):
+        """边缘像素复制补齐，与cv2.BORDER_REPLICATE一致"""
+        shape = tf.shape(image)
+        rows = tf.clip_by_value(tf.range(-pad, shape[0] + pad), 0, shape[0] - 1)
+        cols = tf.clip_by_value(tf.range(-pad, shape[1] + pad), 0, shape[1] - 1)
+        return tf.gather(tf.gather(image, rows), cols, axis=1)
+
+    def convolve(self, image, kernel):
+        """
+        逐通道二维卷积，以镜像补齐(cv2.BORDER_REFLECT_101)
+        :param kernel: numpy [kh, kw]
+        :return: float32 [H, W, C]
+        """
+        kh, kw = kernel.shape
+        padded = tf.pad(tf.cast(image, tf.float32), [[kh // 2, kh // 2], [kw // 2, kw // 2], [0, 0]], mode='REFLECT')
+        weights = np.tile(kernel[:, :, np.newaxis, np.newaxis], [1, 1, self.channel, 1]).astype(np.float32)
+        return tf.nn.depthwise_conv2d(padded[tf.newaxis], weights, strides=[1, 1, 1, 1], padding='VALID')[0]
+
+    def binarization(self, value):
+        def _fn(image):
+            threshold = self.randint(*value) if isinstance(value, list) and len(value) == 2 else value
+            return tf.cast(tf.cast(image, tf.int32) > threshold, tf.uint8) * 255
+        return _fn
+
+    def median_blur(self, value):
+        def _median(image, size):
+            patches = tf.image.extract_image_patches(
+                tf.cast(self.replicate_pad(image, size // 2), tf.int32)[tf.newaxis],
+                ksizes=[1, size, size, 1], strides=[1, 1, 1, 1], rates=[1, 1, 1, 1], padding='VALID'
+            )[0]
+            # [H, W, size*size*C]中各通道交错排列，整理为[H, W, C, size*size]后取中位数
+            patches = tf.reshape(patches, tf.concat([tf.shape(image)[:2], [size * size, self.channel]], 0))
+            patches = tf.transpose(patches, perm=[0, 1, 3, 2])
+            return tf.cast(tf.nn.top_k(patches, size * size // 2 + 1).values[..., -1], tf.uint8)
+        return self.random_kernel(value, _median)
+
+    def gaussian_blur(self, value):
+        def _gaussian(image, size):
+            if size in self.SMALL_GAUSSIAN:
+                kernel = np.asarray(self.SMALL_GAUSSIAN[size])
+            else:
+                sigma = 0.3 * ((size - 1) * 0.5 - 1) + 0.8
+                kernel = np.exp(-np.square(np.arange(size) - (size - 1) / 2) / (2 * sigma * sigma))
+                kernel = kernel / kernel.sum()
+            # 可分离卷积，先纵向再横向
+            output = self.convolve(image, kernel[:, np.newaxis])
+            output = self.convolve(output, kernel[np.newaxis, :])
+            return tf.saturate_cast(tf.round(output), tf.uint8)
+        return self.random_kernel(value, _gaussian)
+
+    @staticmethod
+    def equalize_hist(image):
+        """逐通道直方图均衡化，查找表的计算与cv2.equalizeHist一致"""
+        def _equalize(channel):
+            channel = tf.cast(channel, tf.int32)
+            hist = tf.math.bincount(channel, minlength=256, maxlength=256)
+            total = tf.size(channel)
+            # 第一个非零灰度级的像素数
+            first = hist[tf.argmax(tf.cast(hist > 0, tf.int32), output_type=tf.int32)]
+            scale = 255. / tf.cast(tf.maximum(total - first, 1), tf.float32)
+            lut = tf.cast(tf.cumsum(hist) - first, tf.float32) * scale
+            lut = tf.cast(tf.clip_by_value(tf.round(lut), 0, 255), tf.uint8)
+            return tf.cond(tf.equal(total, first), lambda: tf.cast(channel, tf.uint8), lambda: tf.gather(lut, channel))
+        return tf.stack([_equalize(channel) for channel in tf.unstack(image, axis=-1)], axis=-1)
+
+    def laplacian(self, image):
+        """3x3孔径的拉普拉斯算子后取绝对值，与cv2.Laplacian(ksize=3)及convertScaleAbs一致"""
+        kernel = np.asarray([[2, 0, 2], [0, -8, 0], [2, 0, 2]], dtype=np.float32)
+        return tf.saturate_cast(tf.abs(self.convolve(image, kernel)), tf.uint8)
+
+    @staticmethod
+    def warp(image, matrix, replicate):
+        """
+        将输出像素坐标经3x3矩阵映射到原图坐标后双线性采样
+        :param matrix: [3, 3]，输出坐标(x, y, 1) -> 原图坐标，即OpenCV变换矩阵的逆
+        :param replicate: True时越界取边缘像素(BORDER_REPLICATE)，否则以0填充(BORDER_CONSTANT)
+        """
+        shape = tf.shape(image)
+        height, width = shape[0], shape[1]
+        ys, xs = tf.meshgrid(tf.range(height), tf.range(width), indexing='ij')
+        coords = tf.cast(tf.stack([xs, ys, tf.ones_like(xs)], axis=-1), tf.float32)
+        source = tf.tensordot(coords, tf.transpose(tf.cast(matrix, tf.float32)), axes=1)
+        x = source[..., 0] / source[..., 2]
+        y = source[..., 1] / source[..., 2]
+        x0, y0 = tf.floor(x), tf.floor(y)
+        wx, wy = (x - x0)[..., tf.newaxis], (y - y0)[..., tf.newaxis]
+        pixels = tf.cast(image, tf.float32)
+        max_x, max_y = tf.cast(width - 1, tf.float32), tf.cast(height - 1, tf.float32)
+
+        def _sample(sy, sx):
+            index = tf.cast(tf.stack([tf.clip_by_value(sy, 0, max_y), tf.clip_by_value(sx, 0, max_x)], -1), tf.int32)
+            values = tf.gather_nd(pixels, index)
+            if replicate:
+                return values
+            valid = (sx >= 0) & (sx <= max_x) & (sy >= 0) & (sy <= max_y)
+            return values * tf.cast(valid, tf.float32)[..., tf.newaxis]
+
+        output = _sample(y0, x0) * (1 - wx) * (1 - wy) + _sample(y0, x0 + 1) * wx * (1 - wy) + \
+            _sample(y0 + 1, x0) * (1 - wx) * wy + _sample(y0 + 1, x0 + 1) * wx * wy
+        return tf.saturate_cast(tf.round(output), tf.uint8)
+
+    def rotate(self, value):
+        def _fn(image):
+            shape = tf.cast(tf.shape(image), tf.float64)
+            height, width = shape[0], shape[1]
+            angle = -tf.cast(self.randint(-value, value), tf.float64)
+            # 与Pretreatment.rotate一致，大角度旋转时以左上四分之一处为中心
+            large = tf.abs(angle) > 15
+            cx = tf.where(large, width / 4, width / 2)
+            cy = tf.where(large, height / 4, height / 2)
+            # getRotationMatrix2D(center, -angle)即旋转矩阵的逆
+            theta = -angle * np.pi / 180
+            alpha, beta = tf.cos(theta), tf.sin(theta)
+            matrix = tf.stack([
+                tf.stack([alpha, beta, (1 - alpha) * cx - beta * cy]),
+                tf.stack([-beta, alpha, beta * cx + (1 - alpha) * cy]),
+                tf.constant([0., 0., 1.], dtype=tf.float64)
+            ])
+            return self.warp(image, matrix, replicate=True)
+        return _fn
+
+    @staticmethod
+    def perspective_transform(source, target):
+        """
+        与cv2.getPerspectiveTransform一致，求解将source四点映射到target四点的3x3矩阵
+        :param source: [(x, y)] * 4
+        :param target: [(u, v)] * 4
+        """
+        rows, values = [], []
+        for (x, y), (u, v) in zip(source, target):
+            rows.append([x, y, 1., 0., 0., 0., -x * u, -y * u])
+            rows.append([0., 0., 0., x, y, 1., -x * v, -y * v])
+            values.extend([u, v])
+        a = tf.stack([tf.stack([tf.cast(i, tf.float64) for i in row]) for row in rows])
+        b = tf.reshape(tf.stack([tf.cast(i, tf.float64) for i in values]), [8, 1])
+        return tf.reshape(tf.concat([tf.linalg.solve(a, b)[:, 0], tf.ones([1], tf.float64)], 0), [3, 3])
+
+    def warp_perspective(self, image):
+        size0, size1, size2, size3 = [
+            tf.cast(self.randint(low, high), tf.float64) for low, high in [(3, 9), (25, 30), (23, 27), (33, 37)]
+        ]
+        pts1 = [(0., 0.), (0., size1), (size1, size1), (size1, 0.)]
+        pts2 = [(size0, 0.), (-size0, size1), (size2, size1), (size3, 0.)]
+        # warpPerspective以变换矩阵的逆采样原图，即交换源点与目标点
+        matrix = tf.cond(
+            self.coin(),
+            lambda: self.perspective_transform(pts1, pts2),
+            lambda: self.perspective_transform(pts2, pts1)
+        )
+        return self.warp(image, matrix, replicate=False)
+
+    @staticmethod
+    def sp_noise(prob):
+        def _fn(image):
+            rdn = tf.broadcast_to(tf.random.uniform(tf.shape(image)[:2])[..., tf.newaxis], tf.shape(image))
+            salt = tf.fill(tf.shape(image), tf.constant(255, dtype=tf.uint8))
+            image = tf.where(rdn < prob, tf.zeros_like(image), image)
+            return tf.where(rdn > 1 - prob, salt, image)
+        return _fn
+
+
+def tensor_preprocessing(
+        image,
+        binaryzation=-1,
+        median_blur=-1,
+        gaussian_blur=-1,
+        equalize_hist=False,
+        laplacian=False,
+        warp_perspective=False,
+        sp_noise=-1,
+        rotate=-1,
+):
+    """
+    图内数据增广，参数含义、顺序与各增广1/2的触发概率与preprocessing一致
+    :param image: uint8 [H, W, C]
+    :return: 增广后的uint8 [H, W, C]
+    """
+    pretreatment = TensorPretreatment(image)
+    if binaryzation != -1:
+        pretreatment.apply(pretreatment.binarization(binaryzation))
+    if median_blur != -1 and median_blur:
+        pretreatment.apply(pretreatment.median_blur(median_blur))
+    if gaussian_blur != -1 and gaussian_blur:
+        pretreatment.apply(pretreatment.gaussian_blur(gaussian_blur))
+    if equalize_hist:
+        pretreatment.apply(pretreatment.equalize_hist)
+    if laplacian:
+        pretreatment.apply(pretreatment.laplacian)
+    if rotate > 0:
+        pretreatment.apply(pretreatment.rotate(rotate))
+    if warp_perspective:
+        pretreatment.apply(pretreatment.warp_perspective)
+    if 0 < sp_noise < 1:
+        pretreatment.apply(pretreatment.sp_noise(sp_noise))
+    return pretreatment.get()
+
+
 if __name__ == '__main__':
     pass
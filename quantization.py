@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+"""
+训练后int8量化：以验证集的一部分样本校准，将compile_graph导出的pb模型转换为int8 TFLite模型，
+并在同一批样本上对比浮点模型与int8模型的准确率、模型大小与单张推理耗时
+用法: python quantization.py <project_name> [graph_path]
+"""
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+import utils.data
+import validation
+from config import *
+from serving import GraphModel, latest_graph_path
+
+
+class Quantization(object):
+    """
+    TFLite输入形状须固定，不定宽模型以max_resize_width为输入宽度，样本右侧补0，
+    CTC解码等不支持int8的OP保留为TensorFlow OP(SELECT_TF_OPS)，其余OP量化为int8
+    已知可转换的组合：各CNNNetwork搭配NoRecurrent(CTC或CrossEntropy)；
+    LSTM/GRU/BiLSTM/BiGRU以v1控制流(while_loop)展开时间步，cuDNN版本依赖GPU内核，转换器均不支持，转换时抛出异常
+    """
+    def __init__(self, model_conf: ModelConfig, feeder: utils.data.DataIterator):
+        """
+        :param model_conf: 工程配置
+        :param feeder: 验证集的数据集迭代器，取其前CalibrationSetNum个样本
+        """
+        self.model_conf = model_conf
+        self.feeder = feeder
+        self.validation = validation.Validation(self.model_conf)
+        self.input_shape = [
+            1, self.model_conf.max_resize_width, self.model_conf.resize[1], self.model_conf.image_channel
+        ]
+        self.inputs, self.labels = self.calibration_set()
+
+    def calibration_set(self):
+        """
+        取验证集前CalibrationSetNum个样本，统一为float32 [N, W, H, C]
+        :return: (输入, 标签)
+        """
+        inputs, labels = [], []
+        for input_batch, label_batch in self.feeder.iter_all():
+            inputs.extend(input_batch)
+            labels.extend(label_batch)
+            if len(labels) >= self.model_conf.calibration_set_num:
+                break
+        inputs, labels = inputs[:self.model_conf.calibration_set_num], labels[:self.model_conf.calibration_set_num]
+        batch = np.zeros([len(inputs)] + self.input_shape[1:], dtype=np.float32)
+        for i, image in enumerate(inputs):
+            image = image[:self.input_shape[1]]
+            # uint8输入管道取出的样本尚未归一化
+            batch[i, :image.shape[0]] = image / 255. if image.dtype == np.uint8 else image
+        return batch, labels
+
+    def representative_dataset(self):
+        for image in self.inputs:
+            yield [image[np.newaxis]]
+
+    def export(self, graph_path):
+        """
+        :param graph_path: compile_graph导出的pb模型路径
+        :return: 同目录下同名的tflite模型路径
+        """
+        converter = tf.lite.TFLiteConverter.from_frozen_graph(
+            graph_path,
+            input_arrays=['input'],
+            output_arrays=['dense_decoded'],
+            input_shapes={'input': self.input_shape}
+        )
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = tf.lite.RepresentativeDataset(self.representative_dataset)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+        tflite_path = graph_path.replace('.pb', '.tflite')
+        with tf.io.gfile.GFile(tflite_path, mode='wb') as gf:
+            gf.write(converter.convert())
+        return tflite_path
+
+    def predict_float(self, graph_path):
+        """浮点pb模型逐张推理，与int8模型的调用方式一致以便对比耗时"""
+        model = GraphModel(self.model_conf, graph_path)
+        decoded, start_time = [], time.time()
+        for image in self.inputs:
+            decoded.append(model.sess.run(model.dense_decoded, feed_dict={model.input: image[np.newaxis]})[0])
+        cost_time = time.time() - start_time
+        model.close()
+        return decoded, cost_time
+
+    def predict_int8(self, tflite_path):
+        interpreter = tf.lite.Interpreter(model_path=tflite_path)
+        interpreter.allocate_tensors()
+        input_index = interpreter.get_input_details()[0]['index']
+        output_index = interpreter.get_output_details()[0]['index']
+        decoded, start_time = [], time.time()
+        for image in self.inputs:
+            interpreter.set_tensor(input_index, image[np.newaxis])
+            interpreter.invoke()
+            decoded.append(interpreter.get_tensor(output_index)[0])
+        return decoded, time.time() - start_time
+
+    @staticmethod
+    def dense(decoded):
+        """各样本解码长度不一，以-1补齐为矩阵"""
+        result = np.full((len(decoded), max([len(row) for row in decoded] + [1])), -1, dtype=np.int64)
+        for i, row in enumerate(decoded):
+            result[i, :len(row)] = row
+        return result
+
+    def evaluate(self, graph_path, tflite_path):
+        """
+        :return: {'float': (准确率, 模型字节数, 单张耗时ms), 'int8': (...), 'delta': int8相对浮点的准确率差}
+        """
+        report = {}
+        for name, path, predict in [
+            ('float', graph_path, self.predict_float), ('int8', tflite_path, self.predict_int8)
+        ]:
+            decoded, cost_time = predict(path)
+            accuracy = self.validation.accuracy_calculation(self.labels, self.dense(decoded))
+            report[name] = accuracy, os.path.getsize(path), cost_time * 1000 / max(len(self.labels), 1)
+        report['delta'] = report['int8'][0] - report['float'][0]
+        return report
+
+    def run(self, graph_path):
+        """导出int8模型并输出对比结果"""
+        tflite_path = self.export(graph_path)
+        report = self.evaluate(graph_path, tflite_path)
+        for name in ['float', 'int8']:
+            accuracy, size, latency = report[name]
+            tf.logging.info('Quantization - {}: Accuracy = {:.4f}, Size = {:.2f} MB, Latency = {:.3f} ms'.format(
+                name, accuracy, size / 1024 / 1024, latency
+            ))
+        tf.logging.info('Quantization - {} samples, Accuracy Delta = {:+.4f}, Saved: {}'.format(
+            len(self.labels), report['delta'], tflite_path
+        ))
+        return tflite_path, report
+
+
+def main(argv):
+    model_conf = ModelConfig(project_name=argv[1])
+    graph_path = argv[2] if len(argv) > 2 else latest_graph_path(model_conf)
+    feeder = utils.data.DataIterator(model_conf=model_conf, mode=RunMode.Validation)
+    feeder.read_sample_from_tfrecords(model_conf.validation_path[DatasetType.TFRecords])
+    Quantization(model_conf, feeder).run(graph_path)
+
+
+if __name__ == '__main__':
+    tf.logging.set_verbosity(tf.logging.INFO)
+    main(sys.argv)
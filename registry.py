@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+"""
+多模型注册表：扫描工程out目录下compile_graph导出的 graph/<ModelName>_<acc>.pb 与 model/<ModelName>_model.yaml，
+每个模型独立计算图与会话，按模型名或图片尺寸(ImageWidth/ImageHeight)路由，新的pb文件在运行中热替换
+用法: python registry.py <output_path[,output_path...]> [port] [max_batch_size] [max_latency_ms] [reload_interval]
+"""
+import io
+import sys
+import glob
+import threading
+import concurrent.futures
+import PIL.Image
+import tensorflow as tf
+from config import *
+from http.server import ThreadingHTTPServer
+from serving import GraphModel, InferenceServer, BatcherClosed, request_handler
+
+
+class ModelRegistry(object):
+    """
+    以ModelName(去除准确率后缀)为键管理已加载的模型，同名模型仅保留最近修改的pb，
+    热替换时先切换路由再关闭旧模型，旧模型已入队的请求处理完毕后才释放会话
+    """
+    def __init__(self, output_paths, max_batch_size=64, max_latency=0.005, reload_interval=5):
+        """
+        :param output_paths: 工程的out目录列表
+        :param max_batch_size: 各模型单次推理的最大批次
+        :param max_latency: 各模型等待合批的最长时间(秒)
+        :param reload_interval: 扫描新模型的间隔(秒)，0表示不热加载
+        """
+        self.output_paths = output_paths
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.reload_interval = reload_interval
+        self.lock = threading.Lock()
+        self.servers = {}
+        self.versions = {}
+        self.stopped = threading.Event()
+        self.session_config = tf.compat.v1.ConfigProto(
+            # 所有会话共用进程级线程池，避免每个模型各自创建一组线程
+            use_per_session_threads=False,
+            allow_soft_placement=True,
+            gpu_options=tf.compat.v1.GPUOptions(allow_growth=True)
+        )
+        self.reload()
+        self.thread = None
+        if reload_interval > 0:
+            self.thread = threading.Thread(target=self.watch, name='ModelRegistry', daemon=True)
+            self.thread.start()
+
+    @staticmethod
+    def model_name(graph_path):
+        """<ModelName>_<acc>.pb -> ModelName"""
+        name = os.path.splitext(os.path.basename(graph_path))[0]
+        prefix, _, suffix = name.rpartition('_')
+        return prefix if prefix and suffix.isdigit() else name
+
+    def discover(self):
+        """
+        扫描各out目录
+        :return: {ModelName: (pb路径, 配置路径, out目录)}，同名取最近修改的pb
+        """
+        found = {}
+        for output_path in self.output_paths:
+            for graph_path in glob.glob(os.path.join(output_path, 'graph', '*.pb')):
+                name = self.model_name(graph_path)
+                conf_path = os.path.join(output_path, 'model', '{}_model.yaml'.format(name))
+                if not os.path.exists(conf_path):
+                    continue
+                if name in found and os.path.getmtime(found[name][0]) >= os.path.getmtime(graph_path):
+                    continue
+                found[name] = graph_path, conf_path, output_path
+        return found
+
+    def load(self, graph_path, conf_path, output_path) -> InferenceServer:
+        project_path = os.path.dirname(os.path.abspath(output_path))
+        model_conf = ModelConfig(
+            project_name=os.path.basename(project_path),
+            project_path=project_path,
+            model_conf_path=conf_path
+        )
+        model = GraphModel(model_conf, graph_path, session_config=self.session_config)
+        return InferenceServer(model, max_batch_size=self.max_batch_size, max_latency=self.max_latency)
+
+    def reload(self):
+        """加载新增或更新的模型，卸载pb已被删除的模型"""
+        found = self.discover()
+        for name, (graph_path, conf_path, output_path) in found.items():
+            version = graph_path, os.path.getmtime(graph_path)
+            if self.versions.get(name) == version:
+                continue
+            try:
+                server = self.load(graph_path, conf_path, output_path)
+            except Exception as e:
+                # 文件可能仍在写入，保留旧模型，下次扫描重试
+                tf.compat.v1.logging.warn('Failed to load {}: {}'.format(graph_path, e))
+                continue
+            with self.lock:
+                previous = self.servers.get(name)
+                self.servers[name] = server
+                self.versions[name] = version
+            tf.compat.v1.logging.info('Model {} loaded from {}'.format(name, graph_path))
+            if previous:
+                previous.close()
+        for name in [name for name in self.servers if name not in found]:
+            with self.lock:
+                previous = self.servers.pop(name)
+                self.versions.pop(name)
+            tf.compat.v1.logging.info('Model {} unloaded'.format(name))
+            previous.close()
+
+    def watch(self):
+        while not self.stopped.wait(self.reload_interval):
+            self.reload()
+
+    def route(self, image_bytes, model_name=None) -> InferenceServer:
+        """
+        指定model_name时按名称路由，否则按图片尺寸匹配配置中的ImageWidth/ImageHeight
+        :raises KeyError: 没有匹配的模型
+        """
+        with self.lock:
+            if model_name is not None:
+                if model_name not in self.servers:
+                    raise KeyError('Model {} not found'.format(model_name))
+                return self.servers[model_name]
+            size = PIL.Image.open(io.BytesIO(image_bytes)).size
+            for name in sorted(self.servers):
+                model_conf = self.servers[name].model.model_conf
+                if (model_conf.image_width, model_conf.image_height) == size:
+                    return self.servers[name]
+        raise KeyError('No model matches image size {}x{}'.format(*size))
+
+    def submit(self, image_bytes, model_name=None) -> concurrent.futures.Future:
+        while True:
+            server = self.route(image_bytes, model_name)
+            try:
+                return server.batcher.submit(image_bytes)
+            except BatcherClosed:
+                # 路由到的模型恰好被替换，改用新模型
+                continue
+
+    def predict(self, image_bytes, model_name=None) -> str:
+        return self.submit(image_bytes, model_name).result()
+
+    def predict_many(self, images, model_name=None) -> list:
+        futures = [self.submit(image, model_name) for image in images]
+        return [future.result() for future in futures]
+
+    @property
+    def model_names(self):
+        with self.lock:
+            return sorted(self.servers)
+
+    def serve(self, host='0.0.0.0', port=19952):
+        tf.compat.v1.logging.info('Serving {} on {}:{}'.format(self.model_names, host, port))
+        ThreadingHTTPServer((host, port), request_handler(self)).serve_forever()
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            servers, self.servers, self.versions = list(self.servers.values()), {}, {}
+        for server in servers:
+            server.close()
+
+
+def main(argv):
+    output_paths = argv[1].split(',')
+    port = int(argv[2]) if len(argv) > 2 else 19952
+    max_batch_size = int(argv[3]) if len(argv) > 3 else 64
+    max_latency = (float(argv[4]) if len(argv) > 4 else 5) / 1000
+    reload_interval = float(argv[5]) if len(argv) > 5 else 5
+    ModelRegistry(
+        output_paths,
+        max_batch_size=max_batch_size,
+        max_latency=max_latency,
+        reload_interval=reload_interval
+    ).serve(port=port)
+
+
+if __name__ == '__main__':
+    tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.INFO)
+    main(sys.argv)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+"""
+批量推理服务：加载compile_graph导出的pb模型，将并发请求在时延预算内合并为批次后统一推理
+用法: python serving.py <project_name> [port] [max_batch_size] [max_latency_ms]
+"""
+import sys
+import json
+import time
+import glob
+import queue
+import base64
+import threading
+import urllib.parse
+import concurrent.futures
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import tensorflow as tf
+from config import *
+from constants import RunMode
+from encoder import Encoder
+
+
+class BatcherClosed(RuntimeError):
+    """批处理器已关闭(模型被热替换或卸载)，调用方应改用当前的模型重试"""
+
+
+def latest_graph_path(model_conf: ModelConfig):
+    """工程中最近一次编译的pb模型路径"""
+    graph_paths = glob.glob(os.path.join(model_conf.compile_model_path, "{}_*.pb".format(model_conf.model_name)))
+    if not graph_paths:
+        raise FileNotFoundError("No compiled graph found in {}".format(model_conf.compile_model_path))
+    return max(graph_paths, key=os.path.getmtime)
+
+
+class GraphModel(object):
+    """
+    pb模型：输入OP为input，输出OP为dense_decoded
+    输入为图片字节流(ExportInput: Bytes)时请求直接原样入图，uint8输入时仅在主机端解码并缩放
+    """
+    def __init__(self, model_conf: ModelConfig, graph_path, session_config=None):
+        """
+        :param model_conf: 模型配置
+        :param graph_path: compile_graph导出的pb模型路径
+        :param session_config: 可选，会话配置
+        """
+        self.model_conf = model_conf
+        self.graph_path = graph_path
+        self.encoder = Encoder(model_conf=model_conf, mode=RunMode.Predict)
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            graph_def = tf.compat.v1.GraphDef()
+            with tf.io.gfile.GFile(graph_path, "rb") as f:
+                graph_def.ParseFromString(f.read())
+            tf.import_graph_def(graph_def, name="")
+        self.graph.finalize()
+        self.sess = tf.compat.v1.Session(graph=self.graph, config=session_config)
+        self.input = self.graph.get_tensor_by_name('input:0')
+        self.dense_decoded = self.graph.get_tensor_by_name('dense_decoded:0')
+        self.input_dtype = self.input.dtype
+
+    def encode(self, image_bytes):
+        """
+        图片字节流编码为网络输入
+        :return: float [W, H, C]，uint8输入为缩放后的 uint8 [H, W, C]，字节流输入原样返回
+        """
+        if self.input_dtype == tf.string:
+            return image_bytes
+        if self.input_dtype == tf.uint8:
+            image = self.encoder.image(image_bytes, raw=True)
+            return image.reshape(image.shape[:2] + (-1,))
+        return self.encoder.image(image_bytes)
+
+    def pad_batch(self, arrays):
+        """不定宽输入以当前批次的最大宽度右侧补0，与训练时的padding一致，字节流输入由计算图补齐"""
+        if self.input_dtype == tf.string:
+            return np.array(arrays, dtype=object)
+        axis = 1 if self.input_dtype == tf.uint8 else 0
+        max_width = max([array.shape[axis] for array in arrays])
+        shape = list(arrays[0].shape)
+        shape[axis] = max_width
+        batch = np.zeros([len(arrays)] + shape, dtype=self.input_dtype.as_numpy_dtype)
+        for i, array in enumerate(arrays):
+            if axis:
+                batch[i, :, :array.shape[1]] = array
+            else:
+                batch[i, :array.shape[0]] = array
+        return batch
+
+    def decode(self, dense_decoded):
+        """dense_decoded批量解码为字符串"""
+        return self.model_conf.category_table.decode_batch(dense_decoded, self.model_conf.output_split)
+
+    def predict_arrays(self, arrays):
+        """已编码的输入批次推理"""
+        dense_decoded = self.sess.run(self.dense_decoded, feed_dict={self.input: self.pad_batch(arrays)})
+        return self.decode(np.asarray(dense_decoded).reshape(len(arrays), -1))
+
+    def predict(self, images):
+        """图片字节流批次推理"""
+        return self.predict_arrays([self.encode(image) for image in images])
+
+    def close(self):
+        self.sess.close()
+
+
+class MicroBatcher(object):
+    """
+    动态批处理：请求线程各自完成图片编码后入队，
+    推理线程取出第一个请求后在时延预算内继续收集，达到批次上限或超时即合并推理
+    """
+    def __init__(self, model: GraphModel, max_batch_size=64, max_latency=0.005):
+        """
+        :param model: pb模型
+        :param max_batch_size: 单次推理的最大批次
+        :param max_latency: 首个请求入队后等待合批的最长时间(秒)
+        """
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name='MicroBatcher', daemon=True)
+        self.thread.start()
+
+    def submit(self, image_bytes) -> concurrent.futures.Future:
+        """
+        提交一张图片，返回预测结果的Future，图片无法解码时Future携带异常
+        :raises BatcherClosed: 批处理器已关闭
+        """
+        future = concurrent.futures.Future()
+        try:
+            array = self.model.encode(image_bytes)
+        except Exception as e:
+            future.set_exception(e)
+            return future
+        with self.lock:
+            if self.closed:
+                raise BatcherClosed('{} is closed'.format(self.model.graph_path))
+            self.queue.put((array, future))
+        return future
+
+    def collect(self):
+        """收集一个批次的请求，遇到关闭标记(None)时停止收集并将其保留在批次末尾"""
+        batch = [self.queue.get()]
+        deadline = time.time() + self.max_latency
+        while len(batch) < self.max_batch_size and batch[-1] is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.collect()
+            stop = batch[-1] is None
+            batch = batch[:-1] if stop else batch
+            if batch:
+                self.predict(batch)
+            if stop:
+                return
+
+    def predict(self, batch):
+        """合并推理一个批次并回填各请求的Future"""
+        arrays, futures = zip(*batch)
+        try:
+            for future, result in zip(futures, self.model.predict_arrays(list(arrays))):
+                future.set_result(result)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+
+    def close(self):
+        """停止接收新请求，已入队的请求全部完成后返回"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.queue.put(None)
+        self.thread.join()
+
+
+class InferenceServer(object):
+    """推理服务的Python接口，predict可由多个线程并发调用"""
+    def __init__(self, model: GraphModel, max_batch_size=64, max_latency=0.005):
+        self.model = model
+        self.batcher = MicroBatcher(model, max_batch_size=max_batch_size, max_latency=max_latency)
+
+    def predict(self, image_bytes, model_name=None) -> str:
+        """
+        :param model_name: 与ModelRegistry的接口一致，单模型服务忽略该参数
+        """
+        return self.batcher.submit(image_bytes).result()
+
+    def predict_many(self, images, model_name=None) -> list:
+        """多张图片一同入队，与其他请求合并推理"""
+        futures = [self.batcher.submit(image) for image in images]
+        return [future.result() for future in futures]
+
+    def close(self):
+        """处理完已入队的请求后释放会话"""
+        self.batcher.close()
+        self.model.close()
+
+    def serve(self, host='0.0.0.0', port=19952):
+        tf.compat.v1.logging.info('Serving {} on {}:{}'.format(self.model.graph_path, host, port))
+        ThreadingHTTPServer((host, port), request_handler(self)).serve_forever()
+
+
+def request_handler(target):
+    """
+    HTTP请求处理类，target需提供predict(image_bytes, model_name=None)与predict_many(images, model_name=None)
+    :param target: InferenceServer或ModelRegistry
+    """
+    class PredictHandler(BaseHTTPRequestHandler):
+        """
+        POST /predict[?model_name=...]
+        请求体为图片字节流，或JSON: {"image": base64} / {"images": [base64, ...]}，可附带"model_name"
+        返回JSON: {"success": bool, "message": 预测结果或错误信息}
+        """
+        def reply(self, code, success, message):
+            body = json.dumps({"success": success, "message": message}, ensure_ascii=False).encode('utf8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            url = urllib.parse.urlparse(self.path)
+            if url.path.rstrip('/') != '/predict':
+                return self.reply(404, False, 'Not Found')
+            # 仅转发model_name，其余查询参数忽略
+            model_name = urllib.parse.parse_qs(url.query).get('model_name', [None])[0]
+            content = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            try:
+                if 'json' in self.headers.get('Content-Type', ''):
+                    data = json.loads(content.decode('utf8'))
+                    if 'model_name' in data:
+                        model_name = data['model_name']
+                    if 'images' in data:
+                        images = [base64.b64decode(image) for image in data['images']]
+                        return self.reply(200, True, target.predict_many(images, model_name=model_name))
+                    content = base64.b64decode(data['image'])
+                return self.reply(200, True, target.predict(content, model_name=model_name))
+            except (ValueError, KeyError, TypeError, OSError) as e:
+                return self.reply(400, False, str(e))
+            except Exception as e:
+                return self.reply(500, False, str(e))
+
+        def log_message(self, format, *args):
+            pass
+
+    return PredictHandler
+
+
+def main(argv):
+    model_conf = ModelConfig(project_name=argv[1])
+    port = int(argv[2]) if len(argv) > 2 else 19952
+    max_batch_size = int(argv[3]) if len(argv) > 3 else 64
+    max_latency = (float(argv[4]) if len(argv) > 4 else 5) / 1000
+    model = GraphModel(model_conf, latest_graph_path(model_conf))
+    InferenceServer(model, max_batch_size=max_batch_size, max_latency=max_latency).serve(port=port)
+
+
+if __name__ == '__main__':
+    tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.INFO)
+    main(sys.argv)
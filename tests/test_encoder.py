@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import io
+import os
+import sys
+import types
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+tf = pytest.importorskip("tensorflow")
+
+from constants import RunMode, ExportInput
+from encoder import Encoder
+
+
+def export_shape(resize, export_input, image_channel=1):
+    model_conf = types.SimpleNamespace(
+        category_param='NUMERIC',
+        category_table=None,
+        resize=resize,
+        image_channel=image_channel,
+        max_resize_width=resize[0] if resize[0] != -1 else resize[1] * 6,
+    )
+    with tf.Graph().as_default():
+        _, images = Encoder(model_conf, RunMode.Predict).export_tensor(export_input)
+        return images.get_shape().as_list()
+
+
+@pytest.mark.parametrize("export_input", [ExportInput.Bytes, ExportInput.UInt8])
+def test_fixed_size_export_has_static_width(export_input):
+    # CrossEntropy的FullConnectedCNN需要静态的宽度
+    assert export_shape([150, 50], export_input) == [None, 150, 50, 1]
+
+
+def test_variable_width_export_keeps_height_and_channel():
+    assert export_shape([-1, 64], ExportInput.Bytes, image_channel=3) == [None, None, 64, 3]
+
+
+def encode_bytes(images, resize, image_channel):
+    """以导出的Bytes输入图与image函数分别编码同一批图片"""
+    np = pytest.importorskip("numpy")
+    pytest.importorskip("cv2")
+    model_conf = types.SimpleNamespace(
+        category_param='NUMERIC', category_table=None, resize=resize, image_channel=image_channel,
+        max_resize_width=resize[0] if resize[0] != -1 else resize[1] * 2,
+    )
+    encoder = Encoder(model_conf, RunMode.Predict)
+    with tf.Graph().as_default():
+        inputs, tensor = encoder.export_tensor(ExportInput.Bytes)
+        with tf.compat.v1.Session() as sess:
+            exported = sess.run(tensor, feed_dict={inputs: images})
+    expected = [np.asarray(encoder.image(image), dtype=np.float32) for image in images]
+    return exported, expected
+
+
+def png_bytes(width, height, seed):
+    np = pytest.importorskip("numpy")
+    pil_image = pytest.importorskip("PIL.Image")
+    pixels = np.random.RandomState(seed).randint(0, 256, (height, width, 3)).astype(np.uint8)
+    stream = io.BytesIO()
+    pil_image.fromarray(pixels).save(stream, format='PNG')
+    return stream.getvalue()
+
+
+@pytest.mark.parametrize("resize, image_channel", [([150, 50], 1), ([150, 50], 3), ([-1, 32], 1)])
+def test_bytes_export_matches_image(resize, image_channel):
+    # 导出模型的图内预处理须与训练时的image函数一致，差异仅来自uint8的取整
+    images = [png_bytes(120, 40, 0), png_bytes(90, 45, 1)]
+    exported, expected = encode_bytes(images, resize, image_channel)
+    for batch_image, image in zip(exported, expected):
+        width = image.shape[0]
+        assert abs(batch_image[:width] - image).max() <= 1.5 / 255
+        assert not batch_image[width:].any()
+
+
+def test_variable_width_export_pads_to_widest_image():
+    # 宽于MaxResizeWidth估计值的图片不被裁剪
+    images = [png_bytes(300, 30, 0), png_bytes(60, 30, 1)]
+    exported, expected = encode_bytes(images, [-1, 30], 1)
+    assert exported.shape[1] == expected[0].shape[0] == 300
+    assert expected[1].shape[0] == 60
+
+
+def test_image_batch_augments_before_resize(monkeypatch):
+    # 与image函数一致，增广作用于缩放前的原图
+    np = pytest.importorskip("numpy")
+    model_conf = types.SimpleNamespace(
+        category_param='NUMERIC', category_table=None, resize=[150, 50], image_channel=1
+    )
+    encoder = Encoder(model_conf, RunMode.Trains)
+    shapes = []
+
+    def _batch_preprocessing(images):
+        shapes.append(images.shape[1:])
+        return 255 - images
+
+    monkeypatch.setattr(encoder, 'batch_preprocessing', _batch_preprocessing)
+    monkeypatch.setattr(np.random, 'random_sample', lambda n: np.zeros(n))
+    images = [np.zeros((30, 100), dtype=np.uint8), np.zeros((40, 120), dtype=np.uint8)]
+    batch = encoder.image_batch(images, normalize=False)
+    assert sorted(shapes) == [(30, 100), (40, 120)]
+    assert batch.shape == (2, 150, 50, 1)
+    assert (batch == 255).all()
+
+
+@pytest.mark.parametrize("label_split, max_label_num, loss_func, labels", [
+    ('', 4, 'CTC', [b'aB3a', b'aa11', b'z']),
+    ('', 4, 'CrossEntropy', [b'aB3a', b'0000']),
+    ('|', 3, 'CTC', [b'a|b|b', b'1|2']),
+    ('', 1, 'CrossEntropy', [b'Q']),
+])
+def test_text_tensor_matches_text(label_split, max_label_num, loss_func, labels):
+    # 图内标签编码与text函数一致，含大小写转换与CTC的连续字符空白符
+    from category import CategoryTable
+    from constants import LabelFrom, LossFunction
+    categories = list('0123456789abcdefghijklmnopqrstuvwxyz')
+    model_conf = types.SimpleNamespace(
+        category_param='ALPHANUMERIC_LOWER', category_table=CategoryTable(categories),
+        category_num=len(categories), label_from=LabelFrom.FileName, label_split=label_split,
+        max_label_num=max_label_num, loss_func=LossFunction(loss_func),
+    )
+    if max_label_num == 1:
+        model_conf.category_param = 'CUSTOM'
+        model_conf.category_table = CategoryTable(categories + ['Q'])
+    encoder = Encoder(model_conf, RunMode.Trains)
+    with tf.Graph().as_default():
+        table = encoder.category_lookup()
+        content = tf.compat.v1.placeholder(tf.string, [])
+        label = encoder.text_tensor(content, table)
+        with tf.compat.v1.Session() as sess:
+            sess.run(tf.compat.v1.tables_initializer())
+            for text in labels:
+                expected = encoder.text(text, extracted=True)
+                assert sess.run(label, feed_dict={content: text}).tolist() == list(expected)
+            with pytest.raises(tf.errors.InvalidArgumentError):
+                sess.run(label, feed_dict={content: b'a#'})
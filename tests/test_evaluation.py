@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import os
+import sys
+import types
+import threading
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+pytest.importorskip("tensorflow")
+
+from evaluation import Evaluation
+
+
+def failing_evaluation():
+    evaluator = Evaluation.__new__(Evaluation)
+    evaluator.thread, evaluator.sess, evaluator.error, evaluator.result = None, None, None, None
+    evaluator.graph = object()
+
+    def _restore(sess, snapshot):
+        raise RuntimeError('corrupted snapshot')
+
+    evaluator.saver = types.SimpleNamespace(restore=_restore)
+    return evaluator
+
+
+def test_async_error_is_raised_at_close():
+    evaluator = failing_evaluation()
+    evaluator.thread = threading.Thread(target=evaluator.run, args=('snapshot', 100, 1))
+    evaluator.thread.start()
+    with pytest.raises(RuntimeError, match='corrupted snapshot'):
+        evaluator.close()
+    # 异常只抛出一次
+    evaluator.close()
+
+
+def test_async_error_is_raised_on_next_start():
+    evaluator = failing_evaluation()
+    evaluator.run('snapshot', 100, 1)
+    with pytest.raises(RuntimeError, match='corrupted snapshot'):
+        evaluator.start(sess=None, saver=None, step=200, epoch=1)
+
+
+def test_full_evaluation_runs_snapshot_synchronously(tmp_path):
+    # Full模式在调用线程中评估快照，异常立即抛出
+    evaluator = failing_evaluation()
+    evaluator.snapshot_path = str(tmp_path / 'evaluation' / 'model')
+    saved = []
+    saver = types.SimpleNamespace(save=lambda sess, path, global_step: saved.append(global_step) or path)
+    with pytest.raises(RuntimeError, match='corrupted snapshot'):
+        evaluator.evaluate_snapshot(sess=None, saver=saver, step=300, epoch=1)
+    assert saved == [300] and evaluator.thread is None
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import io
+import os
+import sys
+import types
+import multiprocessing
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+pytest.importorskip("tensorflow")
+pytest.importorskip("cv2")
+np = pytest.importorskip("numpy")
+PIL_Image = pytest.importorskip("PIL.Image")
+
+import utils.pool
+from category import CategoryTable
+from constants import RunMode, DatasetType, ModelField, LossFunction, LabelFrom, InputPipeline
+
+BATCH_SIZE = 32
+GRAY = 128
+
+_BUILD_BATCH = utils.pool._build_batch
+_BARRIER = None
+
+
+def _synchronized_build_batch(slot, _input, _label):
+    # 两个任务都被取走后才开始编码，保证两个批次分别由两个子进程构建
+    _BARRIER.wait(timeout=30)
+    return _BUILD_BATCH(slot, _input, _label)
+
+
+def pool_model_conf():
+    return types.SimpleNamespace(
+        trains_path={DatasetType.TFRecords: []},
+        validation_path={DatasetType.TFRecords: []},
+        batch_size=BATCH_SIZE,
+        validation_batch_size=BATCH_SIZE,
+        input_pipeline=InputPipeline.Feed,
+        model_field=ModelField.Image,
+        category_param='NUMERIC',
+        category_table=CategoryTable(list('0123456789')),
+        category_num=10,
+        resize=[100, 30],
+        max_resize_width=100,
+        image_channel=1,
+        uint8_input=True,
+        batch_encoding=True,
+        loss_func=LossFunction.CTC,
+        max_label_num=2,
+        label_from=LabelFrom.FileName,
+        label_split='',
+        extract_regex='.*?(?=_)',
+        # 只开启固定阈值的二值化：灰度128的图片被增广后变为全255，未增广时保持128
+        binaryzation=[100, 100],
+        median_blur=-1,
+        gaussian_blur=-1,
+        equalize_hist=False,
+        laplace=False,
+        rotate=-1,
+        warp_perspective=False,
+        sp_noise=-1,
+    )
+
+
+def gray_png(size=(120, 36)):
+    output = io.BytesIO()
+    PIL_Image.new('L', size, GRAY).save(output, format='PNG')
+    return output.getvalue()
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="fork start method is not available")
+def test_batch_pool_workers_round_trip_and_draw_different_augment_masks(monkeypatch):
+    global _BARRIER
+    _BARRIER = multiprocessing.Barrier(2)
+    monkeypatch.setattr(utils.pool, '_build_batch', _synchronized_build_batch)
+    # 父进程的随机状态固定，子进程未重新播种时两个批次的增广掩码完全相同
+    np.random.seed(0)
+    pool = utils.pool.BatchPool(pool_model_conf(), RunMode.Trains, BATCH_SIZE, workers=2)
+    try:
+        raw_input, raw_label = [gray_png()] * BATCH_SIZE, [b'12'] * BATCH_SIZE
+        pool.submit(raw_input, raw_label)
+        pool.submit(raw_input, raw_label)
+        batches = [pool.get(), pool.get()]
+    finally:
+        pool.close()
+    assert len(pool.free_slots) == 2
+
+    masks = []
+    for input_batch, label_batch in batches:
+        assert input_batch.shape == (BATCH_SIZE, 100, 30, 1)
+        assert input_batch.dtype == np.uint8
+        assert [list(label) for label in label_batch] == [[1, 2]] * BATCH_SIZE
+        # 共享缓冲区取回的每个样本都是完整的常量图片：未增广为128，增广为255
+        first_pixel = input_batch[:, :1, :1, :]
+        assert np.all(input_batch == first_pixel)
+        assert set(np.unique(first_pixel)) <= {GRAY, 255}
+        masks.append(first_pixel.ravel() == 255)
+
+    assert not np.array_equal(masks[0], masks[1])
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import os
+import sys
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+tf = pytest.importorskip("tensorflow")
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+
+from pretreatment import TensorPretreatment
+
+
+def gray_image(seed=0, shape=(40, 120)):
+    return np.random.RandomState(seed).randint(0, 256, shape).astype(np.uint8)
+
+
+def run(fn, image, times=1):
+    """以[H, W, 1]张量调用fn，返回各次运行的[H, W]结果"""
+    with tf.Graph().as_default():
+        tensor = tf.constant(image[:, :, np.newaxis])
+        output = fn(TensorPretreatment(tensor), tensor)
+        with tf.compat.v1.Session() as sess:
+            return [sess.run(output)[:, :, 0] for _ in range(times)]
+
+
+def test_equalize_hist_matches_opencv():
+    image = gray_image()
+    output, = run(lambda p, t: p.equalize_hist(t), image)
+    assert np.array_equal(output, cv2.equalizeHist(image))
+
+
+def test_laplacian_matches_opencv():
+    image = gray_image(1)
+    output, = run(lambda p, t: p.laplacian(t), image)
+    assert np.array_equal(output, cv2.convertScaleAbs(cv2.Laplacian(image, cv2.CV_16S, ksize=3)))
+
+
+def test_median_blur_matches_opencv():
+    # MedianBlur=3时核尺寸随机为1或3
+    image = gray_image(2)
+    expected = [image, cv2.medianBlur(image, 3)]
+    for output in run(lambda p, t: p.median_blur(3)(t), image, times=10):
+        assert any(np.array_equal(output, i) for i in expected)
+
+
+def test_gaussian_blur_matches_opencv():
+    image = gray_image(3)
+    expected = [image, cv2.GaussianBlur(image, (3, 3), 0)]
+    for output in run(lambda p, t: p.gaussian_blur(3)(t), image, times=10):
+        assert min(np.abs(output.astype(np.int32) - i).max() for i in expected) <= 1
+
+
+def test_binarization_matches_opencv():
+    image = gray_image(4)
+    output, = run(lambda p, t: p.binarization(128)(t), image)
+    assert np.array_equal(output, cv2.threshold(image, 128, 255, cv2.THRESH_BINARY)[1])
+
+
+def test_warp_identity_keeps_image():
+    image = gray_image(5)
+    output, = run(lambda p, t: p.warp(t, np.eye(3), replicate=False), image)
+    assert np.array_equal(output, image)
@@ -24,12 +24,15 @@ from __future__ import division
 from __future__ import print_function
 import copy
 import re
+import time
 import six
 
 from tensorflow.core.framework import attr_value_pb2
 from tensorflow.core.framework import graph_pb2
 from tensorflow.core.framework import node_def_pb2
+from tensorflow.python.client import session
 from tensorflow.python.framework import dtypes
+from tensorflow.python.framework import importer
 from tensorflow.python.framework import ops
 from tensorflow.python.framework import tensor_util
 from tensorflow.python.platform import tf_logging as logging
@@ -471,3 +474,71 @@ def remove_training_nodes(input_graph, protected_nodes=None):
     output_graph = graph_pb2.GraphDef()
     output_graph.node.extend(nodes_after_splicing)
     return output_graph
+
+
+# Export-time passes run after remove_training_nodes, in order. Constants are
+# folded first so that the BatchNormalization arithmetic in inference mode
+# collapses into a constant Mul/Add that fold_batch_norms can merge into the
+# preceding Conv2D/MatMul weights, fold_old_batch_norms handles the fused
+# FusedBatchNorm form, and a second fold_constants pass cleans up what the
+# folding exposed. strip_unused_nodes is left out on purpose: it recreates the
+# input placeholders as float, and convert_variables_to_constants has already
+# pruned everything that does not feed the outputs.
+INFERENCE_TRANSFORMS = [
+    "remove_nodes(op=Identity, op=CheckNumerics, op=StopGradient)",
+    "fold_constants(ignore_errors=true)",
+    "fold_batch_norms",
+    "fold_old_batch_norms",
+    "fold_constants(ignore_errors=true)",
+    "sort_by_execution_order",
+]
+
+
+def optimize_for_inference(input_graph_def, input_names, output_names,
+                           transforms=None):
+    """Rewrites a frozen graph for inference.
+    Strips training-only nodes (CheckNumerics, Identity chains, Dropout in
+    inference mode), folds constants and folds BatchNormalization into the
+    weights of the preceding convolution.
+    Args:
+      input_graph_def: Frozen GraphDef, e.g. from convert_variables_to_constants.
+      input_names: List of input node names.
+      output_names: List of output node names, kept unconditionally.
+      transforms: Optional list of graph transforms, defaults to
+        INFERENCE_TRANSFORMS.
+    Returns:
+      The optimized GraphDef.
+    """
+    # Imported lazily so that builds without the graph_transforms module can
+    # still import this file and fall back to the unoptimized graph.
+    from tensorflow.tools.graph_transforms import TransformGraph
+    pruned_graph_def = remove_training_nodes(
+        input_graph_def, protected_nodes=input_names + output_names)
+    return TransformGraph(
+        pruned_graph_def, input_names, output_names,
+        transforms if transforms else INFERENCE_TRANSFORMS)
+
+
+def graph_latency(graph_def, feed, output_name, steps=20, warmup=3):
+    """Measures the latency of running a GraphDef on a fixed feed.
+    Args:
+      graph_def: GraphDef to import.
+      feed: Dict of tensor name to numpy value.
+      output_name: Name of the tensor to fetch.
+      steps: Number of timed runs.
+      warmup: Number of untimed runs before timing.
+    Returns:
+      A tuple of (mean latency in milliseconds, last output value).
+    """
+    graph = ops.Graph()
+    with graph.as_default():
+        importer.import_graph_def(graph_def, name="")
+    with session.Session(graph=graph) as sess:
+        output = graph.get_tensor_by_name(output_name)
+        feed_dict = {graph.get_tensor_by_name(k): v for k, v in feed.items()}
+        for _ in range(warmup):
+            result = sess.run(output, feed_dict=feed_dict)
+        start = time.time()
+        for _ in range(steps):
+            result = sess.run(output, feed_dict=feed_dict)
+        return (time.time() - start) * 1000 / steps, result
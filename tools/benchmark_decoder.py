@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+"""
+CTC解码器基准：以工程最近的检查点对验证集计算一次logits，再分别以贪心解码与各束宽的束搜索解码，
+报告准确率相对贪心解码的提升与每个样本增加的解码耗时，DecodeCharset与定长约束沿用工程配置
+用法: python tools/benchmark_decoder.py <project_name> [beam_widths: 1,2,4,8,16,32]
+"""
+import os
+import sys
+import copy
+import time
+import numpy as np
+import tensorflow as tf
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import core
+import utils.data
+import validation
+from config import ModelConfig
+from constants import RunMode, LossFunction, DecoderType, DatasetType
+from decoder import Decoder
+
+
+def compute_logits(model_conf: ModelConfig):
+    """
+    :return: [(logits [T, N, C], 序列长度 [N], 标签批次)]
+    """
+    feeder = utils.data.DataIterator(model_conf=model_conf, mode=RunMode.Validation)
+    feeder.read_sample_from_tfrecords(model_conf.validation_path[DatasetType.TFRecords])
+    graph = tf.Graph()
+    with graph.as_default():
+        model = core.NeuralNetwork(
+            model_conf=model_conf,
+            mode=RunMode.Predict,
+            cnn=model_conf.neu_cnn,
+            recurrent=model_conf.neu_recurrent
+        )
+        model.build_graph()
+        saver = tf.train.Saver(var_list=tf.global_variables())
+    batches = []
+    with tf.compat.v1.Session(graph=graph) as sess:
+        tf.keras.backend.set_session(session=sess)
+        saver.restore(sess, tf.train.latest_checkpoint(model_conf.model_root_path))
+        for input_batch, label_batch in feeder.iter_all():
+            if input_batch.dtype == np.uint8:
+                input_batch = input_batch.astype(np.float32) / 255.
+            logits, seq_len = sess.run([model.outputs, model.seq_len], feed_dict={model.inputs: input_batch})
+            batches.append((logits, seq_len, label_batch))
+    return batches
+
+
+def run(model_conf: ModelConfig, batches, decoder_type: DecoderType, beam_width=None):
+    """
+    以指定解码器解码全部批次
+    :return: (准确率, 每个样本的解码耗时ms)
+    """
+    decoder_conf = copy.copy(model_conf)
+    decoder_conf.decoder = decoder_type.value
+    decoder_conf.beam_width = beam_width if beam_width else model_conf.beam_width
+    graph = tf.Graph()
+    with graph.as_default():
+        logits = tf.compat.v1.placeholder(tf.float32, [None, None, model_conf.category_num + 2])
+        seq_len = tf.compat.v1.placeholder(tf.int32, [None])
+        dense_decoded = Decoder(decoder_conf).ctc(logits, seq_len)
+    checker = validation.Validation(model_conf)
+    matched, cost_time, samples = 0, 0., 0
+    with tf.compat.v1.Session(graph=graph) as sess:
+        # 预热
+        sess.run(dense_decoded, feed_dict={logits: batches[0][0], seq_len: batches[0][1]})
+        for batch_logits, batch_seq_len, label_batch in batches:
+            start_time = time.perf_counter()
+            decoded = sess.run(dense_decoded, feed_dict={logits: batch_logits, seq_len: batch_seq_len})
+            cost_time += time.perf_counter() - start_time
+            matched += int(checker.match(label_batch, decoded)[0].sum())
+            samples += len(label_batch)
+    return matched / max(samples, 1), cost_time * 1000 / max(samples, 1)
+
+
+def main(argv):
+    tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.ERROR)
+    model_conf = ModelConfig(project_name=argv[1])
+    if model_conf.loss_func != LossFunction.CTC:
+        print("Beam search decoding only applies to the CTC loss.")
+        return
+    beam_widths = [int(i) for i in argv[2].split(',')] if len(argv) > 2 else [1, 2, 4, 8, 16, 32]
+    batches = compute_logits(model_conf)
+    print("Samples: {}, MaxLabelNum: {}, DecodeCharset: {}".format(
+        sum([len(batch[2]) for batch in batches]), model_conf.max_label_num, model_conf.decode_charset
+    ))
+    greedy_accuracy, greedy_latency = run(model_conf, batches, DecoderType.CTC)
+    print("{:>12} {:>10} {:>10} {:>14} {:>14}".format(
+        "decoder", "accuracy", "gain", "latency(ms)", "added(ms)"
+    ))
+    print("{:>12} {:>10.4f} {:>10} {:>14.4f} {:>14}".format("greedy", greedy_accuracy, "-", greedy_latency, "-"))
+    for beam_width in beam_widths:
+        accuracy, latency = run(model_conf, batches, DecoderType.BeamSearch, beam_width)
+        print("{:>12} {:>10.4f} {:>+10.4f} {:>14.4f} {:>+14.4f}".format(
+            "beam={}".format(beam_width), accuracy, accuracy - greedy_accuracy, latency, latency - greedy_latency
+        ))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
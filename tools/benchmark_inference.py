@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+"""
+推理开销基准：以随机权重构建各CNNNetwork与RecurrentNetwork组合的预测图，在CPU上测量
+各批次大小的p50/p95/p99延迟与吞吐、峰值内存和冻结后的计算图大小，结果写入工程out目录的JSON/CSV报告
+每个组合在独立的子进程中运行，峰值内存互不影响
+用法: python tools/benchmark_inference.py <project_name> [resize: 150,50] [batch_sizes: 1,8,32,64,128,256] [steps]
+"""
+import os
+import sys
+import csv
+import json
+import time
+import itertools
+import multiprocessing
+import numpy as np
+
+# 仅测量CPU推理
+os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+import tensorflow as tf
+from tensorflow.python.framework.graph_util import convert_variables_to_constants
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import core
+from config import ModelConfig
+from constants import RunMode, CNNNetwork, RecurrentNetwork
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+CNN_NETWORKS = [CNNNetwork.CNN5, CNNNetwork.CNNX, CNNNetwork.ResNetTiny, CNNNetwork.ResNet50, CNNNetwork.DenseNet]
+RECURRENT_NETWORKS = [
+    RecurrentNetwork.NoRecurrent, RecurrentNetwork.LSTM, RecurrentNetwork.GRU,
+    RecurrentNetwork.BiLSTM, RecurrentNetwork.BiGRU
+]
+CSV_FIELDS = [
+    'cnn', 'recurrent', 'batch_size', 'p50_ms', 'p95_ms', 'p99_ms', 'throughput',
+    'peak_rss_mb', 'graph_bytes', 'graph_nodes', 'params', 'error'
+]
+
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存(MB)，不支持的平台返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux单位为KB，macOS为字节
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def benchmark(project_name, resize, cnn: CNNNetwork, recurrent: RecurrentNetwork, batch_sizes, steps):
+    """
+    单个网络组合的基准，在子进程中执行
+    :return: 每个批次大小一行结果
+    """
+    model_conf = ModelConfig(project_name=project_name)
+    model_conf.resize = resize
+    graph = tf.Graph()
+    with graph.as_default():
+        model = core.NeuralNetwork(model_conf=model_conf, mode=RunMode.Predict, cnn=cnn, recurrent=recurrent)
+        model.build_graph()
+        params = int(sum([np.prod(v.shape.as_list()) for v in tf.compat.v1.trainable_variables()]))
+        sess = tf.compat.v1.Session(graph=graph)
+        tf.keras.backend.set_session(session=sess)
+        sess.run(tf.compat.v1.global_variables_initializer())
+        graph_def = convert_variables_to_constants(sess, graph.as_graph_def(), output_node_names=['dense_decoded'])
+    common = dict(
+        cnn=cnn.value,
+        recurrent=recurrent.value,
+        graph_bytes=graph_def.ByteSize(),
+        graph_nodes=len(graph_def.node),
+        params=params,
+    )
+    width = model_conf.max_resize_width
+    rows = []
+    for batch_size in batch_sizes:
+        inputs = np.random.random_sample(
+            [batch_size, width, model_conf.resize[1], model_conf.image_channel]
+        ).astype(np.float32)
+        feed_dict = {model.inputs: inputs}
+        # 预热
+        for _ in range(3):
+            sess.run(model.dense_decoded, feed_dict=feed_dict)
+        latency = []
+        for _ in range(steps):
+            start = time.perf_counter()
+            sess.run(model.dense_decoded, feed_dict=feed_dict)
+            latency.append((time.perf_counter() - start) * 1000)
+        p50, p95, p99 = np.percentile(latency, [50, 95, 99])
+        rows.append(dict(
+            common,
+            batch_size=batch_size,
+            p50_ms=round(float(p50), 3),
+            p95_ms=round(float(p95), 3),
+            p99_ms=round(float(p99), 3),
+            throughput=round(batch_size * 1000 / float(np.mean(latency)), 2),
+        ))
+    sess.close()
+    for row in rows:
+        row['peak_rss_mb'] = peak_rss_mb()
+    return rows
+
+
+def run_isolated(*args):
+    """在新进程中运行单个组合，构建失败(如输入尺寸过小)时记录错误并继续"""
+    cnn, recurrent = args[2], args[3]
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        try:
+            return pool.apply(benchmark, args)
+        except Exception as e:
+            return [dict(cnn=cnn.value, recurrent=recurrent.value, error=repr(e))]
+
+
+def main(argv):
+    project_name = argv[1]
+    model_conf = ModelConfig(project_name=project_name)
+    resize = [int(i) for i in argv[2].split(',')] if len(argv) > 2 else model_conf.resize
+    batch_sizes = [int(i) for i in argv[3].split(',')] if len(argv) > 3 else [1, 8, 32, 64, 128, 256]
+    steps = int(argv[4]) if len(argv) > 4 else 30
+
+    report = []
+    print("{:>10} {:>12} {:>6} {:>10} {:>10} {:>10} {:>12} {:>10} {:>10}".format(
+        "cnn", "recurrent", "batch", "p50(ms)", "p95(ms)", "p99(ms)", "samples/sec", "rss(MB)", "graph(MB)"
+    ))
+    for cnn, recurrent in itertools.product(CNN_NETWORKS, RECURRENT_NETWORKS):
+        rows = run_isolated(project_name, resize, cnn, recurrent, batch_sizes, steps)
+        for row in rows:
+            if row.get('error'):
+                print("{:>10} {:>12} {}".format(row['cnn'], row['recurrent'], row['error']))
+                continue
+            print("{:>10} {:>12} {:>6} {:>10.3f} {:>10.3f} {:>10.3f} {:>12.2f} {:>10} {:>10.2f}".format(
+                row['cnn'], row['recurrent'], row['batch_size'], row['p50_ms'], row['p95_ms'], row['p99_ms'],
+                row['throughput'], "{:.1f}".format(row['peak_rss_mb']) if row['peak_rss_mb'] else '-',
+                row['graph_bytes'] / 1024 / 1024
+            ))
+        report.extend(rows)
+
+    report_path = os.path.join(model_conf.output_path, 'benchmark_inference')
+    with open(report_path + '.json', 'w', encoding='utf8') as f:
+        json.dump(dict(resize=resize, batch_sizes=batch_sizes, steps=steps, results=report), f, indent=2)
+    with open(report_path + '.csv', 'w', encoding='utf8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        writer.writerows(report)
+    print("Report: {}.json, {}.csv".format(report_path, report_path))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
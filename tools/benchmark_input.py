@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+"""
+训练输入方式的吞吐基准：以随机批次对比feed_dict、tf.data迭代器与StagingArea三种方式的steps/sec
+用法: python tools/benchmark_input.py <project_name> [steps]
+"""
+import os
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import core
+import utils.sparse
+from config import ModelConfig
+from constants import RunMode, LossFunction
+
+
+def random_batches(model_conf: ModelConfig, number=8):
+    """预先生成若干随机批次循环使用，排除数据准备本身的耗时"""
+    width = model_conf.max_resize_width
+    shape = [model_conf.batch_size, width, model_conf.resize[1], model_conf.image_channel]
+    label_len = model_conf.max_label_num
+    batches = []
+    for _ in range(number):
+        if model_conf.uint8_input:
+            inputs = np.random.randint(0, 256, shape).astype(np.uint8)
+        else:
+            inputs = np.random.random_sample(shape).astype(np.float32)
+        lengths = [label_len] * shape[0] if model_conf.loss_func == LossFunction.CrossEntropy \
+            else np.random.randint(1, label_len + 1, shape[0])
+        labels = [np.random.randint(1, model_conf.category_num, n) for n in lengths]
+        batches.append((inputs, utils.sparse.sparse_tuple_from_sequences(labels)))
+    return batches
+
+
+def dataset_tensors(model_conf: ModelConfig, batches):
+    """以tf.data从Python批次生成输入，迭代器输出直接作为网络输入"""
+    def generator():
+        while True:
+            for inputs, (indices, values, dense_shape) in batches:
+                yield inputs, indices, values, dense_shape
+
+    dataset = tf.data.Dataset.from_generator(
+        generator,
+        output_types=(tf.uint8 if model_conf.uint8_input else tf.float32, tf.int64, tf.int32, tf.int64),
+        output_shapes=([None, None, model_conf.resize[1], model_conf.image_channel], [None, 2], [None], [2])
+    ).prefetch(2)
+    inputs, indices, values, dense_shape = tf.compat.v1.data.make_one_shot_iterator(dataset).get_next()
+    return inputs, tf.SparseTensor(indices=indices, values=values, dense_shape=dense_shape)
+
+
+def run(model_conf: ModelConfig, mode, batches, steps):
+    graph = tf.Graph()
+    with graph.as_default():
+        inputs, labels = None, None
+        if mode == 'tf.data':
+            inputs, labels = dataset_tensors(model_conf, batches)
+        model = core.NeuralNetwork(
+            model_conf=model_conf,
+            mode=RunMode.Trains,
+            cnn=model_conf.neu_cnn,
+            recurrent=model_conf.neu_recurrent,
+            inputs=inputs,
+            labels=labels,
+            staging=mode == 'staging',
+        )
+        model.build_graph()
+        fetches = [model.cost, model.train_op]
+        if model.stage_op is not None:
+            fetches.append(model.stage_op)
+
+        def feed(i):
+            if mode == 'tf.data':
+                return None
+            batch_inputs, batch_labels = batches[i % len(batches)]
+            return {model.feed_inputs: batch_inputs, model.feed_labels: batch_labels}
+
+        with tf.compat.v1.Session(graph=graph, config=tf.compat.v1.ConfigProto(allow_soft_placement=True)) as sess:
+            tf.keras.backend.set_session(session=sess)
+            sess.run(tf.global_variables_initializer())
+            if model.stage_op is not None:
+                sess.run(model.stage_op, feed_dict=feed(0))
+            # 预热
+            for i in range(10):
+                sess.run(fetches, feed_dict=feed(i))
+            start = time.time()
+            for i in range(steps):
+                sess.run(fetches, feed_dict=feed(i))
+            return steps / (time.time() - start)
+
+
+def main(argv):
+    model_conf = ModelConfig(project_name=argv[1])
+    steps = int(argv[2]) if len(argv) > 2 else 100
+    batches = random_batches(model_conf)
+    print("Network: {}+{}, BatchSize: {}, Input: {}".format(
+        model_conf.neu_cnn.value, model_conf.neu_recurrent.value, model_conf.batch_size, batches[0][0].dtype
+    ))
+    print("{:>10} {:>12} {:>8}".format("mode", "steps/sec", "speedup"))
+    baseline = None
+    for mode in ['feed_dict', 'tf.data', 'staging']:
+        steps_per_sec = run(model_conf, mode, batches, steps)
+        baseline = baseline if baseline else steps_per_sec
+        print("{:>10} {:>12.2f} {:>7.2f}x".format(mode, steps_per_sec, steps_per_sec / baseline))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+"""数据增广耗时基准：对比逐像素循环的椒盐噪声与向量化实现，以及逐张增广与整批增广"""
+import os
+import sys
+import random
+import timeit
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pretreatment import Pretreatment, preprocessing, batch_preprocessing
+
+AUGMENTATION = dict(
+    binaryzation=[100, 150],
+    median_blur=3,
+    gaussian_blur=5,
+    rotate=20,
+    warp_perspective=True,
+    sp_noise=0.05,
+    light=True,
+)
+
+
+def sp_noise_loop(image, prob):
+    """原逐像素循环实现，作为基准"""
+    size = image.shape
+    output = np.zeros(image.shape, np.uint8)
+    thres = 1 - prob
+    for i in range(size[0]):
+        for j in range(size[1]):
+            rdn = random.random()
+            if rdn < prob:
+                output[i][j] = 0
+            elif rdn > thres:
+                output[i][j] = 255
+            else:
+                output[i][j] = image[i][j]
+    return output
+
+
+def noise_ratio(image, output):
+    return (output == 0).mean(), (output == 255).mean(), (output == image).mean()
+
+
+def batch_main(number=5, shape=(50, 150)):
+    print("{:>6} {:>16} {:>16} {:>8}".format("batch", "per-sample(ms)", "batch(ms)", "speedup"))
+    for batch_size in [64, 128, 256, 512]:
+        batch = np.random.randint(0, 255, (batch_size,) + shape).astype(np.uint8)
+        per_sample = timeit.timeit(
+            lambda: [preprocessing(image, **AUGMENTATION) for image in batch], number=number
+        ) / number * 1000
+        batched = timeit.timeit(lambda: batch_preprocessing(batch, **AUGMENTATION), number=number) / number * 1000
+        print("{:>6} {:>16.3f} {:>16.3f} {:>7.1f}x".format(batch_size, per_sample, batched, per_sample / batched))
+
+
+def main(number=50, prob=0.05):
+    print("{:>10} {:>12} {:>12} {:>8}  {}".format("shape", "loop(ms)", "numpy(ms)", "speedup", "pepper/salt(loop, numpy)"))
+    for shape in [(50, 150), (64, 200), (100, 300), (50, 150, 3)]:
+        image = np.full(shape, 128, dtype=np.uint8)
+        rng = np.random.RandomState(0)
+        loop = timeit.timeit(lambda: sp_noise_loop(image, prob), number=number) / number * 1000
+        vectorized = timeit.timeit(
+            lambda: Pretreatment(image).sp_noise(prob, rng=rng), number=number
+        ) / number * 1000
+        loop_ratio = noise_ratio(image, sp_noise_loop(image, prob))
+        vectorized_ratio = noise_ratio(image, Pretreatment(image).sp_noise(prob, rng=rng))
+        print("{:>10} {:>12.4f} {:>12.4f} {:>7.1f}x  {:.3f}/{:.3f}, {:.3f}/{:.3f}".format(
+            "x".join([str(i) for i in shape]), loop, vectorized, loop / vectorized,
+            loop_ratio[0], loop_ratio[1], vectorized_ratio[0], vectorized_ratio[1]
+        ))
+    # 相同种子得到相同的增广结果
+    image = np.full((50, 150), 128, dtype=np.uint8)
+    assert np.array_equal(Pretreatment(image).sp_noise(prob, rng=7), Pretreatment(image).sp_noise(prob, rng=7))
+
+
+if __name__ == '__main__':
+    main()
+    batch_main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+"""稀疏标签构建的微基准：对比逐样本循环实现与向量化实现"""
+import os
+import sys
+import random
+import timeit
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.sparse import sparse_tuple_from_sequences, sparse_tuple_from_dense
+
+
+def sparse_tuple_from_sequences_loop(sequences, dtype=np.int32):
+    """原逐样本循环实现，作为基准"""
+    indices = []
+    values = []
+    for n, seq in enumerate(sequences):
+        indices.extend(zip([n] * len(seq), range(0, len(seq), 1)))
+        values.extend(seq)
+
+    indices = np.asarray(indices, dtype=np.int64)
+    values = np.asarray(values, dtype=dtype)
+    shape = np.asarray([len(sequences), np.asarray(indices).max(0)[1] + 1], dtype=np.int64)
+    return indices, values, shape
+
+
+def random_labels(batch_size, min_len=4, max_len=8, category_num=63):
+    return [[random.randint(1, category_num - 1) for _ in range(random.randint(min_len, max_len))]
+            for _ in range(batch_size)]
+
+
+def pad(labels, max_len=8):
+    dense = np.full((len(labels), max_len), -1, dtype=np.int32)
+    for i, label in enumerate(labels):
+        dense[i, :len(label)] = label
+    return dense
+
+
+def main(number=200):
+    print("{:>6} {:>12} {:>12} {:>12} {:>8}".format("batch", "loop(ms)", "lists(ms)", "dense(ms)", "speedup"))
+    for batch_size in [64, 128, 256, 512, 1024]:
+        labels = random_labels(batch_size)
+        dense = pad(labels)
+        expected = sparse_tuple_from_sequences_loop(labels)
+        for result in [sparse_tuple_from_sequences(labels), sparse_tuple_from_dense(dense)]:
+            assert all(np.array_equal(a, b) for a, b in zip(expected, result))
+        loop = timeit.timeit(lambda: sparse_tuple_from_sequences_loop(labels), number=number) / number * 1000
+        lists = timeit.timeit(lambda: sparse_tuple_from_sequences(labels), number=number) / number * 1000
+        flat = timeit.timeit(lambda: sparse_tuple_from_dense(dense), number=number) / number * 1000
+        print("{:>6} {:>12.4f} {:>12.4f} {:>12.4f} {:>7.1f}x".format(batch_size, loop, lists, flat, loop / flat))
+
+
+if __name__ == '__main__':
+    main()
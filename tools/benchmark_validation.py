@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+"""准确率计算的微基准：对比逐样本列表推导的比较与补齐矩阵上的向量化比较"""
+import os
+import sys
+import types
+import random
+import timeit
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from validation import Validation
+
+CATEGORY_NUM = 63
+
+
+def accuracy_loop(original_seq, decoded_seq, category_num=CATEGORY_NUM):
+    """原逐样本实现的比较部分(不含日志)，作为基准"""
+    decoded_seq = decoded_seq.tolist()
+    ignore_value = [-1, category_num, 0]
+    count = 0
+    for i, origin_label in enumerate(original_seq):
+        decoded_label = decoded_seq[i]
+        processed_decoded_label = [j for j in decoded_label if j not in ignore_value]
+        processed_origin_label = [j for j in origin_label if j not in ignore_value]
+        if processed_origin_label == processed_decoded_label:
+            count += 1
+    return count * 1.0 / len(original_seq)
+
+
+def random_batch(batch_size, min_len=4, max_len=8, time_steps=24, error_rate=0.3):
+    """随机标签与模拟的CTC贪心解码输出：标签字符间随机插入空白，部分样本带错误字符"""
+    labels, decoded = [], np.full((batch_size, time_steps), CATEGORY_NUM, dtype=np.int64)
+    for i in range(batch_size):
+        label = [random.randint(1, CATEGORY_NUM - 1) for _ in range(random.randint(min_len, max_len))]
+        labels.append(label)
+        predict = list(label)
+        if random.random() < error_rate:
+            predict[random.randrange(len(predict))] = random.randint(1, CATEGORY_NUM - 1)
+        positions = sorted(random.sample(range(time_steps), len(predict)))
+        decoded[i, positions] = predict
+    return labels, decoded
+
+
+def main(number=5):
+    validation = Validation(types.SimpleNamespace(category_num=CATEGORY_NUM, category=[''] * CATEGORY_NUM))
+    print("{:>6} {:>12} {:>12} {:>8}".format("batch", "loop(ms)", "numpy(ms)", "speedup"))
+    for batch_size in [300, 1000, 5000, 20000]:
+        labels, decoded = random_batch(batch_size)
+        expected = accuracy_loop(labels, decoded)
+        assert abs(expected - validation.match(labels, decoded)[0].mean()) < 1e-9
+        loop = timeit.timeit(lambda: accuracy_loop(labels, decoded), number=number) / number * 1000
+        vectorized = timeit.timeit(lambda: validation.match(labels, decoded), number=number) / number * 1000
+        print("{:>6} {:>12.3f} {:>12.3f} {:>7.1f}x".format(batch_size, loop, vectorized, loop / vectorized))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,19 @@
 #!/usr/bin/env python3
 # -*- coding:utf-8 -*-
 # Author: kerlomz <kerlomz@gmail.com>
+import cv2
+import numpy as np
 import tensorflow as tf
 import core
 import utils
 import utils.data
+import utils.prefetch
 import validation
+import evaluation
+import quantization
 from config import *
-from tf_graph_util import convert_variables_to_constants
+from encoder import Encoder
+from tf_graph_util import convert_variables_to_constants, optimize_for_inference, graph_latency
 from PIL import ImageFile
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
@@ -29,17 +35,22 @@ class Trains:
         """
         编译当前准确率下对应的计算图为pb模型，准确率仅作为模型命名的一部分
         :param acc: 准确率
-        :return:
+        :return: pb模型路径
         """
         input_graph = tf.Graph()
         predict_sess = tf.Session(graph=input_graph)
 
         with predict_sess.graph.as_default():
+            # 字节流或uint8输入的导出模型在图内完成解码、缩放、转置与归一化
+            inputs = None
+            if self.model_conf.export_input != ExportInput.Tensor:
+                _, inputs = Encoder(self.model_conf, RunMode.Predict).export_tensor(self.model_conf.export_input)
             model = core.NeuralNetwork(
                 model_conf=self.model_conf,
                 mode=RunMode.Predict,
                 cnn=self.model_conf.neu_cnn,
-                recurrent=self.model_conf.neu_recurrent
+                recurrent=self.model_conf.neu_recurrent,
+                inputs=inputs
             )
             model.build_graph()
             input_graph_def = predict_sess.graph.as_graph_def()
@@ -53,6 +64,7 @@ class Trains:
                 input_graph_def,
                 output_node_names=['dense_decoded']
             )
+        output_graph_def = self.optimize_graph(output_graph_def)
 
         if not os.path.exists(self.model_conf.compile_model_path):
             os.makedirs(self.model_conf.compile_model_path)
@@ -65,9 +77,46 @@ class Trains:
             gf.write(output_graph_def.SerializeToString())
 
         self.model_conf.output_config(target_model_name="{}_{}".format(self.model_conf.model_name, int(acc * 10000)))
-
-    def achieve_cond(self, acc, cost, epoch):
+        return last_compile_model_path
+
+    def probe_input(self):
+        """与导出模型输入类型一致的单个随机样本"""
+        width, height = self.model_conf.max_resize_width, self.model_conf.resize[1]
+        channel = self.model_conf.image_channel
+        export_input = self.model_conf.export_input
+        if export_input == ExportInput.Bytes:
+            image = np.random.randint(0, 256, [height, width, 3]).astype(np.uint8)
+            return np.array([cv2.imencode('.png', image)[1].tobytes()], dtype=object)
+        if export_input == ExportInput.UInt8:
+            return np.random.randint(0, 256, [1, height, width, channel]).astype(np.uint8)
+        return np.random.random_sample([1, width, height, channel]).astype(np.float32)
+
+    def optimize_graph(self, graph_def):
+        """
+        导出前优化冻结后的计算图：剔除训练节点、常量折叠、BN折叠进卷积权重、去除Identity链，
+        输出优化前后的节点数与单张推理耗时，优化失败或输出不一致时保留原图
+        """
+        feed = {'input:0': self.probe_input()}
+        try:
+            optimized_graph_def = optimize_for_inference(graph_def, ['input'], ['dense_decoded'])
+            before, expected = graph_latency(graph_def, feed, 'dense_decoded:0')
+            after, result = graph_latency(optimized_graph_def, feed, 'dense_decoded:0')
+        except Exception as e:
+            tf.logging.warn('Graph optimization failed, the frozen graph is exported as is: {}'.format(e))
+            return graph_def
+        tf.logging.info('Graph Optimization - Nodes: {} -> {}, Latency: {:.3f} ms -> {:.3f} ms'.format(
+            len(graph_def.node), len(optimized_graph_def.node), before, after
+        ))
+        if not np.array_equal(expected, result):
+            tf.logging.warn('The optimized graph does not reproduce the frozen graph output, it is discarded.')
+            return graph_def
+        return optimized_graph_def
+
+    def achieve_cond(self, acc, cost, epoch, cer=None):
         achieve_accuracy = acc >= self.model_conf.trains_end_acc
+        # 字符错误率可代替准确率作为终止条件，对部分正确的预测也能反映训练进展
+        if self.model_conf.trains_end_cer is not None and cer is not None:
+            achieve_accuracy = achieve_accuracy or cer <= self.model_conf.trains_end_cer
         achieve_cost = cost <= self.model_conf.trains_end_cost
         achieve_epochs = epoch >= self.model_conf.trains_end_epochs
         over_epochs = epoch > 10000
@@ -82,23 +131,32 @@ class Trains:
         """
         # 输出重要的配置参数
         self.model_conf.println()
-        # 定义网络结构
+        tf.compat.v1.logging.info('Loading Trains DataSet...')
+        train_feeder = utils.data.DataIterator(model_conf=self.model_conf, mode=RunMode.Trains)
+        train_feeder.read_sample_from_tfrecords(self.model_conf.trains_path[DatasetType.TFRecords])
+
+        # 定义网络结构，图内输入管道模式下网络直接读取迭代器输出
         model = core.NeuralNetwork(
             model_conf=self.model_conf,
             mode=RunMode.Trains,
             cnn=self.model_conf.neu_cnn,
-            recurrent=self.model_conf.neu_recurrent
+            recurrent=self.model_conf.neu_recurrent,
+            inputs=train_feeder.inputs,
+            labels=train_feeder.sparse_labels,
+            staging=self.model_conf.staging,
         )
         model.build_graph()
 
-        tf.compat.v1.logging.info('Loading Trains DataSet...')
-        train_feeder = utils.data.DataIterator(model_conf=self.model_conf, mode=RunMode.Trains)
-        train_feeder.read_sample_from_tfrecords(self.model_conf.trains_path[DatasetType.TFRecords])
-
         tf.compat.v1.logging.info('Loading Validation DataSet...')
         validation_feeder = utils.data.DataIterator(model_conf=self.model_conf, mode=RunMode.Validation)
         validation_feeder.read_sample_from_tfrecords(self.model_conf.validation_path[DatasetType.TFRecords])
 
+        # 全量验证模式下遍历完整验证集，Async在独立计算图中异步评估
+        validation_mode = self.model_conf.validation_mode
+        evaluator = None
+        if validation_mode != ValidationMode.Batch:
+            evaluator = evaluation.Evaluation(self.model_conf, validation_feeder)
+
         tf.logging.info('Total {} Trains DataSets'.format(train_feeder.size))
         tf.logging.info('Total {} Validation DataSets'.format(validation_feeder.size))
         if validation_feeder.size >= train_feeder.size:
@@ -114,7 +172,8 @@ class Trains:
         num_batches_per_epoch = int(num_train_samples / self.model_conf.batch_size)
         # 会话配置
         sess_config = tf.compat.v1.ConfigProto(
-            # allow_soft_placement=True,
+            # 暂存区默认放在GPU上，无可用GPU时回退到CPU
+            allow_soft_placement=self.model_conf.staging,
             log_device_placement=False,
             gpu_options=tf.compat.v1.GPUOptions(
                 allocator_type='BFC',
@@ -122,11 +181,14 @@ class Trains:
                 per_process_gpu_memory_fraction=self.model_conf.memory_usage)
         )
         accuracy = 0
+        cer = None
         epoch_count = 1
         with tf.compat.v1.Session(config=sess_config) as sess:
             tf.keras.backend.set_session(session=sess)
             init_op = tf.global_variables_initializer()
             sess.run(init_op)
+            train_feeder.initialize(sess)
+            validation_feeder.initialize(sess)
             saver = tf.train.Saver(var_list=tf.global_variables(), max_to_keep=2)
             train_writer = tf.compat.v1.summary.FileWriter('logs', sess.graph)
             # try:
@@ -135,94 +197,167 @@ class Trains:
                 # 加载被中断的训练任务
                 saver.restore(sess, checkpoint_state.model_checkpoint_path)
 
-            tf.logging.info('Start training...')
-
-            # 进入训练任务循环
-            while 1:
+            # 全量与异步评估使用的检查点快照，与训练检查点分开保存
+            snapshot_saver = None
+            if validation_mode in [ValidationMode.Full, ValidationMode.Async]:
+                snapshot_saver = tf.train.Saver(var_list=tf.global_variables(), max_to_keep=1)
+
+            # 后台线程提前生成训练批次，图内输入管道模式下由tf.data预取
+            prefetcher = None
+            try:
+                if not train_feeder.graph_pipeline and self.model_conf.prefetch_depth > 0:
+                    prefetcher = utils.prefetch.BatchPrefetcher(
+                        producer=lambda: train_feeder.generate_batch_by_tfrecords(sess),
+                        depth=self.model_conf.prefetch_depth
+                    ).start()
+
+                def next_feed():
+                    """下一个训练批次的feed，图内输入管道无需feed"""
+                    if train_feeder.graph_pipeline:
+                        return None
+                    if prefetcher:
+                        batch_inputs, batch_labels = prefetcher.get()
+                    else:
+                        batch_inputs, batch_labels = train_feeder.generate_batch_by_tfrecords(sess)
+                    return {
+                        model.feed_inputs: batch_inputs,
+                        model.feed_labels: batch_labels,
+                    }
 
-                start_time = time.time()
+                train_fetches = [model.merged_summary, model.cost, model.global_step, model.train_op, model.seq_len]
+                if model.stage_op is not None:
+                    # 预先放入第一个批次，之后每步计算暂存的批次并放入下一个
+                    sess.run(model.stage_op, feed_dict=next_feed())
+                    train_fetches.append(model.stage_op)
 
-                # 批次循环
-                for cur_batch in range(num_batches_per_epoch):
+                tf.logging.info('Start training...')
 
-                    if self.stop_flag:
-                        break
+                # 进入训练任务循环
+                while 1:
 
-                    batch_time = time.time()
+                    start_time = time.time()
 
-                    trains_batch = train_feeder.generate_batch_by_tfrecords(sess)
+                    # 批次循环
+                    for cur_batch in range(num_batches_per_epoch):
 
-                    batch_inputs, batch_labels = trains_batch
+                        if self.stop_flag:
+                            break
 
-                    feed = {
-                        model.inputs: batch_inputs,
-                        model.labels: batch_labels,
-                    }
+                        batch_time = time.time()
 
-                    summary_str, batch_cost, step, _, seq_len = sess.run(
-                        [model.merged_summary, model.cost, model.global_step, model.train_op, model.seq_len],
-                        feed_dict=feed
-                    )
-                    train_writer.add_summary(summary_str, step)
+                        summary_str, batch_cost, step, _, seq_len = sess.run(
+                            train_fetches,
+                            feed_dict=next_feed()
+                        )[:5]
+                        train_writer.add_summary(summary_str, step)
 
-                    if step % 100 == 0 and step != 0:
-                        tf.logging.info(
-                            'Step: {} Time: {:.3f} sec/batch, Cost = {:.8f}, BatchSize: {}, Shape[1]: {}'.format(
+                        if step % 100 == 0 and step != 0:
+                            log = 'Step: {} Time: {:.3f} sec/batch, Cost = {:.8f}, BatchSize: {}, Shape[1]: {}'.format(
                                 step,
                                 time.time() - batch_time,
                                 batch_cost,
-                                len(batch_inputs),
+                                len(seq_len),
                                 seq_len[0]
                             )
-                        )
-
-                    # 达到保存步数对模型过程进行存储
-                    if step % self.model_conf.trains_save_steps == 0 and step != 0:
-                        saver.save(sess, self.model_conf.save_model, global_step=step)
+                            if prefetcher:
+                                # 饥饿比例高说明输入是瓶颈，队列常满则计算是瓶颈
+                                queue_size, starved, wait = prefetcher.stats()
+                                log += ', Queue: {}/{}, Starved: {:.1%}, Wait: {:.1f} ms/batch'.format(
+                                    queue_size, prefetcher.depth, starved, wait
+                                )
+                            tf.logging.info(log)
+
+                        # 达到保存步数对模型过程进行存储
+                        if step % self.model_conf.trains_save_steps == 0 and step != 0:
+                            saver.save(sess, self.model_conf.save_model, global_step=step)
+
+                        # 进入验证集验证环节
+                        if step % self.model_conf.trains_validation_steps == 0 and step != 0:
+
+                            if validation_mode == ValidationMode.Async:
+                                # 上一次评估未结束时跳过本次，终止条件使用最近一次完成的评估结果
+                                evaluator.start(sess, snapshot_saver, step, epoch_count)
+                                accuracy = evaluator.accuracy
+                                if self.achieve_cond(acc=accuracy, cost=batch_cost, epoch=epoch_count):
+                                    break
+                                continue
+
+                            if validation_mode == ValidationMode.Full:
+                                # 在验证模式的计算图中同步评估快照，训练图中的BN与Dropout处于训练状态
+                                _, accuracy, _ = evaluator.evaluate_snapshot(sess, snapshot_saver, step, epoch_count)
+                                if self.achieve_cond(acc=accuracy, cost=batch_cost, epoch=epoch_count):
+                                    break
+                                continue
+
+                            batch_time = time.time()
+                            validation_batch = validation_feeder.generate_batch_by_tfrecords(sess)
+
+                            test_inputs, test_labels = validation_batch
+                            val_feed = {
+                                model.inputs: test_inputs,
+                                model.labels: test_labels
+                            }
+                            # 字符错误率在图内与解码一同计算
+                            dense_decoded, lr, cer, edit_distance = sess.run(
+                                [model.dense_decoded, model.lrn_rate, model.cer, model.edit_distance],
+                                feed_dict=val_feed
+                            )
+                            # 计算准确率
+                            accuracy = self.validation.accuracy_calculation(
+                                validation_feeder.labels,
+                                dense_decoded,
+                            )
+                            train_writer.add_summary(tf.compat.v1.Summary(value=[
+                                tf.compat.v1.Summary.Value(tag='validation/accuracy', simple_value=accuracy),
+                                tf.compat.v1.Summary.Value(tag='validation/cer', simple_value=cer),
+                                tf.compat.v1.Summary.Value(tag='validation/edit_distance', simple_value=edit_distance),
+                            ]), step)
+                            log = "Epoch: {}, Step: {}, Accuracy = {:.4f}, CER = {:.4f}, Cost = {:.5f}, " \
+                                  "Time = {:.3f} sec/batch, LearningRate: {}"
+                            tf.logging.info(log.format(
+                                epoch_count,
+                                step,
+                                accuracy,
+                                cer,
+                                batch_cost,
+                                time.time() - batch_time,
+                                lr / len(validation_batch),
+                            ))
 
-                    # 进入验证集验证环节
-                    if step % self.model_conf.trains_validation_steps == 0 and step != 0:
+                            # 满足终止条件但尚未完成当前epoch时跳出epoch循环
+                            if self.achieve_cond(acc=accuracy, cost=batch_cost, epoch=epoch_count, cer=cer):
+                                break
 
-                        batch_time = time.time()
-                        validation_batch = validation_feeder.generate_batch_by_tfrecords(sess)
-
-                        test_inputs, test_labels = validation_batch
-                        val_feed = {
-                            model.inputs: test_inputs,
-                            model.labels: test_labels
-                        }
-                        dense_decoded, lr = sess.run(
-                            [model.dense_decoded, model.lrn_rate],
-                            feed_dict=val_feed
-                        )
-                        # 计算准确率
-                        accuracy = self.validation.accuracy_calculation(
-                            validation_feeder.labels,
-                            dense_decoded,
-                        )
-                        log = "Epoch: {}, Step: {}, Accuracy = {:.4f}, Cost = {:.5f}, " \
-                              "Time = {:.3f} sec/batch, LearningRate: {}"
-                        tf.logging.info(log.format(
-                            epoch_count,
-                            step,
-                            accuracy,
-                            batch_cost,
-                            time.time() - batch_time,
-                            lr / len(validation_batch),
+                    # 不定宽输入报告本epoch的padding比例，图内输入管道由图内计数器统计
+                    if train_feeder.variable_width:
+                        tf.logging.info('Epoch: {}, Padding Ratio: {:.2%}'.format(
+                            epoch_count, train_feeder.padding_ratio(sess)
                         ))
 
-                        # 满足终止条件但尚未完成当前epoch时跳出epoch循环
-                        if self.achieve_cond(acc=accuracy, cost=batch_cost, epoch=epoch_count):
-                            break
-
-                # 满足终止条件时，跳出任务循环
-                if self.stop_flag:
-                    break
-                if self.achieve_cond(acc=accuracy, cost=batch_cost, epoch=epoch_count):
-                    self.compile_graph(accuracy)
-                    tf.logging.info('Total Time: {} sec.'.format(time.time() - start_time))
-                    break
-                epoch_count += 1
+                    # 满足终止条件时，跳出任务循环
+                    if self.stop_flag:
+                        break
+                    if self.achieve_cond(acc=accuracy, cost=batch_cost, epoch=epoch_count, cer=cer):
+                        graph_path = self.compile_graph(accuracy)
+                        # 以验证集校准并导出int8模型，报告相对浮点模型的准确率变化
+                        if self.model_conf.quantized_export and self.model_conf.export_input == ExportInput.Tensor:
+                            try:
+                                quantization.Quantization(self.model_conf, validation_feeder).run(graph_path)
+                            except Exception as e:
+                                # 转换失败不影响已导出的浮点模型
+                                tf.logging.warn('Quantization failed for {}/{}, the float graph is kept: {}'.format(
+                                    self.model_conf.neu_cnn.value, self.model_conf.neu_recurrent.value, e
+                                ))
+                        tf.logging.info('Total Time: {} sec.'.format(time.time() - start_time))
+                        break
+                    epoch_count += 1
+            finally:
+                # 训练异常中断时同样停止预取线程并释放进程池与评估会话
+                if prefetcher:
+                    prefetcher.stop()
+                train_feeder.close()
+                if evaluator:
+                    evaluator.close()
 
 
 def main(argv):
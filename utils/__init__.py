@@ -3,4 +3,9 @@
 # Author: kerlomz <kerlomz@gmail.com>
 
 # from . import sparse
-# from . import data
\ No newline at end of file
+# from . import data
+# from . import index
+# from . import tensor
+# from . import prefetch
+# from . import pool
+# from . import bucket
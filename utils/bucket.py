@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+"""不定宽图片按缩放后宽度分桶组批，同一批次内宽度相近，减少padding带来的无效时间步"""
+import random
+
+
+class WidthBucketer:
+    """按宽度区间缓存样本，任一桶凑满一个批次时输出"""
+
+    def __init__(self, batch_size, bucket_width):
+        """
+        :param batch_size: 批次大小
+        :param bucket_width: 每个桶覆盖的宽度区间(像素)，同批次的padding不超过该值
+        """
+        self.batch_size = batch_size
+        self.bucket_width = bucket_width
+        self.buckets = {}
+
+    def add(self, items, widths):
+        """
+        放入样本
+        :param items: 样本(原始字节串或序号)
+        :param widths: 各样本缩放后的宽度
+        """
+        for item, width in zip(items, widths):
+            self.buckets.setdefault(width // self.bucket_width, []).append((item, width))
+
+    def pop(self):
+        """
+        随机取出一个已凑满的桶中的一个批次，避免总是优先输出窄图
+        :return: [(样本, 宽度)]，没有凑满的桶时返回None
+        """
+        ready = [key for key, bucket in self.buckets.items() if len(bucket) >= self.batch_size]
+        if not ready:
+            return None
+        bucket = self.buckets[random.choice(ready)]
+        batch = bucket[:self.batch_size]
+        del bucket[:self.batch_size]
+        return batch
+
+
+class PaddingCounter:
+    """统计不定宽批次的padding比例：1 - 有效宽度之和 / (批次大小 * 批次最大宽度)"""
+
+    def __init__(self):
+        self.valid = 0
+        self.total = 0
+
+    def update(self, widths):
+        widths = list(widths)
+        if widths:
+            self.valid += sum(widths)
+            self.total += len(widths) * max(widths)
+
+    def ratio(self, reset=True):
+        result = 1 - self.valid / self.total if self.total else 0.
+        if reset:
+            self.valid, self.total = 0, 0
+        return result
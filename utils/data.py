@@ -2,10 +2,16 @@
 # -*- coding:utf-8 -*-
 # Author: kerlomz <kerlomz@gmail.com>
 import hashlib
+import itertools
+import numpy as np
 import utils
 import utils.sparse
+import utils.index
+import utils.tensor
+import utils.pool
+import utils.bucket
 import tensorflow as tf
-from constants import RunMode, ModelField, DatasetType, LossFunction
+from constants import RunMode, ModelField, DatasetType, LossFunction, InputPipeline
 from config import ModelConfig, EXCEPT_FORMAT_MAP
 from encoder import Encoder
 
@@ -29,11 +35,26 @@ class DataIterator:
         }
         self.data_dir = self.path_map[mode]
         self.next_element = None
+        self.initializer = None
+        self.label_table = None
+        self.padding_variables = None
+        self.padding_initializer = None
+        self.inputs = None
+        self.sparse_labels = None
         self.image_path = []
         self.label_list = []
         self._label_list = []
         self._size = 0
         self.encoder = Encoder(self.model_conf, self.mode)
+        self.tensor_images = None
+        self.tensor_widths = None
+        self.tensor_labels = []
+        self.tensor_index = None
+        self._permutation = np.zeros(0, dtype=np.int64)
+        self._cursor = 0
+        self.batch_pool = None
+        self.bucketer = None
+        self.padding_counter = utils.bucket.PaddingCounter()
 
     @staticmethod
     def parse_example(serial_example):
@@ -56,15 +77,28 @@ class DataIterator:
         :param path: TFRecords文件路径
         :return:
         """
+        # 样本数取自分片旁的索引文件，缺失时仅扫描一次并持久化
         if isinstance(path, list):
             for p in path:
-                self._size += len([_ for _ in tf.io.tf_record_iterator(p)])
+                self._size += utils.index.record_count(p)
         else:
-            self._size = len([_ for _ in tf.io.tf_record_iterator(path)])
+            self._size = utils.index.record_count(path)
 
         min_after_dequeue = 1000
         batch = self.batch_map[self.mode]
 
+        if self.variable_width and self.model_conf.bucket_width > 0 and not self.graph_pipeline:
+            self.bucketer = utils.bucket.WidthBucketer(batch, self.model_conf.bucket_width)
+
+        if self.graph_pipeline:
+            return self.read_sample_from_graph_pipeline(path, batch, min_after_dequeue)
+
+        if self.tensor_pipeline:
+            return self.read_sample_from_tensor(path)
+
+        if self.memmap_pipeline:
+            return self.read_sample_from_memmap(path)
+
         dataset_train = tf.data.TFRecordDataset(
             filenames=path,
             num_parallel_reads=20
@@ -75,6 +109,233 @@ class DataIterator:
         iterator = tf.compat.v1.data.make_one_shot_iterator(dataset_train)
         self.next_element = iterator.get_next()
 
+        # 训练集的图片批次交由多进程构建
+        workers = self.model_conf.workers
+        if self.mode == RunMode.Trains and workers > 1 and self.model_conf.model_field == ModelField.Image:
+            self.batch_pool = utils.pool.BatchPool(self.model_conf, self.mode, batch, workers)
+
+    def encode_example(self, _input, _label):
+        """tf.data的map阶段：图内完成图片解码/缩放与标签编码，启用UInt8Input时归一化交由网络的第一个操作"""
+        image = self.encoder.image_tensor(_input)
+        if not self.model_conf.uint8_input:
+            image = tf.cast(image, tf.float32) / 255.
+        return image, self.encoder.text_tensor(_label, self.label_table), tf.shape(image)[0]
+
+    def read_sample_from_graph_pipeline(self, path, batch, min_after_dequeue):
+        """
+        构建图内输入管道，解码、缩放、标签编码与稀疏标签构建均在tf.data中并行完成
+        迭代器输出可直接作为网络的inputs/labels，无需feed_dict
+        """
+        if self.model_conf.resize[0] == -1:
+            input_shape = [None, self.model_conf.resize[1], self.model_conf.image_channel]
+        else:
+            input_shape = [self.model_conf.resize[0], self.model_conf.resize[1], self.model_conf.image_channel]
+
+        # 查找表须在map函数之外构建，迭代器捕获该资源，因此使用可初始化的迭代器
+        self.label_table = self.encoder.category_lookup()
+        dataset = tf.data.TFRecordDataset(
+            filenames=path,
+            num_parallel_reads=20
+        ).map(self.parse_example)
+        dataset = dataset.shuffle(min_after_dequeue).repeat()
+        dataset = dataset.map(self.encode_example, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        # 与generate_batch_by_tfrecords中跳过无法解码的样本一致
+        dataset = dataset.apply(tf.data.experimental.ignore_errors())
+
+        if self.model_conf.loss_func == LossFunction.CrossEntropy:
+            dataset = dataset.filter(lambda x, y, w: tf.equal(tf.size(y), self.model_conf.max_label_num))
+
+        # 不定宽图片按当前批次最大宽度padding，标签以-1补齐，同时输出各样本的实际宽度
+        input_dtype = tf.uint8 if self.model_conf.uint8_input else tf.float32
+        padding_values = (
+            tf.constant(0, dtype=input_dtype), tf.constant(-1, dtype=tf.int32), tf.constant(0, dtype=tf.int32)
+        )
+        padded_shapes = (input_shape, [None], [])
+        if self.variable_width and self.model_conf.bucket_width > 0:
+            # 按宽度分桶组批，同批次的padding不超过BucketWidth
+            boundaries = list(range(
+                self.model_conf.bucket_width,
+                self.model_conf.max_resize_width + self.model_conf.bucket_width,
+                self.model_conf.bucket_width
+            ))
+            dataset = dataset.apply(tf.data.experimental.bucket_by_sequence_length(
+                element_length_func=lambda x, y, w: w,
+                bucket_boundaries=boundaries,
+                bucket_batch_sizes=[batch] * (len(boundaries) + 1),
+                padded_shapes=padded_shapes,
+                padding_values=padding_values,
+            ))
+        else:
+            dataset = dataset.padded_batch(
+                batch,
+                padded_shapes=padded_shapes,
+                padding_values=padding_values,
+                drop_remainder=True
+            )
+        dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
+        iterator = tf.compat.v1.data.make_initializable_iterator(dataset)
+        self.initializer = iterator.initializer
+        self.inputs, dense_labels, widths = iterator.get_next()
+        if self.variable_width:
+            self.inputs = self.count_padding(self.inputs, widths)
+        self.next_element = self.inputs, dense_labels
+        self.sparse_labels = self.dense_to_sparse(dense_labels)
+
+    def count_padding(self, inputs, widths):
+        """
+        图内累计有效宽度之和与padding后的宽度之和，每取出一个批次更新一次，由padding_ratio读取
+        计数器为局部变量，不写入检查点
+        """
+        self.padding_variables = [
+            tf.Variable(0, dtype=tf.int64, trainable=False, name=name,
+                        collections=[tf.compat.v1.GraphKeys.LOCAL_VARIABLES])
+            for name in ['padding_valid_width', 'padding_total_width']
+        ]
+        self.padding_initializer = tf.compat.v1.variables_initializer(self.padding_variables)
+        widths = tf.cast(widths, tf.int64)
+        valid, total = self.padding_variables
+        update = [
+            tf.compat.v1.assign_add(valid, tf.reduce_sum(widths)),
+            tf.compat.v1.assign_add(total, tf.size(widths, out_type=tf.int64) * tf.shape(inputs, out_type=tf.int64)[1]),
+        ]
+        with tf.control_dependencies(update):
+            return tf.identity(inputs)
+
+    def padding_ratio(self, sess):
+        """自上次调用以来的padding比例，读取后清零，图内输入管道读取图内计数器"""
+        if self.padding_variables is None:
+            return self.padding_counter.ratio()
+        valid, total = sess.run(self.padding_variables)
+        sess.run(self.padding_initializer)
+        return 1 - valid / total if total else 0.
+
+    def initialize(self, sess):
+        """初始化图内输入管道的标签查找表与迭代器，须在会话初始化变量之后、读取批次之前调用"""
+        if self.initializer is None:
+            return
+        sess.run([self.label_table.initializer, self.initializer])
+        if self.padding_initializer is not None:
+            sess.run(self.padding_initializer)
+
+    @staticmethod
+    def dense_to_sparse(dense_labels, ignore_value=-1):
+        """图内将以ignore_value补齐的密集标签转换为稀疏标签"""
+        indices = tf.where(tf.not_equal(dense_labels, ignore_value))
+        return tf.SparseTensor(
+            indices=indices,
+            values=tf.gather_nd(dense_labels, indices),
+            dense_shape=tf.shape(dense_labels, out_type=tf.int64)
+        )
+
+    def read_sample_from_tensor(self, path):
+        """
+        从预解码的uint8张量分片中读取样本，样本常驻内存，标签只编码一次，按打乱后的序号生成批次
+        :param path: TFRecords文件路径，对应的张量分片不存在时自动生成
+        """
+        images, labels = [], []
+        for p in (path if isinstance(path, list) else [path]):
+            _images, _labels = utils.tensor.load_tensor(p, self.model_conf)
+            images.append(_images)
+            labels.append(_labels)
+        self.tensor_images = np.concatenate(images)
+        self.encode_tensor_labels(np.concatenate(labels))
+
+    def read_sample_from_memmap(self, path):
+        """
+        从内存映射缓存中读取样本，图片不载入进程内存，按打乱后的序号直接从映射中取出批次
+        :param path: TFRecords文件路径，缓存不存在或数据源变化时自动生成
+        """
+        self.tensor_images, widths, labels = utils.tensor.load_memmap(
+            path if isinstance(path, list) else [path], self.model_conf, self.mode
+        )
+        self.tensor_widths = widths if self.model_conf.resize[0] == -1 else None
+        self.encode_tensor_labels(labels)
+
+    def encode_tensor_labels(self, labels):
+        """一次性编码全部标签，过滤无法解码(标签为空)及交叉熵下标签数不符的样本"""
+        self.tensor_labels = [self.encoder.text(label, extracted=True) if label else None for label in labels]
+        using_cross_entropy = self.model_conf.loss_func == LossFunction.CrossEntropy
+        self.tensor_index = np.asarray([
+            i for i, label in enumerate(self.tensor_labels) if label is not None and (
+                not using_cross_entropy or len(label) == self.model_conf.max_label_num
+            )
+        ], dtype=np.int64)
+        if len(self.tensor_index) < len(self.tensor_labels):
+            tf.logging.warn("{} samples that cannot be decoded or with incorrect number of tags "
+                            "are ignored.".format(len(self.tensor_labels) - len(self.tensor_index)))
+        self._size = len(self.tensor_index)
+
+    def next_tensor_index(self):
+        """当前批次在张量分片中的序号，每轮遍历完后重新打乱"""
+        batch = self.batch_map[self.mode]
+        if self._cursor + batch > len(self._permutation):
+            self._permutation = np.random.permutation(self.tensor_index)
+            self._cursor = 0
+        index = self._permutation[self._cursor: self._cursor + batch]
+        self._cursor += batch
+        return index
+
+    def next_bucket_index(self):
+        """启用分桶时，从打乱后的序号中按宽度凑满一个批次"""
+        batch = self.bucketer.pop()
+        while batch is None:
+            index = self.next_tensor_index()
+            self.bucketer.add(index, self.tensor_widths[index])
+            batch = self.bucketer.pop()
+        return np.asarray([i for i, _ in batch], dtype=np.int64)
+
+    def predict_width(self, image_bytes):
+        """读取图片头部预测缩放后的宽度，无法识别的图片返回0，在编码时被跳过"""
+        try:
+            return utils.tensor.resize_width(image_bytes, self.model_conf)
+        except OSError:
+            return 0
+
+    def next_raw_batch(self, sess):
+        """从TFRecords取出一个原始样本批次，不定宽时统计padding比例，启用分桶时按缩放后宽度组批"""
+        if not self.variable_width:
+            return sess.run(self.next_element)
+        batch = self.bucketer.pop() if self.bucketer else None
+        while batch is None:
+            _input, _label = sess.run(self.next_element)
+            widths = [self.predict_width(i) for i in _input]
+            if not self.bucketer:
+                batch = list(zip(zip(_input, _label), widths))
+                break
+            self.bucketer.add(zip(_input, _label), widths)
+            batch = self.bucketer.pop()
+        samples, widths = zip(*batch)
+        self.padding_counter.update(widths)
+        _input, _label = zip(*samples)
+        return list(_input), list(_label)
+
+    @property
+    def memmap_pipeline(self):
+        """是否读取内存映射缓存"""
+        return self.model_conf.input_pipeline == InputPipeline.Memmap
+
+    @property
+    def tensor_pipeline(self):
+        """是否读取预解码的张量分片"""
+        return self.model_conf.input_pipeline == InputPipeline.Tensor
+
+    @property
+    def graph_pipeline(self):
+        """是否启用图内输入管道"""
+        return self.model_conf.input_pipeline == InputPipeline.Graph
+
+    @property
+    def variable_width(self):
+        """是否为不定宽的图片输入"""
+        return self.model_conf.model_field == ModelField.Image and self.model_conf.resize[0] == -1
+
+    @property
+    def batch_encoding(self):
+        """开启BatchEncoding时固定尺寸的图片输入使用批量数据增广，不定宽输入仍逐张处理"""
+        if not self.model_conf.batch_encoding:
+            return False
+        return self.model_conf.model_field == ModelField.Image and self.model_conf.resize[0] != -1
+
     @property
     def size(self):
         """样本数"""
@@ -92,15 +353,80 @@ class DataIterator:
         batch_labels = utils.sparse.sparse_tuple_from_sequences(label_batch)
         return batch_inputs, batch_labels
 
+    def tensor_batch(self, index):
+        """按序号从预解码的张量中取出并编码一个图片批次"""
+        normalize = not self.model_conf.uint8_input
+        if self.tensor_widths is None:
+            return self.encoder.image_batch(self.tensor_images[index], normalize=normalize)
+        # 不定宽时裁剪到当前批次的最大宽度
+        widths = self.tensor_widths[index]
+        return self.encoder.image_batch(self.tensor_images[index][:, :, :widths.max()], widths, normalize=normalize)
+
+    def iter_all(self):
+        """
+        按顺序不重复地遍历完整数据集一次，逐批返回(输入批次, 标签批次)，用于全量评估
+        预解码的输入管道直接按序号读取，其余管道在主机端读取TFRecords并编码，与图内管道的迭代器互不影响
+        """
+        batch = self.batch_map[self.mode]
+        if self.tensor_images is not None:
+            for start in range(0, len(self.tensor_index), batch):
+                index = self.tensor_index[start: start + batch]
+                yield self.tensor_batch(index), [self.tensor_labels[i] for i in index]
+            return
+        paths = self.data_dir if isinstance(self.data_dir, list) else [self.data_dir]
+        records = itertools.chain.from_iterable(utils.tensor.read_records(path) for path in paths)
+        while True:
+            chunk = list(itertools.islice(records, batch))
+            if not chunk:
+                return
+            _input, _label = zip(*chunk)
+            input_batch, label_batch = self.encode_batch(list(_input), list(_label))
+            if label_batch:
+                yield input_batch, label_batch
+
     def generate_batch_by_tfrecords(self, sess):
         """根据TFRecords生成当前批次，输入为当前TensorFlow会话，输出为稀疏型X和Y"""
-        _input, _label = sess.run(self.next_element)
+        if self.tensor_pipeline or self.memmap_pipeline:
+            # 排序后按序号从映射中读取，尽量顺序访问
+            index = np.sort(self.next_bucket_index() if self.bucketer else self.next_tensor_index())
+            self.label_list = [self.tensor_labels[i] for i in index]
+            if self.tensor_widths is not None:
+                self.padding_counter.update(self.tensor_widths[index])
+            return self.to_sparse(self.tensor_batch(index), self.label_list)
+
+        if self.batch_pool:
+            # 保持每个子进程都有一个批次在构建
+            while not self.batch_pool.full:
+                self.batch_pool.submit(*self.next_raw_batch(sess))
+            input_batch, self.label_list = self.batch_pool.get()
+            return self.to_sparse(input_batch, self.label_list)
+
+        if self.graph_pipeline:
+            _input, _label = sess.run(self.next_element)
+            # 以-1补齐的标签矩阵直接向量化构建稀疏标签，无需逐样本转换为列表
+            self.label_list = _label
+            return _input, utils.sparse.sparse_tuple_from_dense(_label, ignore_value=-1)
+
+        input_batch, self.label_list = self.encode_batch(*self.next_raw_batch(sess))
+        return self.to_sparse(input_batch, self.label_list)
+
+    def encode_batch(self, _input, _label):
+        """
+        编码一个原始样本批次，跳过无法解码及交叉熵下标签数不符的样本
+        :param _input: 图片字节串批次
+        :param _label: 标签字节串批次
+        :return: (输入批次, 标签批次)
+        """
         input_batch = []
         label_batch = []
+        batch_encoding = self.batch_encoding
         for index, (i1, i2) in enumerate(zip(_input, _label)):
             try:
                 if self.model_conf.model_field == ModelField.Image:
-                    input_array = self.encoder.image(i1)
+                    if batch_encoding:
+                        input_array = self.encoder.decode_image(i1)
+                    else:
+                        input_array = self.encoder.image(i1)
                 else:
                     input_array = self.encoder.text(i1)
                 label_array = self.encoder.text(i2, extracted=True)
@@ -120,6 +446,10 @@ class DataIterator:
                     f.write(i1)
                 continue
 
+        # 固定尺寸的图片整批进行向量化数据增广，再缩放与归一化
+        if batch_encoding and input_batch:
+            input_batch = self.encoder.image_batch(input_batch, normalize=not self.model_conf.uint8_input)
+
         # 如果图片尺寸不固定则padding当前批次，使用最大的宽度作为序列最大长度
         if self.model_conf.model_field == ModelField.Image and self.model_conf.resize[0] == -1:
             input_batch = tf.keras.preprocessing.sequence.pad_sequences(
@@ -131,6 +461,10 @@ class DataIterator:
                 value=0
             )
 
-        self.label_list = label_batch
+        return input_batch, label_batch
 
-        return self.to_sparse(input_batch, self.label_list)
+    def close(self):
+        """释放批次构建进程池"""
+        if self.batch_pool:
+            self.batch_pool.close()
+            self.batch_pool = None
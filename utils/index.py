@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+"""TFRecords分片的索引文件，记录每条样本的字节偏移，避免启动时为统计样本数重复读取整个分片"""
+import os
+import struct
+import numpy as np
+import tensorflow as tf
+
+INDEX_SUFFIX = '.index'
+
+# TFRecord单条记录结构: uint64长度 + uint32长度校验 + 数据 + uint32数据校验
+RECORD_HEADER_SIZE = 12
+RECORD_FOOTER_SIZE = 4
+
+
+def index_path(path):
+    """分片对应的索引文件路径"""
+    return "{}{}".format(path, INDEX_SUFFIX)
+
+
+def record_size(serialized):
+    """单条序列化样本写入TFRecords后占用的字节数"""
+    return RECORD_HEADER_SIZE + len(serialized) + RECORD_FOOTER_SIZE
+
+
+def write_index(path, offsets, file_size=None):
+    """
+    写入索引文件，内容为uint64数组：各记录的起始偏移，最后一项为分片文件大小
+    :param path: TFRecords分片路径
+    :param offsets: 各记录的起始字节偏移
+    :param file_size: 分片文件大小，缺省时读取文件大小
+    """
+    file_size = os.path.getsize(path) if file_size is None else file_size
+    with open(index_path(path), "wb") as f:
+        np.save(f, np.asarray(list(offsets) + [file_size], dtype=np.uint64))
+
+
+def read_index(path):
+    """
+    读取索引文件，索引不存在或与分片大小不一致(分片已被重写)时返回None
+    :return: 各记录的起始字节偏移
+    """
+    sidecar = index_path(path)
+    if not os.path.exists(sidecar) or not os.path.exists(path):
+        return None
+    try:
+        with open(sidecar, "rb") as f:
+            index = np.load(f)
+    except (IOError, ValueError):
+        return None
+    if len(index) < 1 or int(index[-1]) != os.path.getsize(path):
+        return None
+    return index[:-1]
+
+
+def scan_offsets(path):
+    """仅读取每条记录的头部并跳过数据部分，扫描得到各记录的起始字节偏移"""
+    offsets = []
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        offset = 0
+        while offset < file_size:
+            f.seek(offset)
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            length, = struct.unpack('<Q', header)
+            offsets.append(offset)
+            offset += RECORD_HEADER_SIZE + length + RECORD_FOOTER_SIZE
+    return np.asarray(offsets, dtype=np.uint64)
+
+
+def load_index(path):
+    """读取分片索引，不存在时扫描一次分片并持久化索引"""
+    offsets = read_index(path)
+    if offsets is not None:
+        return offsets
+    tf.compat.v1.logging.info('Index of {} not found, scanning...'.format(path))
+    offsets = scan_offsets(path)
+    try:
+        write_index(path, offsets.tolist())
+    except IOError as e:
+        tf.compat.v1.logging.warn('Could not save the index of {}: {}'.format(path, e))
+    return offsets
+
+
+def record_count(path):
+    """分片中的样本数"""
+    return len(load_index(path))
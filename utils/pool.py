@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+"""
+多进程批次构建：子进程接收原始样本字节，完成解码、数据增广与归一化，
+图片批次写入预先分配的共享内存缓冲区，仅将形状、类型与编码后的标签通过管道返回，避免pickle传输整批数组
+"""
+import cv2
+import ctypes
+import collections
+import multiprocessing
+import numpy as np
+import utils.data
+from config import ModelConfig
+from constants import RunMode
+
+_FEEDER = None
+_BUFFERS = None
+
+
+def _seed_worker():
+    """fork出的子进程继承父进程的np.random状态，重新以系统熵播种，否则各进程的增广掩码与参数完全相同"""
+    np.random.seed()
+
+
+def _init_worker(model_conf: ModelConfig, mode: RunMode, buffers):
+    """进程池初始化：子进程中创建编码用的数据集迭代器并保存共享缓冲区"""
+    global _FEEDER, _BUFFERS
+    _seed_worker()
+    # 每个子进程单线程运行OpenCV，并行度由进程数决定，同时避免fork后OpenCV线程池挂起
+    cv2.setNumThreads(1)
+    _FEEDER = utils.data.DataIterator(model_conf=model_conf, mode=mode)
+    _BUFFERS = buffers
+
+
+def _build_batch(slot, _input, _label):
+    """
+    子进程任务：编码一个批次并写入共享缓冲区
+    :return: (批次形状, 数据类型, 标签批次, 超出缓冲区时退回pickle传输的批次数组)
+    """
+    input_batch, label_batch = _FEEDER.encode_batch(_input, _label)
+    input_batch = np.asarray(input_batch)
+    # 缓冲区按float32分配，uint8批次占用其四分之一
+    buffer = np.frombuffer(_BUFFERS[slot], dtype=input_batch.dtype)
+    if input_batch.size > buffer.size:
+        return input_batch.shape, input_batch.dtype.str, label_batch, input_batch
+    buffer[:input_batch.size] = input_batch.ravel()
+    return input_batch.shape, input_batch.dtype.str, label_batch, None
+
+
+class BatchPool:
+    """保持与进程数相同的批次在子进程中并行构建，按提交顺序取回"""
+
+    def __init__(self, model_conf: ModelConfig, mode: RunMode, batch_size, workers):
+        """
+        :param model_conf: 工程配置
+        :param mode: 运行模式
+        :param batch_size: 批次大小，用于分配共享缓冲区
+        :param workers: 子进程数
+        """
+        self.workers = workers
+        self.buffers = [
+            multiprocessing.RawArray(ctypes.c_float, batch_size * self.sample_size(model_conf))
+            for _ in range(workers)
+        ]
+        self.free_slots = collections.deque(range(workers))
+        self.pending = collections.deque()
+        self.pool = multiprocessing.Pool(
+            processes=workers, initializer=_init_worker, initargs=(model_conf, mode, self.buffers)
+        )
+
+    @staticmethod
+    def sample_size(model_conf: ModelConfig):
+        """单个样本的最大元素数，不定宽时按配置的原图宽高比留出余量，超出时退回pickle传输"""
+        return model_conf.max_resize_width * model_conf.resize[1] * model_conf.image_channel
+
+    @property
+    def full(self):
+        """是否所有缓冲区都已有批次在构建"""
+        return not self.free_slots
+
+    def submit(self, _input, _label):
+        """提交一个原始样本批次"""
+        slot = self.free_slots.popleft()
+        self.pending.append((slot, self.pool.apply_async(_build_batch, (slot, list(_input), list(_label)))))
+
+    def get(self):
+        """
+        取回最早提交的批次，从共享缓冲区复制后即释放该缓冲区
+        :return: (图片批次, 标签批次)
+        """
+        slot, result = self.pending.popleft()
+        try:
+            shape, dtype, label_batch, input_batch = result.get()
+            if input_batch is None:
+                size = int(np.prod(shape))
+                input_batch = np.frombuffer(self.buffers[slot], dtype=dtype, count=size).reshape(shape).copy()
+        finally:
+            self.free_slots.append(slot)
+        return input_batch, label_batch
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+"""后台预取训练批次：生产者线程提前生成后续批次，使批次准备与当前训练步并行"""
+import time
+import queue
+import threading
+
+
+class BatchPrefetcher:
+    """
+    有界队列的批次生产者
+    生产者函数中的sess.run、OpenCV与NumPy运算大部分会释放GIL，使用线程即可与训练步重叠
+    """
+
+    def __init__(self, producer, depth=2):
+        """
+        :param producer: 无参函数，每次调用返回一个批次
+        :param depth: 队列深度，即最多提前准备的批次数
+        """
+        self.producer = producer
+        self.depth = depth
+        self.queue = queue.Queue(maxsize=depth)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='BatchPrefetcher', daemon=True)
+        self.get_count = 0
+        self.starved_count = 0
+        self.wait_time = 0.
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                batch = self.producer()
+            except Exception as e:
+                # 异常交由消费者在get时抛出
+                batch = e
+            while not self.stop_event.is_set():
+                try:
+                    self.queue.put(batch, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if isinstance(batch, Exception):
+                return
+
+    def get(self):
+        """取出下一个批次，队列为空时等待生产者并记为一次饥饿"""
+        starved = self.queue.empty()
+        wait_start = time.time()
+        batch = self.queue.get()
+        self.wait_time += time.time() - wait_start
+        self.get_count += 1
+        self.starved_count += int(starved)
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
+
+    def stats(self, reset=True):
+        """
+        自上次统计以来的队列状态
+        :return: (当前队列长度, 饥饿比例, 平均等待毫秒数)
+        """
+        count = max(self.get_count, 1)
+        result = self.queue.qsize(), self.starved_count / count, self.wait_time / count * 1000
+        if reset:
+            self.get_count, self.starved_count, self.wait_time = 0, 0, 0.
+        return result
+
+    def stop(self):
+        self.stop_event.set()
+        # 清空队列，唤醒可能阻塞在put上的生产者
+        while not self.queue.empty():
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.thread.join(timeout=5)
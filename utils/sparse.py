@@ -1,18 +1,39 @@
 #!/usr/bin/env python3
 # -*- coding:utf-8 -*-
 # Author: kerlomz <kerlomz@gmail.com>
+import itertools
 import numpy as np
 
 
+def sparse_tuple_from_lengths(values, lengths, dtype=np.int32):
+    """
+    根据展平后的标签值与每个样本的标签长度构建稀疏序列
+    :param values: 所有样本标签按顺序展平后的一维数组
+    :param lengths: 每个样本的标签长度
+    :return: indices, values, shape
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    batch_size = len(lengths)
+    total = int(lengths.sum())
+    rows = np.repeat(np.arange(batch_size, dtype=np.int64), lengths)
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    indices = np.empty((total, 2), dtype=np.int64)
+    indices[:, 0] = rows
+    indices[:, 1] = np.arange(total, dtype=np.int64) - starts
+    values = np.asarray(values, dtype=dtype).reshape(-1)
+    shape = np.asarray([batch_size, lengths.max() if batch_size else 0], dtype=np.int64)
+    return indices, values, shape
+
+
 def sparse_tuple_from_sequences(sequences, dtype=np.int32):
     """密集序列转稀疏序列"""
-    indices = []
-    values = []
-    for n, seq in enumerate(sequences):
-        indices.extend(zip([n] * len(seq), range(0, len(seq), 1)))
-        values.extend(seq)
+    lengths = np.fromiter((len(seq) for seq in sequences), dtype=np.int64, count=len(sequences))
+    values = np.fromiter(itertools.chain.from_iterable(sequences), dtype=dtype, count=int(lengths.sum()))
+    return sparse_tuple_from_lengths(values, lengths, dtype=dtype)
 
-    indices = np.asarray(indices, dtype=np.int64)
-    values = np.asarray(values, dtype=dtype)
-    shape = np.asarray([len(sequences), np.asarray(indices).max(0)[1] + 1], dtype=np.int64)
-    return indices, values, shape
+
+def sparse_tuple_from_dense(dense, ignore_value=-1, dtype=np.int32):
+    """以ignore_value补齐的密集标签矩阵转稀疏序列"""
+    dense = np.asarray(dense)
+    mask = dense != ignore_value
+    return sparse_tuple_from_lengths(dense[mask], mask.sum(axis=1), dtype=dtype)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+"""
+预解码的张量分片：将TFRecords分片中的图片一次性解码并缩放为uint8张量，
+训练时直接按序号读取，每个epoch不再重复解码图片
+分片布局：<分片>.images.npy [N, H, W(, C)] uint8，<分片>.labels.npy [N] 定长字节串，
+<分片>.meta.json 记录生成时TFRecords分片的大小与修改时间及尺寸配置
+内存映射缓存：同一运行模式的全部分片解码后合并为 dataset/<Mode>.cache.* 一组文件，
+以numpy.memmap只读映射，多个训练进程与验证集共享系统页缓存，不定宽图片以0补齐到最大宽度
+"""
+import os
+import io
+import json
+import PIL.Image
+import numpy as np
+import tensorflow as tf
+from tqdm import tqdm
+import utils.index
+from constants import RunMode
+from config import ModelConfig
+from encoder import Encoder
+
+IMAGES_SUFFIX = '.images.npy'
+LABELS_SUFFIX = '.labels.npy'
+WIDTHS_SUFFIX = '.widths.npy'
+META_SUFFIX = '.meta.json'
+
+
+def tensor_paths(path):
+    """TFRecords分片对应的图片张量与标签文件路径"""
+    return "{}{}".format(path, IMAGES_SUFFIX), "{}{}".format(path, LABELS_SUFFIX)
+
+
+def tensor_meta(path, model_conf: ModelConfig):
+    """张量分片对应的数据源与尺寸配置，任一变化时需重新生成分片，与memmap_meta一致"""
+    return {
+        'source': [path, os.path.getsize(path), int(os.path.getmtime(path))],
+        'resize': model_conf.resize,
+        'channel': model_conf.image_channel,
+    }
+
+
+def image_shape(model_conf: ModelConfig):
+    """单张图片在张量分片中的形状 [H, W(, C)]"""
+    shape = [model_conf.resize[1], model_conf.resize[0]]
+    return shape if model_conf.image_channel == 1 else shape + [model_conf.image_channel]
+
+
+def tensor_exists(path, model_conf: ModelConfig):
+    """张量分片存在，且TFRecords分片未被重新打包、Resize/ImageChannel未变化"""
+    images_path, labels_path = tensor_paths(path)
+    meta_path = "{}{}".format(path, META_SUFFIX)
+    for p in [images_path, labels_path, meta_path]:
+        if not os.path.exists(p):
+            return False
+    with open(meta_path, "r", encoding="utf8") as f:
+        return json.load(f) == tensor_meta(path, model_conf)
+
+
+def read_records(path):
+    """逐条读取TFRecords分片中的 (图片字节流, 标签字节串)"""
+    for record in tf.io.tf_record_iterator(path):
+        feature = tf.train.Example.FromString(record).features.feature
+        yield feature['input'].bytes_list.value[0], feature['label'].bytes_list.value[0]
+
+
+def write_tensor(path, model_conf: ModelConfig):
+    """
+    将TFRecords分片解码缩放后写为张量分片，无法解码的样本被跳过
+    :param path: TFRecords分片路径
+    :param model_conf: 工程配置，Resize需为固定尺寸
+    """
+    if model_conf.resize[0] == -1:
+        raise ValueError('Tensor shards require a fixed Resize, got {}.'.format(model_conf.resize))
+    encoder = Encoder(model_conf, RunMode.Validation)
+    images_path, labels_path = tensor_paths(path)
+    size = utils.index.record_count(path)
+    images = np.lib.format.open_memmap(
+        images_path, mode='w+', dtype=np.uint8, shape=tuple([size] + image_shape(model_conf))
+    )
+    labels = []
+    pbar = tqdm(read_records(path), total=size)
+    for image_bytes, label in pbar:
+        try:
+            images[len(labels)] = encoder.image(image_bytes, raw=True)
+        except OSError:
+            continue
+        labels.append(label)
+        pbar.set_description('[Processing tensor] [{}]'.format(images_path))
+    images.flush()
+    del images
+    if len(labels) < size:
+        valid = np.load(images_path, mmap_mode='r')[:len(labels)]
+        np.save(images_path + '.tmp.npy', valid)
+        del valid
+        os.replace(images_path + '.tmp.npy', images_path)
+    np.save(labels_path, np.asarray(labels, dtype=np.bytes_))
+    # 最后写入元数据，中断的转换不会被误认为有效分片
+    with open("{}{}".format(path, META_SUFFIX), "w", encoding="utf8") as f:
+        json.dump(tensor_meta(path, model_conf), f)
+
+
+def load_tensor(path, model_conf: ModelConfig):
+    """
+    读取张量分片，分片不存在、数据源变化或尺寸与配置不一致时先从TFRecords生成
+    :return: (图片张量 [N, H, W(, C)] uint8, 标签字节串数组 [N])
+    """
+    if not tensor_exists(path, model_conf):
+        tf.compat.v1.logging.info('Tensor shard of {} not found, converting...'.format(path))
+        write_tensor(path, model_conf)
+    images_path, labels_path = tensor_paths(path)
+    return np.load(images_path), np.load(labels_path)
+
+
+def memmap_prefix(model_conf: ModelConfig, mode: RunMode):
+    """内存映射缓存文件的路径前缀"""
+    return os.path.join(model_conf.dataset_root_path, "{}.cache".format(mode.value)).replace("\\", "/")
+
+
+def memmap_meta(paths, model_conf: ModelConfig):
+    """缓存对应的数据源与尺寸配置，任一变化时需重新生成缓存"""
+    return {
+        'sources': [[p, os.path.getsize(p), int(os.path.getmtime(p))] for p in paths],
+        'resize': model_conf.resize,
+        'channel': model_conf.image_channel,
+    }
+
+
+def memmap_exists(paths, model_conf: ModelConfig, mode: RunMode):
+    prefix = memmap_prefix(model_conf, mode)
+    for suffix in [IMAGES_SUFFIX, LABELS_SUFFIX, WIDTHS_SUFFIX, META_SUFFIX]:
+        if not os.path.exists(prefix + suffix):
+            return False
+    with open(prefix + META_SUFFIX, "r", encoding="utf8") as f:
+        return json.load(f) == memmap_meta(paths, model_conf)
+
+
+def resize_width(image_bytes, model_conf: ModelConfig):
+    """只读取图片头部，计算按比例缩放后的宽度，与Encoder.image一致"""
+    if model_conf.resize[0] != -1:
+        return model_conf.resize[0]
+    width, height = PIL.Image.open(io.BytesIO(image_bytes)).size
+    return int(model_conf.resize[1] / height * width)
+
+
+def write_memmap(paths, model_conf: ModelConfig, mode: RunMode):
+    """
+    将同一运行模式的全部TFRecords分片解码后写入一组内存映射缓存文件
+    不定宽时先读取图片头部得到各样本缩放后的宽度，再以最大宽度分配空间
+    """
+    encoder = Encoder(model_conf, RunMode.Validation)
+    prefix = memmap_prefix(model_conf, mode)
+    widths = []
+    for path in paths:
+        for image_bytes, _ in tqdm(read_records(path), total=utils.index.record_count(path)):
+            try:
+                widths.append(resize_width(image_bytes, model_conf))
+            except OSError:
+                widths.append(0)
+    shape = [len(widths), model_conf.resize[1], max(widths + [1])]
+    shape = shape if model_conf.image_channel == 1 else shape + [model_conf.image_channel]
+    images = np.lib.format.open_memmap(prefix + IMAGES_SUFFIX, mode='w+', dtype=np.uint8, shape=tuple(shape))
+    labels = []
+    index = 0
+    for path in paths:
+        pbar = tqdm(read_records(path), total=utils.index.record_count(path))
+        for image_bytes, label in pbar:
+            width = widths[index]
+            if width:
+                try:
+                    images[index, :, :width] = encoder.image(image_bytes, raw=True)
+                except OSError:
+                    widths[index] = width = 0
+            # 无法解码的样本标签置空，读取时被过滤
+            labels.append(label if width else b'')
+            index += 1
+            pbar.set_description('[Processing memmap] [{}]'.format(prefix))
+    images.flush()
+    del images
+    np.save(prefix + LABELS_SUFFIX, np.asarray(labels, dtype=np.bytes_))
+    np.save(prefix + WIDTHS_SUFFIX, np.asarray(widths, dtype=np.int32))
+    with open(prefix + META_SUFFIX, "w", encoding="utf8") as f:
+        json.dump(memmap_meta(paths, model_conf), f)
+
+
+def load_memmap(paths, model_conf: ModelConfig, mode: RunMode):
+    """
+    只读映射内存映射缓存，缓存不存在或数据源变化时先生成
+    :return: (图片映射 [N, H, maxW(, C)] uint8, 缩放后宽度 [N], 标签字节串数组 [N])
+    """
+    if not memmap_exists(paths, model_conf, mode):
+        tf.compat.v1.logging.info('Memmap cache of {} not found, converting...'.format(mode.value))
+        write_memmap(paths, model_conf, mode)
+    prefix = memmap_prefix(model_conf, mode)
+    images = np.load(prefix + IMAGES_SUFFIX, mmap_mode='r')
+    return images, np.load(prefix + WIDTHS_SUFFIX), np.load(prefix + LABELS_SUFFIX)
@@ -2,6 +2,7 @@
 # -*- coding:utf-8 -*-
 # Author: kerlomz <kerlomz@gmail.com>
 import json
+import itertools
 import numpy as np
 import tensorflow as tf
 from config import ModelConfig
@@ -17,17 +18,74 @@ class Validation(object):
         self.category_num = self.model.category_num
         self.category = self.model.category
 
-    def accuracy_calculation(self, original_seq, decoded_seq):
+    @staticmethod
+    def dense_labels(sequences) -> np.ndarray:
+        """标签批次转换为以-1补齐的int64矩阵，已补齐的矩阵直接返回"""
+        if isinstance(sequences, np.ndarray) and sequences.ndim == 2:
+            return sequences.astype(np.int64)
+        lengths = np.fromiter((len(seq) for seq in sequences), dtype=np.int64, count=len(sequences))
+        if len(sequences) and isinstance(sequences[0], np.ndarray):
+            values = np.concatenate(sequences).astype(np.int64)
+        else:
+            values = np.fromiter(itertools.chain.from_iterable(sequences), dtype=np.int64, count=int(lengths.sum()))
+        dense = np.full((len(sequences), max(lengths.max(initial=0), 1)), -1, dtype=np.int64)
+        dense[np.arange(dense.shape[1])[np.newaxis, :] < lengths[:, np.newaxis]] = values
+        return dense
+
+    def compact(self, dense) -> np.ndarray:
+        """去除忽略值(-1, category_num, 0)后左对齐，空位以-1填充"""
+        keep = (dense != -1) & (dense != self.category_num) & (dense != 0)
+        index = np.flatnonzero(keep)
+        rows = index // dense.shape[1]
+        counts = np.bincount(rows, minlength=len(dense))
+        # 每个保留值在所在行中的新位置 = 全局序号 - 所在行之前的保留值总数
+        position = np.arange(len(index)) - (np.cumsum(counts) - counts)[rows]
+        compacted = np.full((len(dense), max(int(counts.max(initial=0)), 1)), -1, dtype=np.int64)
+        compacted[rows, position] = dense.ravel()[index]
+        return compacted
+
+    def match(self, original_seq, decoded_seq):
+        """
+        向量化比较标签与预测结果
+        :param original_seq: 标签批次(序列列表或以-1补齐的矩阵)
+        :param decoded_seq: dense_decoded输出的预测矩阵
+        :return: (各样本是否完全正确 bool[N], 标签矩阵 [N, L], 预测矩阵 [N, L])，矩阵均已去除忽略值并左对齐
+        """
+        labels = self.compact(self.dense_labels(original_seq))
+        decoded = np.asarray(decoded_seq, dtype=np.int64)
+        decoded = self.compact(decoded.reshape(len(decoded), -1))
+        width = max(labels.shape[1], decoded.shape[1])
+        labels = np.pad(labels, ((0, 0), (0, width - labels.shape[1])), constant_values=-1)
+        decoded = np.pad(decoded, ((0, 0), (0, width - decoded.shape[1])), constant_values=-1)
+        return (labels == decoded).all(axis=1), labels, decoded
+
+    @staticmethod
+    def position_confusion(labels, decoded) -> np.ndarray:
+        """
+        按字符位置统计预测情况，输入为match返回的左对齐矩阵
+        :return: int64 [L, 4]，各位置的 正确、替换(预测为其他字符)、缺失(少预测)、多余(多预测) 计数
         """
-        准确率计算函数
+        label_valid = labels != -1
+        decoded_valid = decoded != -1
+        return np.stack([
+            (label_valid & (labels == decoded)).sum(axis=0),
+            (label_valid & decoded_valid & (labels != decoded)).sum(axis=0),
+            (label_valid & ~decoded_valid).sum(axis=0),
+            (~label_valid & decoded_valid).sum(axis=0),
+        ], axis=1)
+
+    def readable(self, seq) -> str:
+        """日志用：类别序号转换为字符，category_num显示为-，忽略-1"""
+        return "".join([self.category[_] if _ != self.category_num else '-' for _ in seq if _ != -1])
+
+    def accuracy_calculation(self, original_seq, decoded_seq, return_confusion=False):
+        """
+        准确率计算函数，对补齐后的标签矩阵与预测矩阵整批向量化比较
         :param original_seq: 密集数组-Y标签
         :param decoded_seq: 密集数组-预测标签
-        :return:
+        :param return_confusion: 为True时同时返回各字符位置的统计，见position_confusion
+        :return: 准确率，return_confusion为True时为(准确率, 位置统计)
         """
-        if isinstance(decoded_seq, np.ndarray):
-            decoded_seq = decoded_seq.tolist()
-
-        ignore_value = [-1, self.category_num, 0]
         original_seq_len = len(original_seq)
         decoded_seq_len = len(decoded_seq)
 
@@ -38,39 +96,37 @@ class Validation(object):
                 original_seq_len,
                 decoded_seq_len
             ))
-            return 0
-        count = 0
-
-        # Here is for debugging, positioning error source use
-        error_sample = []
-        for i, origin_label in enumerate(original_seq):
+            return (0, None) if return_confusion else 0
 
-            decoded_label = decoded_seq[i]
-            if isinstance(decoded_label, int):
-                decoded_label = [decoded_label]
-            processed_decoded_label = [j for j in decoded_label if j not in ignore_value]
-            processed_origin_label = [j for j in origin_label if j not in ignore_value]
+        matched, labels, decoded = self.match(original_seq, decoded_seq)
+        accuracy = float(matched.mean()) if len(matched) else 0.
 
-            if i < 5:
+        # Here is for debugging, positioning error source use
+        # 仅在对应日志级别开启时才格式化样本
+        if tf.compat.v1.logging.get_verbosity() <= tf.compat.v1.logging.INFO:
+            decoded_seq = np.asarray(decoded_seq).reshape(decoded_seq_len, -1)
+            for i in range(min(5, original_seq_len)):
+                origin_label, decoded_label = np.asarray(original_seq[i]).tolist(), decoded_seq[i].tolist()
                 tf.logging.info(
                     "{} {} {} {} {} --> {} {}".format(
                         i,
-                        len(processed_origin_label),
-                        len(processed_decoded_label),
+                        int((labels[i] != -1).sum()),
+                        int((decoded[i] != -1).sum()),
                         origin_label,
                         decoded_label,
-                        [self.category[_] if _ != self.category_num else '-' for _ in origin_label if _ != -1],
-                        [self.category[_] if _ != self.category_num else '-' for _ in decoded_label if _ != -1]
+                        self.readable(origin_label),
+                        self.readable(decoded_label)
                     )
                 )
-            if processed_origin_label == processed_decoded_label:
-                count += 1
-        # Training is not useful for decoding
-        # Here is for debugging, positioning error source use
-            if processed_origin_label != processed_decoded_label and len(error_sample) < 5:
-                error_sample.append({
-                    "origin": "".join([self.category[_] if _ != self.category_num else '-' for _ in origin_label if _ != -1]),
-                    "decode": "".join([self.category[_] if _ != self.category_num else '-' for _ in decoded_label if _ != -1])
-                })
-        tf.compat.v1.logging.error(json.dumps(error_sample, ensure_ascii=False))
-        return count * 1.0 / len(original_seq)
\ No newline at end of file
+        if tf.compat.v1.logging.get_verbosity() <= tf.compat.v1.logging.ERROR:
+            error_index = np.flatnonzero(~matched)[:5]
+            table = self.model.category_table
+            error_sample = [{"origin": origin, "decode": decode} for origin, decode in zip(
+                table.decode_batch(labels[error_index], self.model.output_split),
+                table.decode_batch(decoded[error_index], self.model.output_split)
+            )]
+            tf.compat.v1.logging.error(json.dumps(error_sample, ensure_ascii=False))
+
+        if return_confusion:
+            return accuracy, self.position_confusion(labels, decoded)
+        return accuracy